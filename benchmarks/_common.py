@@ -0,0 +1,26 @@
+"""Supporto condiviso dei benchmark: DB temporaneo e client MQTT in-process."""
+import contextlib
+import os
+import tempfile
+
+from thermostat.db import database
+from thermostat.db.database import init_db, close_connections
+from thermostat.mqtt.localbroker import LocalBroker, LocalClient
+
+
+@contextlib.contextmanager
+def temp_db(name="bench.db"):
+    # DB SQLite temporaneo con lo schema creato; connessioni chiuse all'uscita
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_NAME = os.path.join(tmp, name)
+        init_db()
+        try:
+            yield database.DB_NAME
+        finally:
+            close_connections()
+
+
+def local_client(broker=None, client_id="controller"):
+    # client con l'interfaccia paho su un LocalBroker (nuovo se non indicato): i comandi
+    # pubblicati dal controller passano dal broker, che li conta in `broker.published`
+    return LocalClient(broker if broker is not None else LocalBroker(), client_id)
@@ -0,0 +1,150 @@
+"""Load test dell'API HTTP: richieste/s e percentili di latenza per tipo di endpoint
+con un mix concorrente di letture (/valves, storici) e scritture (stanze, override).
+
+A fine test riporta l'hit rate della cache delle risposte (`/valves`, `/rooms`,
+dashboard) letto da `thermostat_api_cache_total` su `/metrics`, cumulativo
+dall'avvio dell'API.
+
+Richiede un'API già in esecuzione (es. `uvicorn thermostat.api.app:app`); usa
+solo la libreria standard.
+
+Esecuzione:
+    python -m benchmarks.bench_api_load --url http://127.0.0.1:8000 --concurrency 32 --duration 10
+"""
+import argparse
+import http.client
+import json
+import random
+import threading
+import time
+import urllib.parse
+
+from thermostat.core.latency import LatencyRecorder
+
+
+def _request(conn, method, path, body=None, headers=None):
+    conn.request(method, path, body=body, headers=headers or {})
+    resp = conn.getresponse()
+    resp.read()
+    return resp.status
+
+
+def _seed(host, port, n_valves, n_rooms):
+    # stanze e valvole usate dal mix di richieste
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    for r in range(n_rooms):
+        body = json.dumps({"id": f"room{r}", "name": f"Room {r}", "target_temp": 21.0, "hysteresis": 0.5})
+        _request(conn, "POST", "/rooms", body, {"Content-Type": "application/json"})
+    for v in range(n_valves):
+        body = json.dumps({"id": f"valve{v}", "room_id": f"room{v % n_rooms}"})
+        _request(conn, "POST", "/valves", body, {"Content-Type": "application/json"})
+    conn.close()
+
+
+def _cache_hit_rates(host, port):
+    # {key: (hit, miss)} dalla metrica thermostat_api_cache_total dell'API
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    conn.request("GET", "/metrics")
+    text = conn.getresponse().read().decode()
+    conn.close()
+    counts = {}
+    for line in text.splitlines():
+        if not line.startswith("thermostat_api_cache_total{"):
+            continue
+        labels, value = line[len("thermostat_api_cache_total{"):].split("} ")
+        fields = dict(item.split("=", 1) for item in labels.split(","))
+        key, result = fields["key"].strip('"'), fields["result"].strip('"')
+        hit, miss = counts.get(key, (0, 0))
+        counts[key] = (hit + float(value), miss) if result == "hit" else (hit, miss + float(value))
+    return counts
+
+
+def _pick(rng, n_valves, n_rooms, write_ratio):
+    # (tipo, metodo, path, body, headers)
+    if rng.random() < write_ratio:
+        if rng.random() < 0.5:
+            r = rng.randrange(n_rooms)
+            body = json.dumps({"id": f"room{r}", "name": f"Room {r}", "target_temp": 20 + rng.random() * 3, "hysteresis": 0.5})
+            return "write /rooms", "POST", "/rooms", body, {"Content-Type": "application/json"}
+        v = rng.randrange(n_valves)
+        body = urllib.parse.urlencode({"heating": "true", "duration": 60})
+        headers = {"Content-Type": "application/x-www-form-urlencoded"}
+        return "write override", "POST", f"/web/valves/valve{v}/command", body, headers
+    x = rng.random()
+    if x < 0.4:
+        return "GET /valves", "GET", "/valves", None, None
+    if x < 0.7:
+        return "GET valve history", "GET", f"/valves/valve{rng.randrange(n_valves)}/history?limit=50", None, None
+    return "GET room history", "GET", f"/rooms/room{rng.randrange(n_rooms)}/history?limit=50", None, None
+
+
+def _client(host, port, deadline, args, seed, recorders, errors, lock):
+    rng = random.Random(seed)
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    while time.monotonic() < deadline:
+        kind, method, path, body, headers = _pick(rng, args.valves, args.rooms, args.write_ratio)
+        start = time.perf_counter()
+        try:
+            status = _request(conn, method, path, body, headers)
+        except (OSError, http.client.HTTPException):
+            status = None
+            conn.close()
+            conn = http.client.HTTPConnection(host, port, timeout=30)
+        elapsed = time.perf_counter() - start
+        with lock:
+            if kind not in recorders:
+                recorders[kind] = LatencyRecorder(size=1000000)
+                errors[kind] = 0
+        # 404 sugli storici vuoti è una risposta valida
+        if status is None or status >= 500:
+            errors[kind] += 1
+        else:
+            recorders[kind].record(elapsed)
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--valves", type=int, default=100)
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--write-ratio", type=float, default=0.1)
+    parser.add_argument("--no-seed", action="store_true", help="non creare stanze e valvole prima del test")
+    args = parser.parse_args()
+
+    url = urllib.parse.urlparse(args.url)
+    host, port = url.hostname, url.port or 80
+    if not args.no_seed:
+        _seed(host, port, args.valves, args.rooms)
+
+    recorders, errors, lock = {}, {}, threading.Lock()
+    deadline = time.monotonic() + args.duration
+    start = time.perf_counter()
+    threads = [
+        threading.Thread(target=_client, args=(host, port, deadline, args, i, recorders, errors, lock))
+        for i in range(args.concurrency)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    total = sum(r.count for r in recorders.values())
+    print(f"concurrency={args.concurrency} duration={elapsed:.1f}s requests={total} ({total / elapsed:.0f} req/s)")
+    for kind in sorted(recorders):
+        rec = recorders[kind]
+        pct = rec.percentiles((50, 99))
+        if not pct:
+            continue
+        print(
+            f"{kind:20s} {rec.count / elapsed:8.0f} req/s  p50={pct[50]:7.1f} ms  p99={pct[99]:7.1f} ms  errors={errors[kind]}"
+        )
+    for key, (hit, miss) in sorted(_cache_hit_rates(host, port).items()):
+        print(f"cache {key:14s} hit={hit:.0f} miss={miss:.0f} hit rate={hit / max(hit + miss, 1):.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""Benchmark: latenza pubblicazione temperatura -> elaborazione con il runtime a thread singolo e con il runtime asyncio a shard.
+
+Entrambi i runtime ricevono i messaggi dallo stesso percorso: un publisher
+pubblica su un `LocalBroker` e il client del controller (`LocalClient`) li
+consegna dal proprio thread di rete, che nel runtime a thread elabora inline e
+nel runtime asyncio passa agli shard. La latenza è misurata dal `ts` nel payload
+(istante della pubblicazione) alla fine dell'elaborazione, quindi include
+l'attesa in coda in entrambi i casi.
+
+`--db-delay-ms` simula un commit lento sul percorso caldo per mostrare come una
+singola scrittura lenta blocchi tutte le valvole nel runtime a thread singolo.
+
+Esecuzione:
+    python -m benchmarks.bench_async_runtime --valves 1000 --messages 5000 --db-delay-ms 2
+"""
+import argparse
+import asyncio
+import json
+import threading
+import time
+
+from benchmarks._common import local_client, temp_db
+from thermostat.mqtt.client import MQTTClient
+from thermostat.mqtt.localbroker import LocalBroker
+
+
+def _messages(n_valves, n_messages):
+    for i in range(n_messages):
+        vid = f"valve{i % n_valves}"
+        yield vid, 18.0 + (i % 70) / 10.0
+
+
+def _slow_writer(client, delay):
+    # rallenta il percorso caldo come farebbe un commit sincrono
+    if delay <= 0:
+        return
+    original = client.controller.writer.save_temperature
+
+    def save_temperature(*args, **kwargs):
+        time.sleep(delay)
+        return original(*args, **kwargs)
+
+    client.controller.writer.save_temperature = save_temperature
+
+
+def _controller(broker, args):
+    # MQTTClient su LocalClient; l'evento segnala le sottoscrizioni fatte in on_connect
+    client = MQTTClient(client=local_client(broker))
+    _slow_writer(client, args.db_delay_ms / 1000.0)
+    connected = threading.Event()
+    on_connect = client.client.on_connect
+
+    def ready(*a):
+        on_connect(*a)
+        connected.set()
+
+    client.client.on_connect = ready
+    return client, connected
+
+
+def _feed(broker, client, args):
+    # pubblica tutte le letture e attende che siano state elaborate; ritorna i secondi trascorsi
+    publisher = local_client(broker, "feeder")
+    interval = 1.0 / args.rate if args.rate else 0.0
+    start = time.perf_counter()
+    for i, (vid, temp) in enumerate(_messages(args.valves, args.messages)):
+        if interval:
+            # pubblicazione a ritmo costante (non a raffica)
+            delay = start + i * interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        payload = json.dumps({"value": temp, "ts": time.time()}).encode()
+        publisher.publish(f"home/valves/{vid}/temperature", payload)
+    while client.latency.count < args.messages:
+        time.sleep(0.005)
+    return time.perf_counter() - start
+
+
+def _run_thread(args):
+    broker = LocalBroker()
+    client, connected = _controller(broker, args)
+    client.client.connect()
+    client.client.loop_start()
+    connected.wait(5)
+    elapsed = _feed(broker, client, args)
+    client.client.disconnect()
+    client.client.loop_stop()
+    client.controller.stop()
+    return client.latency.percentiles(), args.messages / elapsed
+
+
+def _run_asyncio(args):
+    from thermostat.mqtt.async_runtime import AsyncRuntime
+
+    broker = LocalBroker()
+    client, connected = _controller(broker, args)
+    runtime = AsyncRuntime(client, shards=args.shards)
+    result = {}
+
+    def feeder():
+        connected.wait(5)
+        result["elapsed"] = _feed(broker, client, args)
+        runtime.stop()
+
+    t = threading.Thread(target=feeder)
+    t.start()
+    asyncio.run(runtime.run())
+    t.join()
+    client.controller.stop()
+    return client.latency.percentiles(), args.messages / result["elapsed"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--valves", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--rate", type=float, default=0, help="messaggi/s (0 = raffica)")
+    parser.add_argument("--shards", type=int, default=8)
+    parser.add_argument("--db-delay-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    with temp_db():
+        results = [("thread", _run_thread(args)), ("asyncio", _run_asyncio(args))]
+
+    print(f"valves={args.valves} messages={args.messages} db_delay_ms={args.db_delay_ms} shards={args.shards}")
+    for name, (pct, rate) in results:
+        print(
+            f"{name:8s} {rate:10.1f} msg/s  latency ms "
+            f"p50={pct[50]:.2f} p90={pct[90]:.2f} p99={pct[99]:.2f} p99.9={pct[99.9]:.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
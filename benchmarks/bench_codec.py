@@ -0,0 +1,102 @@
+"""Microbenchmark dei codec dei payload (JSON rispetto al binario bin1).
+
+Misura encode/decode di temperatura e comando per ogni codec (più il decode con
+riconoscimento automatico del formato usato dal controller), la dimensione dei
+payload e le letture/s di `MQTTClient.dispatch` con telemetria JSON e binaria,
+un messaggio per lettura oppure in batch da gateway di `--batch` letture
+(`LocalClient` su un broker in-process, DB temporaneo, metriche e log per
+lettura disattivati).
+
+Esecuzione:
+    python -m benchmarks.bench_codec --iterations 200000 --messages 50000
+"""
+import argparse
+import time
+import timeit
+
+from benchmarks._common import local_client, temp_db
+from thermostat import metrics
+from thermostat.mqtt import codec
+from thermostat.mqtt.client import MQTTClient
+
+
+def _ns(fn, iterations):
+    return min(timeit.repeat(fn, number=iterations, repeat=3)) / iterations * 1e9
+
+
+def _micro(iterations):
+    ts = time.time()
+    rows = []
+    for c in (codec.JSON, codec.BIN1):
+        temp = c.encode_temperature(21.37, ts)
+        cmd = c.encode_command(True)
+        rows.append((
+            c.name,
+            len(temp),
+            len(cmd),
+            _ns(lambda: c.encode_temperature(21.37, ts), iterations),
+            _ns(lambda: c.decode_temperature(temp), iterations),
+            _ns(lambda: codec.decode_temperature(temp), iterations),
+            _ns(lambda: c.encode_command(True), iterations),
+            _ns(lambda: c.decode_command(cmd), iterations),
+        ))
+    return rows
+
+
+def _dispatch(client, n_valves, n_messages, valve_codec):
+    ts = time.time()
+    messages = [
+        (f"home/valves/valve{i % n_valves}/temperature", valve_codec.encode_temperature(18.0 + (i % 70) / 10.0, ts))
+        for i in range(n_messages)
+    ]
+    for vid in range(n_valves):
+        client.controller.set_valve_codec(f"valve{vid}", valve_codec)
+    dispatch = client.dispatch
+    start = time.perf_counter()
+    for topic, payload in messages:
+        dispatch(topic, payload)
+    elapsed = time.perf_counter() - start
+    client.controller.writer.flush(30)
+    return n_messages / elapsed
+
+
+def _dispatch_batches(client, n_valves, n_messages, batch_size, batch_codec):
+    ts = time.time()
+    readings = [(f"valve{i % n_valves}", 18.0 + (i % 70) / 10.0, ts) for i in range(n_messages)]
+    batches = [batch_codec.encode_batch(readings[i:i + batch_size]) for i in range(0, n_messages, batch_size)]
+    dispatch = client.dispatch
+    start = time.perf_counter()
+    for payload in batches:
+        dispatch("home/gateways/gw0/batch", payload)
+    elapsed = time.perf_counter() - start
+    client.controller.writer.flush(30)
+    return n_messages / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=200000)
+    parser.add_argument("--valves", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=50000)
+    parser.add_argument("--batch", type=int, default=100, help="letture per batch di gateway")
+    args = parser.parse_args()
+
+    print("codec  temp B  cmd B  enc temp ns  dec temp ns  dec auto ns  enc cmd ns  dec cmd ns")
+    for name, t_size, c_size, enc_t, dec_t, dec_auto, enc_c, dec_c in _micro(args.iterations):
+        print(f"{name:5s} {t_size:7d} {c_size:6d} {enc_t:12.0f} {dec_t:12.0f} {dec_auto:12.0f} {enc_c:11.0f} {dec_c:11.0f}")
+
+    metrics.REGISTRY.enabled = False
+    with temp_db():
+        client = MQTTClient(client=local_client())
+        # riscaldamento: registra le valvole
+        _dispatch(client, args.valves, args.valves * 2, codec.JSON)
+        rates = {c.name: _dispatch(client, args.valves, args.messages, c) for c in (codec.JSON, codec.BIN1)}
+        for c in (codec.JSON, codec.BIN1):
+            rates[f"{c.name} batch"] = _dispatch_batches(client, args.valves, args.messages, args.batch, c)
+        client.controller.stop()
+    for name, rate in rates.items():
+        print(f"dispatch {name:10s} {rate:10.0f} letture/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Benchmark: operazioni/s del repository con connessioni aperte a ogni chiamata e con il pool per-thread.
+
+Misura direttamente `ThermostatRepository` (lettura di una valvola e scrittura di
+una lettura con lo stato della valvola, una transazione per chiamata) e il costo
+di ottenere la connessione (`sqlite3.connect` + close rispetto a
+`ConnectionManager.get`), senza controller né writer write-behind. Nel caso
+"prima" ogni connessione viene chiusa a fine chiamata come nel codice precedente.
+
+Esecuzione:
+    python -m benchmarks.bench_db_connections --valves 1000 --operations 5000
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+from thermostat.db import database, repository
+from thermostat.db.database import init_db, close_connections
+
+
+def _rate(fn, n):
+    start = time.perf_counter()
+    for i in range(n):
+        fn(i)
+    return n / (time.perf_counter() - start)
+
+
+def _operations(repo, n_valves, n, after_call):
+    # after_call: eseguita a fine di ogni chiamata del repository (chiusura nel caso "prima")
+    now = time.time()
+
+    def read(i):
+        repo.get_valve(f"valve{i % n_valves}")
+        after_call()
+
+    def write(i):
+        vid = f"valve{i % n_valves}"
+        repo.write_batch([(vid, 18.0 + (i % 70) / 10.0, now + i)], [(vid, 21.0, now + i, 0)])
+        after_call()
+
+    return _rate(read, n), _rate(write, n)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--valves", type=int, default=1000)
+    parser.add_argument("--operations", type=int, default=5000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_NAME = os.path.join(tmp, "bench.db")
+        init_db()
+        repo = repository.ThermostatRepository()
+        repo.register_valves([(f"valve{i}", None) for i in range(args.valves)])
+
+        # "prima": una connessione nuova per ogni chiamata, chiusa a fine chiamata
+        opened = []
+
+        def connect():
+            conn = sqlite3.connect(database.DB_NAME)
+            opened.append(conn)
+            return conn
+
+        def close_opened():
+            while opened:
+                opened.pop().close()
+
+        pooled = repository.get_connection
+        repository.get_connection = connect
+        try:
+            before = _operations(repo, args.valves, args.operations, close_opened)
+        finally:
+            repository.get_connection = pooled
+        connect_close = _rate(lambda i: sqlite3.connect(database.DB_NAME).close(), args.operations)
+
+        # "dopo": connessioni persistenti con WAL e PRAGMA applicati una volta
+        after = _operations(repo, args.valves, args.operations, lambda: None)
+        get = _rate(lambda i: database.connections.get(database.DB_NAME), args.operations)
+        close_connections()
+
+    print(f"valves={args.valves} operations={args.operations}")
+    print(f"{'':20s} {'connect-per-call':>18s} {'pooled':>12s} {'speedup':>8s}")
+    for name, b, a in (("get_valve", before[0], after[0]), ("write_batch", before[1], after[1]), ("connessione", connect_close, get)):
+        print(f"{name:20s} {b:14.0f} op/s {a:8.0f} op/s {a / b:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
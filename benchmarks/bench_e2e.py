@@ -0,0 +1,420 @@
+"""Benchmark end-to-end: simulatore -> broker -> controller -> DB con risultati in JSON.
+
+Ogni scenario gira su un DB temporaneo nuovo con un `LocalBroker` in-process al
+posto di mosquitto, il `MQTTClient`/`ThermostatController` reale (runtime a
+thread o asyncio) e il `LoadSimulator` di `valve_simulator.load`:
+
+- steady: tutte le valvole riportano ogni `--interval` secondi;
+- burst: per `--burst-duration` secondi le valvole riportano ogni `--burst-interval`;
+- room_storm: traffico steady mentre un secondo repository (come l'API) cambia il
+  target delle stanze `--storm-rate` volte al secondo;
+- reconnect: dopo un periodo steady i simulatori si disconnettono finché tutte le
+  valvole vanno OFFLINE, poi si ricollegano insieme e riportano entro `--reconnect-window` s.
+
+Per ogni scenario vengono riportati messaggi/s elaborati, percentili di latenza
+pubblicazione -> elaborazione e del tempo di ritorno dei comandi, write
+amplification del DB (righe, transazioni e byte scritti per messaggio) e RSS.
+Con `--batch N` il simulatore pubblica batch da gateway (fino a N letture per
+messaggio) invece di un messaggio per lettura.
+
+Esecuzione:
+    python -m benchmarks.bench_e2e --valves 2000 --duration 10 --output e2e.json
+    python -m benchmarks.bench_e2e --scenario steady --scenario burst --batch 100
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # non disponibile su Windows
+    resource = None
+
+from thermostat.core.latency import LatencyRecorder
+from thermostat.core.registry import ValveState
+from thermostat.db import database
+from thermostat.db.database import init_db, close_connections
+from thermostat.db.repository import ThermostatRepository
+from thermostat.mqtt.client import MQTTClient
+from thermostat.mqtt.localbroker import LocalBroker, LocalClient
+from valve_simulator.load import LoadSimulator
+
+SCENARIOS = ("steady", "burst", "room_storm", "reconnect")
+
+
+def _io_written():
+    # byte passati a write() dal processo (None se /proc/self/io non è disponibile)
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _rss_mb():
+    # RSS corrente e massimo del processo in MB
+    current = None
+    try:
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        pass
+    peak = None
+    if resource is not None:
+        # ru_maxrss è in KB su Linux
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    return current, peak
+
+
+def _pct(recorder):
+    return {f"p{k:g}": round(v, 3) for k, v in recorder.percentiles().items()}
+
+
+class Harness:
+    """Broker locale, controller e simulatore di un singolo scenario."""
+
+    def __init__(self, args, tmp, name):
+        self.args = args
+        database.DB_NAME = os.path.join(tmp, f"{name}.db")
+        init_db()
+        self.broker = LocalBroker()
+        self.mqtt = MQTTClient(client=LocalClient(self.broker, "controller"))
+        # finestra ampia: i percentili coprono tutto lo scenario
+        self.mqtt.latency = LatencyRecorder(size=10 ** 6)
+        self.mqtt.controller.OFFLINE_TIMEOUT = args.offline_timeout
+        self.controller = self.mqtt.controller
+        self.runtime = None
+        self._thread = None
+        self.sims = []
+        self.payload_bytes = 0
+        self._base = None
+
+    def start(self):
+        client = self.mqtt.client
+        if self.args.runtime == "asyncio":
+            from thermostat.mqtt.async_runtime import AsyncRuntime
+
+            self.runtime = AsyncRuntime(self.mqtt, shards=self.args.shards)
+            self._thread = threading.Thread(target=asyncio.run, args=(self.runtime.run(connect=False),), daemon=True)
+            self._thread.start()
+            while self.runtime._stopping is None:
+                time.sleep(0.01)
+        client.connect()
+        client.loop_start()
+        # lascia al loop il tempo di eseguire on_connect (sottoscrizioni)
+        time.sleep(0.1)
+
+    def simulator(self, interval, seed=0):
+        broker = self.broker
+
+        def factory(client_id):
+            client = LocalClient(broker, client_id)
+            client.connect()
+            return client
+
+        sim = LoadSimulator(
+            self.args.valves, interval, self.args.connections, prefix="sim", client_factory=factory, seed=seed,
+            codecs=[self.args.codec], batch_size=self.args.batch, batch_interval=self.args.batch_interval,
+        )
+        if self.args.codec == "bin1":
+            # annuncio con i codec supportati: dopo il primo comando la telemetria è binaria
+            sim.announce()
+        self.sims.append(sim)
+        return sim
+
+    def published(self):
+        return sum(s.published for s in self.sims)
+
+    def drain(self, timeout=60.0):
+        # attende che il controller abbia elaborato tutto ciò che è stato pubblicato
+        deadline = time.monotonic() + timeout
+        target = self.published()
+        while self.mqtt.latency.count < target and time.monotonic() < deadline:
+            time.sleep(0.005)
+        return self.mqtt.latency.count >= target
+
+    def stop(self):
+        client = self.mqtt.client
+        if self.runtime is not None:
+            self.runtime.stop()
+            self._thread.join(30)
+        client.loop_stop()
+        client.disconnect()
+        self.controller.stop()
+
+    def db_bytes(self):
+        path = database.DB_NAME
+        return sum(os.path.getsize(p) for p in (path, path + "-wal") if os.path.exists(p))
+
+    def mark(self):
+        # inizio della fase misurata: i contatori del risultato partono da qui
+        self.mqtt.latency.reset()
+        for sim in self.sims:
+            sim.command_rtt.reset()
+        self._base = {
+            "io": _io_written(),
+            "payload": self.payload_bytes,
+            "writer": self.controller.writer.stats(),
+            "commands": self.controller.command_stats(),
+        }
+
+    def result(self, elapsed, extra=None):
+        base = self._base
+        processed = self.mqtt.latency.count
+        io_after = _io_written()
+        writer = {
+            k: v - base["writer"][k] if k in ("readings_written", "valves_written", "flushes", "dropped") else v
+            for k, v in self.controller.writer.stats().items()
+        }
+        commands = {k: v - base["commands"][k] for k, v in self.controller.command_stats().items()}
+        payload = self.payload_bytes - base["payload"]
+        rtt = LatencyRecorder(size=10 ** 7)
+        for sim in self.sims:
+            for sample in sim.command_rtt.samples():
+                rtt.record(sample)
+        rss, rss_peak = _rss_mb()
+        per_msg = (lambda x: round(x / processed, 4)) if processed else (lambda x: None)
+        io_bytes = io_after - base["io"] if base["io"] is not None and io_after is not None else None
+        result = {
+            "valves": self.args.valves,
+            "published": self.published(),
+            "processed": processed,
+            "elapsed_s": round(elapsed, 3),
+            "msgs_per_s": round(processed / elapsed, 1) if elapsed else None,
+            "latency_ms": _pct(self.mqtt.latency),
+            "command_rtt_ms": _pct(rtt),
+            "commands": commands,
+            "max_schedule_lag_ms": round(max(s.max_lag for s in self.sims) * 1000.0, 3),
+            "db": {
+                "readings_written": writer["readings_written"],
+                "valve_rows_written": writer["valves_written"],
+                "transactions": writer["flushes"],
+                "dropped": writer["dropped"],
+                "rows_per_msg": per_msg(writer["readings_written"] + writer["valves_written"]),
+                "transactions_per_msg": per_msg(writer["flushes"]),
+                "bytes_written": io_bytes,
+                "bytes_per_msg": per_msg(io_bytes) if io_bytes is not None else None,
+                # byte scritti su disco per byte di payload MQTT ricevuto
+                "write_amplification": round(io_bytes / payload, 2) if io_bytes and payload else None,
+                "file_bytes": self.db_bytes(),
+                "flush_ms_avg": round(writer["flush_ms_avg"], 3),
+                "flush_ms_max": round(writer["flush_ms_max"], 3),
+            },
+            "rss_mb": round(rss, 1) if rss is not None else None,
+            "rss_peak_mb": round(rss_peak, 1) if rss_peak is not None else None,
+        }
+        if extra:
+            result.update(extra)
+        return result
+
+
+def _count_payload(harness):
+    # byte di payload delle letture di temperatura pubblicate (per la write amplification)
+    publish = harness.broker.publish
+
+    def counting(topic, payload, qos=0, retain=False):
+        if topic.endswith("/temperature"):
+            harness.payload_bytes += len(payload)
+        return publish(topic, payload, qos, retain)
+
+    harness.broker.publish = counting
+
+
+def _run_for(harness, sim, seconds):
+    start = time.perf_counter()
+    sim.start()
+    time.sleep(seconds)
+    sim.stop()
+    drained = harness.drain()
+    return time.perf_counter() - start, drained
+
+
+def scenario_steady(harness, args):
+    sim = harness.simulator(args.interval)
+    harness.mark()
+    elapsed, drained = _run_for(harness, sim, args.duration)
+    harness.controller.writer.flush(30)
+    return harness.result(elapsed, {"drained": drained})
+
+
+def scenario_burst(harness, args):
+    sim = harness.simulator(args.burst_interval)
+    harness.mark()
+    start = time.perf_counter()
+    sim.start()
+    time.sleep(args.burst_duration)
+    sim.stop()
+    published = time.perf_counter() - start
+    drained = harness.drain()
+    # tempo per smaltire la coda accumulata dopo la fine della raffica
+    drain_s = time.perf_counter() - start - published
+    harness.controller.writer.flush(30)
+    return harness.result(
+        time.perf_counter() - start,
+        {"drained": drained, "publish_s": round(published, 3), "drain_s": round(drain_s, 3),
+         "offered_msgs_per_s": round(harness.published() / published, 1)},
+    )
+
+
+def scenario_room_storm(harness, args):
+    # stanze e assegnazioni prima dell'avvio, come farebbe il provisioning dall'API
+    api = ThermostatRepository()
+    rooms = [{"id": f"room{r}", "name": f"Room {r}", "target_temp": 20.0, "hysteresis": 0.5} for r in range(args.rooms)]
+    api.save_rooms(rooms)
+    api.register_valves([(f"sim{i}", f"room{i % args.rooms}") for i in range(args.valves)])
+    harness.controller.state.load()
+
+    # propagazione: istante di scrittura per revisione, istante di ricarica della cache del controller
+    written = {}
+    propagation = LatencyRecorder(size=10 ** 6)
+    lock = threading.Lock()
+
+    def on_state(event, data):
+        if event != "reloaded":
+            return
+        now = time.time()
+        with lock:
+            for rev in [r for r in written if r <= data["revision"]]:
+                propagation.record(now - written.pop(rev))
+
+    harness.controller.state.add_listener(on_state)
+    stop = threading.Event()
+    updates = [0]
+
+    def storm():
+        # repository separato: le modifiche arrivano al controller tramite il poll, come dall'API
+        repo = ThermostatRepository()
+        rng = random.Random(1)
+        interval = 1.0 / args.storm_rate
+        start = time.perf_counter()
+        while not stop.is_set():
+            r = rng.randrange(args.rooms)
+            repo.save_room(f"room{r}", f"Room {r}", round(rng.uniform(16.0, 24.0), 1), 0.5)
+            rev = repo.get_config_revision()
+            with lock:
+                written[rev] = time.time()
+            updates[0] += 1
+            delay = start + updates[0] * interval - time.perf_counter()
+            if delay > 0:
+                stop.wait(delay)
+        # chiude la connessione di questo thread
+        database.connections.close()
+
+    sim = harness.simulator(args.interval)
+    harness.mark()
+    writer = threading.Thread(target=storm, daemon=True)
+    writer.start()
+    elapsed, drained = _run_for(harness, sim, args.duration)
+    stop.set()
+    writer.join(10)
+    harness.controller.writer.flush(30)
+    return harness.result(
+        elapsed,
+        {"drained": drained, "rooms": args.rooms, "room_updates": updates[0],
+         "config_propagation_ms": _pct(propagation)},
+    )
+
+
+def scenario_reconnect(harness, args):
+    warmup = harness.simulator(args.interval)
+    warmup.start()
+    time.sleep(min(args.duration, args.interval * 1.5))
+    # disconnessione di massa: nessuna lettura finché tutte le valvole vanno OFFLINE
+    warmup.stop()
+    harness.drain()
+    valves = harness.controller.valves
+    deadline = time.monotonic() + args.offline_timeout + 10.0
+    offline = 0
+    while time.monotonic() < deadline:
+        offline = sum(1 for i in range(args.valves) if f"sim{i}" in valves and valves[f"sim{i}"].state == ValveState.OFFLINE)
+        if offline >= args.valves:
+            break
+        time.sleep(0.05)
+    harness.controller.writer.flush(30)
+    warm_processed = harness.mqtt.latency.count
+
+    # riconnessione contemporanea: ogni valvola riporta entro reconnect_window secondi
+    sim = harness.simulator(args.reconnect_window, seed=1)
+    harness.mark()
+    start = time.perf_counter()
+    wall_start = time.time()
+    sim.start()
+    time.sleep(args.reconnect_window)
+    sim.stop()
+    deadline = time.monotonic() + 60.0
+    while harness.mqtt.latency.count < sim.published and time.monotonic() < deadline:
+        time.sleep(0.005)
+    elapsed = time.perf_counter() - start
+    harness.controller.writer.flush(30)
+    back_online = sum(1 for i in range(args.valves) if valves[f"sim{i}"].last_seen >= wall_start)
+    # solo la fase di riconnessione nei contatori di pubblicazione
+    harness.sims = [sim]
+    return harness.result(
+        elapsed,
+        {"warmup_processed": warm_processed, "went_offline": offline, "back_online": back_online},
+    )
+
+
+def run_scenario(name, args, tmp):
+    harness = Harness(args, tmp, name)
+    _count_payload(harness)
+    harness.start()
+    try:
+        return globals()[f"scenario_{name}"](harness, args)
+    finally:
+        for sim in harness.sims:
+            if not sim._stop.is_set():
+                sim.stop()
+        harness.stop()
+        close_connections()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="ripetibile (default: tutti)")
+    parser.add_argument("--valves", type=int, default=2000)
+    parser.add_argument("--interval", type=float, default=1.0, help="secondi tra due letture della stessa valvola")
+    parser.add_argument("--duration", type=float, default=10.0, help="durata degli scenari steady e room_storm")
+    parser.add_argument("--connections", type=int, default=4, help="connessioni del simulatore")
+    parser.add_argument("--runtime", choices=("thread", "asyncio"), default="thread")
+    parser.add_argument("--shards", type=int, default=8, help="shard del runtime asyncio")
+    parser.add_argument("--codec", choices=("json", "bin1"), default="json", help="codec negoziato dalle valvole")
+    parser.add_argument("--batch", type=int, default=0, help="letture per batch di gateway (0 = un messaggio per lettura)")
+    parser.add_argument("--batch-interval", type=float, default=0.05, help="secondi tra due batch del simulatore")
+    parser.add_argument("--burst-interval", type=float, default=0.1)
+    parser.add_argument("--burst-duration", type=float, default=3.0)
+    parser.add_argument("--rooms", type=int, default=50)
+    parser.add_argument("--storm-rate", type=float, default=50.0, help="modifiche stanza/s nello scenario room_storm")
+    parser.add_argument("--offline-timeout", type=float, default=2.0)
+    parser.add_argument("--reconnect-window", type=float, default=1.0)
+    parser.add_argument("--output", help="file JSON dei risultati (default: stdout)")
+    args = parser.parse_args()
+
+    results = {
+        "benchmark": "e2e",
+        "timestamp": time.time(),
+        "params": {k: v for k, v in vars(args).items() if k not in ("scenario", "output")},
+        "scenarios": {},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in args.scenario or SCENARIOS:
+            results["scenarios"][name] = run_scenario(name, args, tmp)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Benchmark: storico di un anno letto dalle partizioni grezze rispetto ai rollup.
+
+Esecuzione:
+    python -m benchmarks.bench_history_rollups --days 365 --interval 60
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from thermostat.db import database
+from thermostat.db.database import init_db, close_connections
+from thermostat.db.repository import ThermostatRepository
+
+
+def _timed(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--interval", type=float, default=60.0, help="secondi tra due letture")
+    parser.add_argument("--limit", type=int, default=500, help="budget di punti della richiesta")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_NAME = os.path.join(tmp, "bench.db")
+        init_db()
+        repo = ThermostatRepository()
+        repo.save_room("living", "Soggiorno", 21.0, 0.5)
+        repo.assign_valve_to_room("valve1", "living")
+
+        end = time.time()
+        start = end - args.days * 86400
+        n = int(args.days * 86400 / args.interval)
+        t0 = time.perf_counter()
+        batch = []
+        for i in range(n):
+            ts = start + i * args.interval
+            batch.append(("valve1", 18.0 + (i % 70) / 10.0, ts))
+            if len(batch) == 10000:
+                repo.write_batch(batch, [])
+                batch = []
+        if batch:
+            repo.write_batch(batch, [])
+        load = time.perf_counter() - t0
+
+        # grezzo: tutte le letture dell'intervallo (quello che serviva prima per un grafico annuale)
+        raw, raw_ms = _timed(lambda: repo.get_valve_history("valve1", start, end, n, "raw"), args.repeat)
+        auto, auto_ms = _timed(lambda: repo.get_valve_history("valve1", start, end, args.limit), args.repeat)
+        room, room_ms = _timed(lambda: repo.get_room_history("living", start, end, args.limit), args.repeat)
+        close_connections()
+
+    print(f"readings={n} load={load:.1f}s ({n / load:.0f} readings/s con rollup)")
+    print(f"raw valve history:   {raw_ms:9.1f} ms  points={len(raw)}")
+    print(f"auto valve history:  {auto_ms:9.1f} ms  points={len(auto)} bucket={auto[0]['timestamp'] - auto[1]['timestamp']:.0f}s")
+    print(f"auto room history:   {room_ms:9.1f} ms  points={len(room)}")
+    print(f"speedup:             {raw_ms / auto_ms:9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
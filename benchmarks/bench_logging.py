@@ -0,0 +1,126 @@
+"""Benchmark: throughput del controller a livello INFO con logging sincrono, su coda e campionato.
+
+Per ogni configurazione di `setup_logging` (modalità sync/queue, formato
+text/json, intervallo di campionamento delle righe per lettura) elabora
+`--messages` letture con `MQTTClient.dispatch` (`LocalClient` su un broker
+in-process, DB temporaneo) scrivendo console e file di log nella cartella del DB.
+Riporta i messaggi/s del percorso caldo, il tempo per svuotare la coda del
+listener a fine misura e le righe effettivamente scritte.
+
+Le temperature oscillano lentamente intorno al setpoint (pochi cambi di stato,
+come nella realtà). `--io-delay-ms` rallenta ogni flush del file di log per
+simulare un disco lento o una rotazione.
+
+Esecuzione:
+    python -m benchmarks.bench_logging --valves 1000 --messages 50000
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import time
+
+from benchmarks._common import local_client, temp_db
+from thermostat import logging_config
+from thermostat.mqtt.client import MQTTClient
+
+# (etichetta, modalità, formato, intervallo righe per lettura in secondi)
+CONFIGS = (
+    ("sync text (default)", "sync", "text", 0),
+    ("queue text", "queue", "text", 0),
+    ("queue json", "queue", "json", 0),
+    ("sync text sampled", "sync", "text", 60),
+    ("queue text sampled", "queue", "text", 60),
+)
+
+
+def _payloads(n_valves, n_messages):
+    now = time.time()
+    out = []
+    for i in range(n_messages):
+        v, k = i % n_valves, i // n_valves
+        temp = round(22.0 + 2.0 * math.sin(k / 20.0 + v), 2)
+        out.append((f"home/valves/valve{v}/temperature", json.dumps({"value": temp, "ts": now}).encode()))
+    return out
+
+
+def _slow_file(delay):
+    # rallenta i flush dell'handler su file (sia diretto sia dietro al listener)
+    if delay <= 0:
+        return
+    listener = logging_config._listener
+    handlers = listener.handlers if listener is not None else logging.getLogger().handlers
+    for handler in handlers:
+        if isinstance(handler, logging.FileHandler):
+            original = handler.flush
+
+            def flush(original=original):
+                time.sleep(delay)
+                original()
+
+            handler.flush = flush
+
+
+def _lines(path):
+    if not os.path.exists(path):
+        return 0
+    with open(path, "rb") as f:
+        return sum(1 for _ in f)
+
+
+def _run(client, messages, tmp, mode, fmt, interval, io_delay):
+    log_file = os.path.join(tmp, "thermostat.log")
+    console_file = os.path.join(tmp, "console.log")
+    for path in (log_file, console_file):
+        if os.path.exists(path):
+            os.remove(path)
+    with open(console_file, "w") as console:
+        logging_config.setup_logging(mode, fmt, interval, log_file=log_file, stream=console)
+        _slow_file(io_delay)
+        dispatch = client.dispatch
+        start = time.perf_counter()
+        for topic, payload in messages:
+            dispatch(topic, payload)
+        elapsed = time.perf_counter() - start
+        # il lavoro rimandato al listener: scrittura dei record rimasti in coda
+        drain_start = time.perf_counter()
+        logging_config.stop_logging()
+        drain = time.perf_counter() - drain_start
+    client.controller.writer.flush(30)
+    dropped = sum(getattr(h, "dropped", 0) for h in logging.getLogger().handlers)
+    return elapsed, drain, _lines(log_file), dropped
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--valves", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=50000)
+    parser.add_argument("--io-delay-ms", type=float, default=0.0, help="ritardo di ogni flush del file di log")
+    args = parser.parse_args()
+    os.environ["LOG_LEVEL"] = "INFO"
+
+    results = []
+    with temp_db() as db_path:
+        tmp = os.path.dirname(db_path)
+        client = MQTTClient(client=local_client())
+        messages = _payloads(args.valves, args.messages)
+        # riscaldamento senza log: registra le valvole
+        logging_config.setup_logging("sync", "text", 0, log_file=None, stream=open(os.devnull, "w"))
+        for topic, payload in messages[: args.valves * 2]:
+            client.dispatch(topic, payload)
+        for label, mode, fmt, interval in CONFIGS:
+            results.append((label, _run(client, messages, tmp, mode, fmt, interval, args.io_delay_ms / 1000.0)))
+        client.controller.stop()
+
+    print(f"valves={args.valves} messages={args.messages} level=INFO io_delay_ms={args.io_delay_ms}")
+    base = results[0][1][0]
+    for label, (elapsed, drain, lines, dropped) in results:
+        print(
+            f"{label:20s} {args.messages / elapsed:9.0f} msg/s ({base / elapsed:5.1f}x)  "
+            f"drain listener {drain * 1000:7.1f} ms  righe nel file {lines:6d}  scartate {dropped}"
+        )
+
+
+if __name__ == "__main__":
+    main()
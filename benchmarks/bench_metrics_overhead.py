@@ -0,0 +1,90 @@
+"""Benchmark: costo delle metriche sul percorso caldo del controller.
+
+Elabora `--messages` letture con `MQTTClient.dispatch` (`LocalClient` su un
+broker in-process, DB temporaneo) con i timer delle fasi attivi e disattivati
+(`REGISTRY.enabled`, come con THERMOSTAT_METRICS=0), alternando le ripetizioni e
+tenendo la migliore, poi misura il costo unitario di `Histogram.observe`/`Counter.inc` e il tempo di
+rendering di /metrics.
+
+Esecuzione:
+    python -m benchmarks.bench_metrics_overhead --valves 1000 --messages 50000
+"""
+import argparse
+import json
+import time
+
+from benchmarks._common import local_client, temp_db
+from thermostat import metrics
+from thermostat.mqtt.client import MQTTClient, MESSAGES
+
+
+def _payloads(n_valves, n_messages):
+    now = time.time()
+    return [
+        (f"home/valves/valve{i % n_valves}/temperature", json.dumps({"value": 18.0 + (i % 70) / 10.0, "ts": now}).encode())
+        for i in range(n_messages)
+    ]
+
+
+def _run(client, messages):
+    dispatch = client.dispatch
+    start = time.perf_counter()
+    for topic, payload in messages:
+        dispatch(topic, payload)
+    elapsed = time.perf_counter() - start
+    client.controller.writer.flush(30)
+    return elapsed
+
+
+def _unit_cost(fn, n=200000):
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - start) / n * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--valves", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=50000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with temp_db():
+        client = MQTTClient(client=local_client())
+        messages = _payloads(args.valves, args.messages)
+        # riscaldamento: registra le valvole e riempie le cache
+        _run(client, messages[: args.valves * 2])
+
+        best = {True: None, False: None}
+        for _ in range(args.repeat):
+            for enabled in (True, False):
+                metrics.REGISTRY.enabled = enabled
+                elapsed = _run(client, messages)
+                best[enabled] = elapsed if best[enabled] is None else min(best[enabled], elapsed)
+        metrics.REGISTRY.enabled = True
+        client.controller.stop()
+
+        render_start = time.perf_counter()
+        text = metrics.REGISTRY.render()
+        render_ms = (time.perf_counter() - render_start) * 1000.0
+
+    on, off = best[True], best[False]
+    per_msg_on = on / args.messages * 1e6
+    per_msg_off = off / args.messages * 1e6
+    print(f"valves={args.valves} messages={args.messages} repeat={args.repeat}")
+    print(f"metrics off {args.messages / off:10.0f} msg/s  {per_msg_off:6.2f} us/msg")
+    print(f"metrics on  {args.messages / on:10.0f} msg/s  {per_msg_on:6.2f} us/msg")
+    print(f"overhead    {per_msg_on - per_msg_off:+6.2f} us/msg ({(on / off - 1) * 100:+.1f}%)")
+
+    histogram = metrics.Histogram("bench_seconds", "bench", ("stage",))
+    counter = metrics.Counter("bench_total", "bench", ("kind",))
+    timer = histogram.timer()
+    print(f"Histogram.observe {_unit_cost(lambda: histogram.observe(0.0001, 'parse')):6.0f} ns")
+    print(f"Counter.inc       {_unit_cost(lambda: counter.inc('temperature', 'ok')):6.0f} ns")
+    print(f"StageTimer.mark   {_unit_cost(lambda: timer.mark('bench')):6.0f} ns")
+    print(f"/metrics render   {render_ms:6.2f} ms ({len(text)} byte, {MESSAGES.value('temperature', 'ok')} messaggi contati)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Benchmark delle query dello storico con e senza indici coprenti.
+
+Carica `--readings` letture (default 10M) nelle partizioni senza indici, misura
+lo storico per valvola e per stanza, crea gli indici con `ensure_indexes` (come
+fa `init_db`) e ripete le misure. La verifica con EXPLAIN QUERY PLAN che le query
+usino gli indici attesi è in `tests/test_query_plans.py`.
+
+Esecuzione:
+    python -m benchmarks.bench_query_plans --readings 10000000 --valves 1000 --days 30
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from thermostat.db import database, partitions as partitions_module
+from thermostat.db.database import init_db, get_connection, close_connections
+from thermostat.db.partitions import partitions
+from thermostat.db.repository import ThermostatRepository
+
+
+def _load(args, start):
+    conn = get_connection()
+    n_valves = args.valves
+    per_valve = args.readings // n_valves
+    step = args.days * 86400 / per_valve
+    rng = random.Random(1)
+    with conn:
+        cursor = conn.cursor()
+        cursor.executemany(
+            "INSERT INTO valves (id, setpoint, last_seen, room_id) VALUES (?, 22.0, ?, ?)",
+            [(f"valve{v}", start, f"room{v % args.rooms}") for v in range(n_valves)],
+        )
+    # inserimento in ordine di tempo, come arrivano le letture reali
+    batch = []
+    for i in range(per_valve):
+        ts = start + i * step
+        for v in range(n_valves):
+            batch.append((f"valve{v}", 18.0 + rng.random() * 6, ts))
+        if len(batch) >= 200000:
+            with conn:
+                partitions.insert_many(conn.cursor(), batch)
+            batch = []
+    if batch:
+        with conn:
+            partitions.insert_many(conn.cursor(), batch)
+    return per_valve * n_valves
+
+
+def _queries(repo, args, start):
+    end = start + args.days * 86400
+    mid = start + args.days * 86400 / 2
+    return {
+        "valve history (latest 50)": lambda: repo.get_valve_history("valve7", None, None, 50, "raw"),
+        "valve history (1 day)": lambda: repo.get_valve_history("valve7", mid, mid + 86400, 10000, "raw"),
+        "room history (latest 50)": lambda: repo.get_room_history("room3", None, None, 50, "raw"),
+        "room history (1 hour)": lambda: repo.get_room_history("room3", mid, mid + 3600, 100000, "raw"),
+        "valve history (whole range)": lambda: repo.get_valve_history("valve7", start, end, 1000000, "raw"),
+    }
+
+
+def _measure(queries, repeat):
+    results = {}
+    for name, fn in queries.items():
+        best = None
+        rows = 0
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            rows = len(fn())
+            elapsed = time.perf_counter() - t0
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = (best * 1000, rows)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--readings", type=int, default=10000000)
+    parser.add_argument("--valves", type=int, default=1000)
+    parser.add_argument("--rooms", type=int, default=50)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_NAME = os.path.join(tmp, "bench.db")
+        init_db()
+        repo = ThermostatRepository()
+        start = (int(time.time()) // 86400 - args.days) * 86400
+
+        # caricamento senza indici sulle partizioni (schema precedente)
+        indexes = partitions_module.PARTITION_INDEXES
+        partitions_module.PARTITION_INDEXES = ()
+        t0 = time.perf_counter()
+        try:
+            n = _load(args, start)
+        finally:
+            partitions_module.PARTITION_INDEXES = indexes
+        load = time.perf_counter() - t0
+        print(f"readings={n} valves={args.valves} rooms={args.rooms} days={args.days} load={load:.1f}s")
+
+        before = _measure(_queries(repo, args, start), 1)
+
+        t0 = time.perf_counter()
+        conn = get_connection()
+        with conn:
+            names = partitions.ensure_indexes(conn.cursor())
+        print(f"ensure_indexes: {len(names)} partizioni in {time.perf_counter() - t0:.1f}s")
+
+        after = _measure(_queries(repo, args, start), args.repeat)
+        for name in before:
+            b, rows = before[name]
+            a, _ = after[name]
+            print(f"{name:28s} rows={rows:7d}  no index {b:9.1f} ms  covering {a:8.2f} ms  ({b / a:7.1f}x)")
+
+        close_connections()
+
+
+if __name__ == "__main__":
+    main()
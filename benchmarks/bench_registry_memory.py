@@ -0,0 +1,66 @@
+"""Benchmark: memoria per valvola del vecchio dict di oggetti `Valve` rispetto al
+registro colonnare `ValveRegistry`.
+
+Esecuzione:
+    python -m benchmarks.bench_registry_memory --valves 100000
+"""
+import argparse
+import time
+import tracemalloc
+
+from thermostat.core.registry import ValveRegistry, ValveState
+
+
+class _LegacyValve:
+    # copia del vecchio oggetto Valve (un __dict__ per istanza)
+    def __init__(self, valve_id, setpoint=22.0):
+        self.valve_id = valve_id
+        self.setpoint = setpoint
+        self.current_temp = None
+        self.state = ValveState.IDLE
+        self.last_seen = time.time()
+
+
+def _measure(build, ids):
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    obj = build(ids)
+    used = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    return obj, used
+
+
+def _build_legacy(ids):
+    valves = {}
+    for i, vid in enumerate(ids):
+        v = _LegacyValve(vid)
+        v.current_temp = 20.0 + (i % 50) / 10.0
+        valves[vid] = v
+    return valves
+
+
+def _build_registry(ids):
+    registry = ValveRegistry()
+    for i, vid in enumerate(ids):
+        registry.add(vid).current_temp = 20.0 + (i % 50) / 10.0
+    return registry
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--valves", type=int, default=100000)
+    args = parser.parse_args()
+
+    # gli id sono condivisi: misuriamo solo il costo delle strutture
+    ids = [f"valve{i}" for i in range(args.valves)]
+    _, legacy = _measure(_build_legacy, ids)
+    _, registry = _measure(_build_registry, ids)
+
+    print(f"valves={args.valves}")
+    print(f"dict[Valve]:   {legacy / args.valves:8.1f} bytes/valve")
+    print(f"ValveRegistry: {registry / args.valves:8.1f} bytes/valve")
+    print(f"ratio:         {legacy / registry:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Benchmark: controllo a livello di stanza rispetto alla decisione per valvola.
+
+Elabora `--messages` letture con `MQTTClient.dispatch` (`LocalClient` su un
+broker in-process, DB temporaneo, log per lettura disattivati) prima con le valvole senza stanza
+(isteresi e comando a ogni lettura) e poi con le stesse valvole assegnate a
+stanze da `--valves-per-room` valvole, per ogni modo di aggregazione. Con le
+stanze il percorso caldo aggiorna solo l'aggregato; le decisioni avvengono una
+volta per stanza per tick e ne viene misurato il costo a parte.
+
+Il lavoro di controllo per lettura è la somma delle fasi read, decision e
+publish di `thermostat_stage_seconds` (senza parse e persist, che non cambiano);
+le letture/s includono il writer, il cui costo cresce con lo storico e i rollup
+di stanza.
+
+Esecuzione:
+    python -m benchmarks.bench_rooms --valves 10000 --valves-per-room 20 --messages 100000
+"""
+import argparse
+import json
+import time
+
+from benchmarks._common import local_client, temp_db
+from thermostat.core.controller import STAGE_SECONDS
+from thermostat.core.rooms import AGGREGATIONS
+from thermostat.mqtt.client import MQTTClient
+from thermostat.mqtt.localbroker import LocalBroker
+
+# fasi del percorso caldo che dipendono dalla logica di controllo
+CONTROL_STAGES = ("read", "decision", "publish")
+
+
+def _payloads(n_valves, n_messages):
+    now = time.time()
+    return [
+        (f"home/valves/valve{i % n_valves}/temperature", json.dumps({"value": 18.0 + (i % 70) / 10.0, "ts": now}).encode())
+        for i in range(n_messages)
+    ]
+
+
+def _control_seconds():
+    total = 0.0
+    for stage in CONTROL_STAGES:
+        snap = STAGE_SECONDS.snapshot(stage)
+        if snap is not None:
+            total += snap[1]
+    return total
+
+
+def _run(client, messages):
+    dispatch = client.dispatch
+    start = time.perf_counter()
+    for topic, payload in messages:
+        dispatch(topic, payload)
+    elapsed = time.perf_counter() - start
+    client.controller.writer.flush(60)
+    return elapsed
+
+
+def _tick(controller, room_ids):
+    # una decisione per ogni stanza (come allo scadere del tick), tempo totale
+    start = time.perf_counter()
+    for room_id in room_ids:
+        controller._decide_room(("room", room_id))
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--valves", type=int, default=10000)
+    parser.add_argument("--valves-per-room", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--tick", type=float, default=1.0, help="ROOM_TICK del controller (s)")
+    args = parser.parse_args()
+    n_rooms = max(1, args.valves // args.valves_per_room)
+
+    with temp_db():
+        # i comandi pubblicati dal controller vengono contati dal broker
+        broker = LocalBroker()
+        client = MQTTClient(client=local_client(broker))
+        controller = client.controller
+        # tick lungo: le decisioni di stanza le eseguiamo noi, non lo scheduler
+        controller.ROOM_TICK = 3600.0
+        messages = _payloads(args.valves, args.messages)
+        _run(client, messages[: args.valves])
+
+        broker.published = 0
+        control = _control_seconds()
+        per_valve = _run(client, messages)
+        per_valve_control = _control_seconds() - control
+        per_valve_commands = broker.published
+
+        repo = controller.repository
+        repo.save_rooms([
+            {"id": f"room{r}", "name": f"Room {r}", "target_temp": 21.0, "hysteresis": 0.5} for r in range(n_rooms)
+        ])
+        for v in range(args.valves):
+            repo.assign_valve_to_room(f"valve{v}", f"room{v % n_rooms}")
+        room_ids = [f"room{r}" for r in range(n_rooms)]
+
+        results = []
+        for aggregation in AGGREGATIONS:
+            controller.configure_rooms(aggregation, 3600.0)
+            _run(client, messages[: args.valves])
+            _tick(controller, room_ids)
+            broker.published = 0
+            control = _control_seconds()
+            elapsed = _run(client, messages)
+            control = _control_seconds() - control
+            tick = _tick(controller, room_ids)
+            results.append((aggregation, elapsed, control, tick, broker.published))
+        controller.stop()
+
+    print(f"valves={args.valves} rooms={n_rooms} messages={args.messages} tick={args.tick}s")
+    print(
+        f"per valvola       {args.messages / per_valve:8.0f} letture/s  controllo {per_valve_control / args.messages * 1e6:5.2f} us/lettura  "
+        f"decisioni {args.messages:7d}  comandi {per_valve_commands}"
+    )
+    for aggregation, elapsed, control, tick, commands in results:
+        print(
+            f"stanza {aggregation:9s}  {args.messages / elapsed:8.0f} letture/s  controllo {control / args.messages * 1e6:5.2f} us/lettura  "
+            f"decisioni {n_rooms:7d}  comandi {commands}  tick {tick * 1000:6.2f} ms ({tick / args.tick * 100:.2f}% di un tick)"
+        )
+
+
+if __name__ == "__main__":
+    main()
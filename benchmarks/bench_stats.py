@@ -0,0 +1,117 @@
+"""Benchmark: statistiche mobili in memoria rispetto al calcolo dallo storico sul DB.
+
+Misura il costo di `RollingStats.record` (per lettura, sul percorso caldo) e di
+`snapshot` (per richiesta), le letture/s di `MQTTClient.dispatch` con e senza
+registrazione delle statistiche (`LocalClient` su un broker in-process, DB
+temporaneo, metriche e log per lettura disattivati) e, per confronto,
+media/min/max delle ultime 24 h di una valvola calcolate dalle letture grezze
+sul DB (`--interval` s tra due letture).
+
+Esecuzione:
+    python -m benchmarks.bench_stats --valves 1000 --messages 50000 --interval 60
+"""
+import argparse
+import time
+import timeit
+
+from benchmarks._common import local_client, temp_db
+from thermostat import metrics
+from thermostat.core.stats import RollingStats
+from thermostat.db.repository import ThermostatRepository
+from thermostat.mqtt import codec
+from thermostat.mqtt.client import MQTTClient
+
+
+class _NoStats:
+    # stesso `record` di RollingStats senza lavoro, per misurare il costo sul dispatch
+    def record(self, key, temperature, state, ts):
+        pass
+
+
+def _micro(n_keys, iterations):
+    stats = RollingStats()
+    now = time.time()
+    for k in range(n_keys):
+        stats.record(f"valve{k}", 20.0, 0, now)
+    i = iter(range(10**12))
+
+    def record():
+        n = next(i)
+        stats.record(f"valve{n % n_keys}", 18.0 + (n % 70) / 10.0, n % 2, now + n * 0.01)
+
+    record_ns = min(timeit.repeat(record, number=iterations, repeat=3)) / iterations * 1e9
+    snapshot_us = min(timeit.repeat(lambda: stats.snapshot("valve0", now), number=10000, repeat=3)) / 10000 * 1e6
+    return record_ns, snapshot_us
+
+
+def _dispatch(client, n_valves, n_messages):
+    ts = time.time()
+    messages = [
+        (f"home/valves/valve{i % n_valves}/temperature", codec.JSON.encode_temperature(18.0 + (i % 70) / 10.0, ts))
+        for i in range(n_messages)
+    ]
+    dispatch = client.dispatch
+    start = time.perf_counter()
+    for topic, payload in messages:
+        dispatch(topic, payload)
+    elapsed = time.perf_counter() - start
+    client.controller.writer.flush(30)
+    return n_messages / elapsed
+
+
+def _db_day(repo, interval):
+    # lo stesso riepilogo di 24 h calcolato dalle letture grezze
+    end = time.time()
+    n = int(86400 / interval)
+    repo.write_batch([("valve0", 18.0 + (i % 70) / 10.0, end - 86400 + i * interval) for i in range(n)], [])
+    best = None
+    for _ in range(3):
+        start = time.perf_counter()
+        rows = repo.get_valve_history("valve0", end - 86400, end, n, "raw")
+        temps = [r["temperature"] for r in rows]
+        summary = (len(temps), sum(temps) / len(temps), min(temps), max(temps))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return summary[0], best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--valves", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=50000)
+    parser.add_argument("--iterations", type=int, default=200000)
+    parser.add_argument("--interval", type=float, default=60.0, help="secondi tra due letture nello storico sul DB")
+    args = parser.parse_args()
+
+    record_ns, snapshot_us = _micro(args.valves, args.iterations)
+    stats = RollingStats()
+    for k in range(args.valves):
+        stats.record(f"valve{k}", 20.0, 0, time.time())
+    memory = sum(
+        col.itemsize * len(col)
+        for w in stats.windows
+        for col in (w.last_bucket, w.count, w.sum, w.min, w.max, w.heating, w.observed, w.transitions)
+    ) + (stats._last_ts.itemsize + stats._last_state.itemsize) * args.valves
+
+    metrics.REGISTRY.enabled = False
+    with temp_db():
+        client = MQTTClient(client=local_client())
+        controller = client.controller
+        # riscaldamento: registra le valvole
+        _dispatch(client, args.valves, args.valves * 2)
+        with_stats = _dispatch(client, args.valves, args.messages)
+        valve_stats, controller.valve_stats = controller.valve_stats, _NoStats()
+        without_stats = _dispatch(client, args.valves, args.messages)
+        controller.valve_stats = valve_stats
+        controller.stop()
+        rows, db_ms = _db_day(ThermostatRepository(), args.interval)
+
+    print(f"record            {record_ns:8.0f} ns/lettura")
+    print(f"snapshot          {snapshot_us:8.1f} us/richiesta (finestre 1h e 24h)")
+    print(f"memoria           {memory / args.valves:8.0f} B/valvola (colonne array)")
+    print(f"dispatch          {with_stats:8.0f} letture/s con statistiche, {without_stats:.0f} senza")
+    print(f"24h dal DB        {db_ms:8.1f} ms ({rows} letture grezze)")
+
+
+if __name__ == "__main__":
+    main()
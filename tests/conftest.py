@@ -0,0 +1,16 @@
+import pytest
+
+from thermostat.db import database
+from thermostat.db.partitions import partitions
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    # DB temporaneo per test, con schema creato e connessioni chiuse alla fine;
+    # il catalogo delle partizioni in cache si riferisce al DB precedente
+    monkeypatch.setattr(database, "DB_NAME", str(tmp_path / "test.db"))
+    partitions.invalidate()
+    database.init_db()
+    yield database.DB_NAME
+    database.close_connections()
+    partitions.invalidate()
@@ -0,0 +1,121 @@
+import threading
+import time
+
+import pytest
+
+from thermostat.db.repository import ThermostatRepository
+from thermostat.mqtt import codec
+from thermostat.mqtt.cluster import Supervisor, ThreadWorker, valve_topic
+from thermostat.mqtt.localbroker import LocalBroker, LocalClient
+
+VALVES = [f"v{i}" for i in range(24)]
+
+
+def _wait(predicate, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+
+class _Handled:
+    # registra quale worker ha elaborato ciascuna lettura
+    def __init__(self):
+        self.by_valve = {}
+        self._lock = threading.Lock()
+
+    def wrap(self, worker):
+        controller = worker.client.controller
+
+        def handle_temperature(valve_id, temperature):
+            self._record(worker.worker_id, valve_id)
+
+        def handle_batch(gateway_id, readings, batch_codec=None):
+            for valve_id, _ in readings:
+                self._record(worker.worker_id, valve_id)
+
+        controller.handle_temperature = handle_temperature
+        controller.handle_batch = handle_batch
+        return worker
+
+    def _record(self, worker_id, valve_id):
+        with self._lock:
+            self.by_valve.setdefault(valve_id, []).append(worker_id)
+
+    def reset(self):
+        with self._lock:
+            self.by_valve = {}
+
+
+@pytest.fixture
+def cluster(db):
+    ThermostatRepository().register_valves([(vid, None) for vid in VALVES])
+    broker = LocalBroker()
+    handled = _Handled()
+    publisher = LocalClient(broker, "supervisor")
+    publisher.connect()
+    supervisor = Supervisor(3, publisher, lambda wid: handled.wrap(ThreadWorker(wid, broker)), restart_delay=3600)
+    supervisor.start()
+    try:
+        yield broker, supervisor, handled
+    finally:
+        supervisor.shutdown()
+
+
+def _subscriptions(supervisor):
+    return {wid: set(w.client._subscribed) for wid, w in supervisor.workers.items() if w.is_alive()}
+
+
+def _converged(supervisor):
+    # ogni valvola sottoscritta da esattamente un worker vivo
+    subs = list(_subscriptions(supervisor).values())
+    return sorted(vid for s in subs for vid in s) == sorted(VALVES)
+
+
+def _owner(supervisor, valve_id):
+    return next(iter(supervisor.workers.values())).client.shard.ring.owner(valve_id)
+
+
+def _publish_all(broker, handled):
+    handled.reset()
+    for vid in VALVES:
+        # il broker consegna la lettura al solo worker proprietario
+        assert broker.publish(valve_topic(vid), codec.JSON.encode_temperature(20.0)) == 1
+    assert _wait(lambda: len(handled.by_valve) == len(VALVES))
+
+
+def test_each_reading_is_handled_by_exactly_one_worker(cluster):
+    broker, supervisor, handled = cluster
+    assert _wait(lambda: _converged(supervisor))
+
+    _publish_all(broker, handled)
+    for vid, workers in handled.by_valve.items():
+        assert workers == [_owner(supervisor, vid)]
+
+    # il batch arriva a un solo worker, che inoltra le letture altrui ai proprietari
+    handled.reset()
+    batch = codec.JSON.encode_batch([(vid, 20.5, None) for vid in VALVES])
+    assert broker.publish("home/gateways/gw1/batch", batch) == 1
+    assert _wait(lambda: len(handled.by_valve) == len(VALVES))
+    time.sleep(0.1)
+    for vid, workers in handled.by_valve.items():
+        assert workers == [_owner(supervisor, vid)]
+
+
+def test_ownership_moves_when_a_worker_leaves(cluster):
+    broker, supervisor, handled = cluster
+    assert _wait(lambda: _converged(supervisor))
+    lost = _subscriptions(supervisor)["worker-0"]
+    assert lost
+
+    supervisor.workers["worker-0"].terminate()
+    supervisor.check()
+    assert supervisor.members == ["worker-1", "worker-2"]
+    assert _wait(lambda: _converged(supervisor))
+
+    _publish_all(broker, handled)
+    for vid, workers in handled.by_valve.items():
+        assert len(workers) == 1 and workers[0] in ("worker-1", "worker-2")
+    assert all(handled.by_valve[vid] != ["worker-0"] for vid in lost)
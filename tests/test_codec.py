@@ -0,0 +1,47 @@
+import pytest
+
+from thermostat.mqtt import codec
+
+CODECS = [codec.JSON, codec.BIN1]
+
+
+@pytest.mark.parametrize("c", CODECS, ids=lambda c: c.name)
+def test_temperature_round_trip(c):
+    payload = c.encode_temperature(21.37, 1_700_000_000.5)
+    assert codec.detect(payload) is c
+    assert codec.decode_temperature(payload) == (21.37, 1_700_000_000.5)
+    assert c.decode_temperature(c.encode_temperature(None)) == (None, None)
+
+
+@pytest.mark.parametrize("c", CODECS, ids=lambda c: c.name)
+def test_command_round_trip(c):
+    assert codec.decode_command(c.encode_command(True)) is True
+    assert codec.decode_command(c.encode_command(False)) is False
+
+
+@pytest.mark.parametrize("c", CODECS, ids=lambda c: c.name)
+def test_batch_and_commands_round_trip(c):
+    readings = [("v1", 20.5, 1_700_000_000.0), ("valvola-è", None, None), ("v3", -3.25, 1.5)]
+    assert codec.decode_batch(c.encode_batch(readings)) == readings
+    commands = [("v1", True), ("v2", False)]
+    assert codec.decode_commands(c.encode_commands(commands)) == commands
+
+
+def test_invalid_payloads_raise_value_error():
+    with pytest.raises(ValueError):
+        codec.detect(b"")
+    with pytest.raises(ValueError):
+        codec.detect(b"\xff\x00")
+    with pytest.raises(ValueError):
+        codec.BIN1.decode_temperature(b"\x01\x00")
+    with pytest.raises(ValueError):
+        # id dichiarato più lungo del payload
+        codec.BIN1.decode_batch(codec.BIN1.encode_batch([("v1", 20.0, None)])[:-12])
+    with pytest.raises(ValueError):
+        codec.BIN1.encode_batch([("x" * 256, 20.0, None)])
+
+
+def test_negotiate_prefers_binary():
+    assert codec.negotiate(["json", "bin1"]) is codec.BIN1
+    assert codec.negotiate(["json"]) is codec.JSON
+    assert codec.negotiate(None) is codec.JSON
@@ -0,0 +1,152 @@
+import threading
+import time
+
+import pytest
+
+from thermostat.core.controller import ThermostatController
+from thermostat.core.registry import ValveState
+from thermostat.db.repository import ThermostatRepository
+from thermostat.mqtt import codec
+from thermostat.mqtt.client import MQTTClient
+from thermostat.mqtt.localbroker import LocalBroker, LocalClient
+
+
+def _wait(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_db_maintenance_does_not_delay_offline_deadlines(db):
+    controller = ThermostatController(LocalClient(LocalBroker(), "controller"))
+    controller.OFFLINE_TIMEOUT = 0.2
+    started = threading.Event()
+
+    def slow_retention(days, archive_path=None):
+        started.set()
+        time.sleep(1.0)
+        return []
+
+    controller.repository.apply_retention = slow_retention
+    try:
+        controller.start_retention(30)
+        assert started.wait(1.0)
+        controller.handle_temperature("v1", 20.0)
+        # la scadenza offline (0.2 s) non aspetta la retention (1 s)
+        assert _wait(lambda: controller.valves["v1"].state == ValveState.OFFLINE, timeout=0.6)
+    finally:
+        controller.stop()
+
+
+def test_expired_override_is_cleared_off_the_scheduler_thread(db):
+    controller = ThermostatController(LocalClient(LocalBroker(), "controller"))
+    threads = []
+    clear = controller.repository.clear_valve_override
+
+    def record_thread(valve_id):
+        threads.append(threading.current_thread().name)
+        clear(valve_id)
+
+    controller.repository.clear_valve_override = record_thread
+    try:
+        controller.repository.set_valve_override("v1", True, time.time() + 0.1)
+        assert _wait(lambda: controller.state.get_override("v1") is None)
+        assert threads and all(name.startswith("controller-maintenance") for name in threads)
+    finally:
+        controller.stop()
+
+
+class _Commands:
+    # osservatore dei comandi pubblicati dal controller sul LocalBroker
+    def __init__(self, broker):
+        self.client = LocalClient(broker, "observer")
+        self.client.on_message = self._on_message
+        self.client.connect()
+        self.client.subscribe("home/valves/+/command")
+        self.client.loop_start()
+        self.received = {}
+        self._cond = threading.Condition()
+
+    def _on_message(self, client, userdata, msg):
+        with self._cond:
+            self.received[msg.topic.split("/")[2]] = codec.decode_command(msg.payload)
+            self._cond.notify_all()
+
+    def wait(self, expected, timeout=2.0):
+        # attende che l'ultimo comando di ogni valvola sia quello atteso
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: all(self.received.get(v) == h for v, h in expected.items()), timeout
+            )
+
+    def close(self):
+        self.client.loop_stop()
+
+
+@pytest.fixture
+def room_controller(db):
+    broker = LocalBroker()
+    commands = _Commands(broker)
+    controller = ThermostatController(LocalClient(broker, "controller"))
+    # tick lungo: le decisioni immediate non devono aspettarlo
+    controller.ROOM_TICK = 3600.0
+    repo = controller.repository
+    repo.save_room("living", "Soggiorno", 21.0, 0.5)
+    for vid in ("v1", "v2"):
+        repo.assign_valve_to_room(vid, "living")
+        controller.handle_temperature(vid, 19.0)
+    yield controller, commands
+    controller.stop()
+    commands.close()
+
+
+def test_room_valves_wait_for_the_tick(room_controller):
+    controller, commands = room_controller
+    assert not commands.wait({"v1": True}, timeout=0.2)
+
+
+def test_room_target_change_is_applied_immediately(room_controller):
+    controller, commands = room_controller
+    controller.repository.update_room("living", "Soggiorno", 21.0, 0.5)
+    assert commands.wait({"v1": True, "v2": True})
+    # target pubblicato per la stanza: nuovo target sotto la temperatura attuale
+    controller.update_room_target("living", 17.0)
+    assert commands.wait({"v1": False, "v2": False})
+    assert controller.state.rooms["living"]["target_temp"] == 17.0
+
+
+def test_valve_setpoint_topic_never_targets_a_room_with_the_same_id(db):
+    client = MQTTClient(client=LocalClient(LocalBroker(), "controller"))
+    controller = client.controller
+    try:
+        controller.repository.save_room("living", "Soggiorno", 21.0, 0.5)
+        # una valvola senza stanza con lo stesso id della stanza
+        controller.handle_temperature("living", 19.0)
+        client.dispatch("home/thermostat/setpoint/living", b'{"setpoint": 25.0}')
+        assert controller.valves["living"].setpoint == 25.0
+        assert controller.state.rooms["living"]["target_temp"] == 21.0
+        client.dispatch("home/thermostat/room_setpoint/living", b'{"setpoint": 17.0}')
+        assert _wait(lambda: controller.state.rooms["living"]["target_temp"] == 17.0)
+        assert controller.valves["living"].setpoint == 25.0
+    finally:
+        controller.stop()
+
+
+def test_override_of_room_valve_is_applied_immediately(room_controller):
+    controller, commands = room_controller
+    controller.repository.set_valve_override("v1", False, None)
+    assert commands.wait({"v1": False, "v2": True})
+    controller.repository.clear_valve_override("v1")
+    assert commands.wait({"v1": True, "v2": True})
+
+
+def test_room_change_from_another_process_is_applied_on_reload(room_controller):
+    controller, commands = room_controller
+    # scrittura da un'altra connessione (come l'API): la vede solo il poll della cache
+    other = threading.Thread(target=ThermostatRepository().update_room, args=("living", "Soggiorno", 23.0, 0.5))
+    other.start()
+    other.join()
+    assert commands.wait({"v1": True, "v2": True}, timeout=3.0)
@@ -0,0 +1,39 @@
+import sqlite3
+import threading
+
+import pytest
+
+from thermostat.db import database
+
+
+def test_connection_is_reused_per_thread(db):
+    assert database.get_connection() is database.get_connection()
+
+
+def test_connections_of_exited_threads_are_pruned(db):
+    manager = database.connections
+    opened = []
+
+    def work():
+        opened.append(database.get_connection())
+
+    threads = [threading.Thread(target=work) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    manager.prune()
+    # resta solo quella del thread del test
+    assert manager.open_count() == 1
+    for conn in opened:
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
+
+
+def test_close_all_closes_connections_of_other_threads(db):
+    opened = []
+    t = threading.Thread(target=lambda: opened.append(database.get_connection()))
+    t.start()
+    t.join()
+    database.close_connections()
+    assert database.connections.open_count() == 0
@@ -0,0 +1,72 @@
+import sqlite3
+
+from thermostat.db import database
+from thermostat.db.partitions import READINGS_VIEW, VIEW_PARTITIONS, partitions
+from thermostat.db.repository import ThermostatRepository
+
+DAY = 86400
+START = 1_700_000_000 // DAY * DAY
+
+
+def _count(sql):
+    return database.get_connection().execute(sql).fetchone()[0]
+
+
+def test_readings_are_routed_to_daily_partitions(db):
+    repo = ThermostatRepository()
+    repo.save_temperature("v1", 20.0, START + 10)
+    repo.save_temperature("v1", 21.0, START + DAY + 10)
+    cursor = database.get_connection().cursor()
+    assert [p[0] for p in partitions.list(cursor)] == ["readings_20231114", "readings_20231115"]
+    history = repo.get_valve_history("v1", resolution="raw")
+    assert [r["temperature"] for r in history] == [21.0, 20.0]
+
+
+def test_more_partitions_than_a_compound_select_allows(db):
+    repo = ThermostatRepository()
+    days = 520
+    for day in range(days):
+        # ogni giorno nuovo crea una partizione e ricrea la vista
+        repo.save_temperature("v1", 20.0, START + day * DAY)
+    cursor = database.get_connection().cursor()
+    assert len(partitions.list(cursor)) == days
+    # la vista copre solo le partizioni più recenti, lo storico passa dal catalogo
+    assert _count(f"SELECT COUNT(*) FROM {READINGS_VIEW}") == VIEW_PARTITIONS
+    assert _count(f"SELECT MIN(timestamp) FROM {READINGS_VIEW}") == START + (days - VIEW_PARTITIONS) * DAY
+    history = repo.get_valve_history("v1", limit=days, resolution="raw")
+    assert len(history) == days
+
+
+def test_legacy_table_with_many_days_is_migrated(tmp_path, monkeypatch):
+    path = str(tmp_path / "legacy.db")
+    monkeypatch.setattr(database, "DB_NAME", path)
+    days = 510
+    conn = sqlite3.connect(path)
+    conn.execute(f"CREATE TABLE {READINGS_VIEW} (id INTEGER PRIMARY KEY, valve_id TEXT, temperature REAL, timestamp REAL)")
+    conn.executemany(
+        f"INSERT INTO {READINGS_VIEW} (valve_id, temperature, timestamp) VALUES (?, ?, ?)",
+        [("v1", 20.0, START + day * DAY + 60) for day in range(days)],
+    )
+    conn.commit()
+    conn.close()
+    partitions.invalidate()
+    try:
+        database.init_db()
+        cursor = database.get_connection().cursor()
+        assert len(partitions.list(cursor)) == days
+        assert sum(_count(f"SELECT COUNT(*) FROM {p[0]}") for p in partitions.list(cursor)) == days
+        assert _count(f"SELECT type = 'view' FROM sqlite_master WHERE name = '{READINGS_VIEW}'") == 1
+    finally:
+        database.close_connections()
+        partitions.invalidate()
+
+
+def test_retention_drops_whole_partitions(db):
+    repo = ThermostatRepository()
+    for day in range(3):
+        repo.save_temperature("v1", 20.0, START + day * DAY)
+    conn = database.get_connection()
+    with conn:
+        dropped = partitions.drop_before(conn.cursor(), START + 2 * DAY)
+    assert dropped == ["readings_20231114", "readings_20231115"]
+    assert _count(f"SELECT COUNT(*) FROM {READINGS_VIEW}") == 1
@@ -0,0 +1,39 @@
+import pytest
+
+from thermostat.db import database
+from thermostat.db.partitions import partitions
+
+# le stesse query del repository e dell'export su una partizione: (sql, parametri, indici attesi)
+PLANS = {
+    "valve history": (
+        "SELECT temperature, timestamp FROM {name} WHERE valve_id = ? AND timestamp >= ? AND timestamp <= ? "
+        "ORDER BY timestamp DESC LIMIT ?",
+        ("valve7", 0, 1e12, 50),
+        ["COVERING INDEX {index}"],
+    ),
+    "room history": (
+        "SELECT t.temperature, t.timestamp FROM {name} t JOIN valves v ON t.valve_id = v.id "
+        "WHERE v.room_id = ? AND t.timestamp >= ? ORDER BY t.timestamp DESC LIMIT ?",
+        ("room3", 0, 50),
+        ["idx_valves_room_id", "COVERING INDEX {index}"],
+    ),
+    "export by room": (
+        "SELECT valve_id, temperature, timestamp FROM {name} "
+        "WHERE valve_id IN (SELECT id FROM valves WHERE room_id = ?)",
+        ("room3",),
+        ["COVERING INDEX {index}"],
+    ),
+}
+
+
+@pytest.mark.parametrize("label", sorted(PLANS))
+def test_history_queries_use_covering_indexes(db, label):
+    conn = database.get_connection()
+    with conn:
+        name = partitions.partition_for(conn.cursor(), 1_700_000_000)
+    sql, params, expected = PLANS[label]
+    index = f"idx_{name}_valve_ts"
+    rows = conn.execute("EXPLAIN QUERY PLAN " + sql.format(name=name), params).fetchall()
+    plan = " | ".join(r[3] for r in rows)
+    for item in expected:
+        assert item.format(index=index) in plan
@@ -0,0 +1,71 @@
+import pytest
+
+from thermostat.core.rooms import RoomEngine
+
+
+def test_mean_and_min_aggregation():
+    engine = RoomEngine("mean")
+    assert engine.update("living", "v1", 20.0) == ["living"]
+    # la stanza è già da decidere: non va riprogrammata
+    assert engine.update("living", "v2", 22.0) == []
+    assert engine.temperature("living") == 21.0
+    engine.set_aggregation("min")
+    assert engine.temperature("living") == 20.0
+    # la valvola minima sale: il minimo passa all'altra
+    engine.update("living", "v1", 23.0)
+    assert engine.temperature("living") == 22.0
+
+
+def test_weighted_aggregation_uses_announced_weights():
+    engine = RoomEngine("weighted")
+    engine.update("living", "v1", 20.0)
+    engine.update("living", "v2", 23.0)
+    engine.set_weight("v2", 2.0)
+    assert engine.temperature("living") == pytest.approx(22.0)
+    engine.set_weight("v2", None)
+    assert engine.temperature("living") == pytest.approx(21.5)
+
+
+def test_take_clears_dirty_and_new_readings_wake_the_room():
+    engine = RoomEngine()
+    engine.update("living", "v1", 20.0)
+    temperature, valves, heating = engine.take("living")
+    assert (temperature, valves, heating) == (20.0, ["v1"], None)
+    engine.set_heating("living", True)
+    assert engine.update("living", "v1", 20.5) == ["living"]
+    assert engine.take("living")[2] is True
+    assert engine.take("missing") == (None, (), None)
+
+
+def test_valve_counted_in_one_room_only():
+    engine = RoomEngine()
+    engine.update("living", "v1", 20.0)
+    engine.update("living", "v2", 22.0)
+    engine.take("living")
+    # riassegnata: esce dalla stanza di prima, che torna da decidere
+    assert engine.update("kitchen", "v2", 18.0) == ["living", "kitchen"]
+    assert engine.temperature("living") == 20.0
+    assert engine.temperature("kitchen") == 18.0
+    engine.take("living")
+    assert engine.remove("v1") == ["living"]
+    assert engine.temperature("living") is None
+    assert "v1" not in engine
+
+
+def test_reload_drops_deleted_rooms_and_reassigned_valves():
+    engine = RoomEngine()
+    engine.update("living", "v1", 20.0)
+    engine.update("living", "v2", 22.0)
+    engine.update("attic", "v3", 15.0)
+    for room_id in engine.room_ids():
+        engine.take(room_id)
+    woken = engine.reload({"v1": "living", "v2": "kitchen"}, {"living": {}, "kitchen": {}})
+    assert woken == ["living"]
+    assert engine.temperature("living") == 20.0
+    assert "attic" not in engine.room_ids()
+    assert "v3" not in engine
+
+
+def test_invalid_aggregation():
+    with pytest.raises(ValueError):
+        RoomEngine("median")
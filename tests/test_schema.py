@@ -0,0 +1,22 @@
+from thermostat.api.schema import RoomCreate, ValveRegister, validate_rows
+
+
+def test_malformed_rows_become_row_errors():
+    rows = [
+        {"id": "living", "name": "Soggiorno"},
+        "living",
+        None,
+        42,
+        {"id": "kitchen", "name": "Cucina", "target_temp": "caldo"},
+        {"id": "attic", "name": "Soffitta", "hysteresis": 1.0},
+    ]
+    valid, errors = validate_rows(RoomCreate, rows)
+    assert [(i, m.id) for i, m in valid] == [(0, "living"), (5, "attic")]
+    assert [(e.row, e.id) for e in errors] == [(1, None), (2, None), (3, None), (4, "kitchen")]
+    assert errors[3].errors[0].startswith("target_temp:")
+
+
+def test_valve_rows_keep_optional_room():
+    valid, errors = validate_rows(ValveRegister, [{"id": "v1"}, {"id": "v2", "room_id": "living"}, {"room_id": "x"}])
+    assert [(m.id, m.room_id) for _, m in valid] == [("v1", None), ("v2", "living")]
+    assert [(e.row, e.errors) for e in errors] == [(2, ["id: Field required"])]
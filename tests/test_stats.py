@@ -0,0 +1,48 @@
+import pytest
+
+from thermostat.core.stats import HEATING, RollingStats
+
+HOUR = 3600
+# istante allineato ai bucket di entrambe le finestre di default (600 s e 3600 s)
+T = 2000 * HOUR
+IDLE = 0
+
+
+def test_temperature_summary_and_duty_cycle():
+    stats = RollingStats()
+    stats.record("v1", 19.0, HEATING, T)
+    stats.record("v1", 21.0, IDLE, T + 300)
+    stats.record("v1", 20.0, IDLE, T + 600)
+    window = stats.snapshot("v1", T + 600)["windows"]["1h"]
+    assert window["count"] == 3
+    assert window["mean"] == 20.0
+    assert (window["min"], window["max"]) == (19.0, 21.0)
+    assert window["observed_s"] == 600
+    assert window["heating_s"] == 300
+    assert window["duty_cycle"] == 0.5
+    assert window["transitions"] == 1
+
+
+def test_old_buckets_leave_the_window():
+    stats = RollingStats()
+    stats.record("v1", 19.0, IDLE, T)
+    stats.record("v1", 21.0, IDLE, T + 2 * HOUR)
+    window = stats.snapshot("v1", T + 2 * HOUR)["windows"]["1h"]
+    assert window["count"] == 1
+    assert window["mean"] == 21.0
+
+
+def test_gap_longer_than_the_window_is_split_across_buckets():
+    stats = RollingStats()
+    stats.record("v1", 20.0, HEATING, T)
+    # la valvola torna dopo 3 ore offline
+    stats.record("v1", 20.0, HEATING, T + 3 * HOUR)
+    windows = stats.snapshot("v1", T + 3 * HOUR)["windows"]
+    # la finestra di 1 h conta al più i suoi bucket, non tutto il buco
+    assert windows["1h"]["observed_s"] == pytest.approx(HOUR - 600)
+    assert windows["1h"]["duty_cycle"] == 1.0
+    assert windows["24h"]["observed_s"] == pytest.approx(3 * HOUR)
+    # un'ora per bucket: dopo 25 ore resta solo l'ultima ora del buco
+    later = stats.snapshot("v1", T + 25 * HOUR)["windows"]["24h"]
+    assert later["observed_s"] == pytest.approx(HOUR)
+    assert later["heating_s"] == pytest.approx(HOUR)
@@ -0,0 +1,100 @@
+import sqlite3
+import threading
+
+from thermostat.db.repository import ThermostatRepository
+from thermostat.db.writer import WriteBehindWriter
+
+
+def _count_readings(repo, valve_id):
+    return len(repo.get_valve_history(valve_id, limit=100000, resolution="raw"))
+
+
+def test_flush_writes_readings_and_valves(db):
+    repo = ThermostatRepository()
+    writer = WriteBehindWriter(repo, flush_interval=5.0)
+    try:
+        for i in range(10):
+            writer.save_temperature("v1", 20.0 + i, 1000.0 + i)
+        writer.save_valve("v1", 21.5, 1009.0, 1)
+        assert writer.flush(5)
+        assert _count_readings(repo, "v1") == 10
+        assert repo.get_valve("v1")["setpoint"] == 21.5
+    finally:
+        writer.close()
+
+
+def test_close_drains_queue_and_later_puts_are_written(db):
+    repo = ThermostatRepository()
+    writer = WriteBehindWriter(repo, flush_interval=5.0)
+    for i in range(100):
+        writer.save_temperature("v1", 20.0, 1000.0 + i)
+    writer.close()
+    assert _count_readings(repo, "v1") == 100
+    # dopo la chiusura le scritture sono sincrone
+    writer.save_temperature("v1", 20.0, 2000.0)
+    assert _count_readings(repo, "v1") == 101
+    assert writer.flush(1)
+
+
+def test_no_reading_lost_when_closing_under_concurrent_producers(db):
+    repo = ThermostatRepository()
+    writer = WriteBehindWriter(repo, batch_size=50, flush_interval=0.01)
+    n_threads, per_thread = 4, 500
+    start = threading.Barrier(n_threads + 1)
+
+    def produce(t):
+        start.wait()
+        for i in range(per_thread):
+            writer.save_temperature(f"v{t}", 20.0, 1000.0 + i)
+
+    threads = [threading.Thread(target=produce, args=(t,)) for t in range(n_threads)]
+    for t in threads:
+        t.start()
+    start.wait()
+    writer.close()
+    for t in threads:
+        t.join()
+    assert sum(_count_readings(repo, f"v{t}") for t in range(n_threads)) == n_threads * per_thread
+
+
+class _FlakyRepository(ThermostatRepository):
+    # fallisce le prime `failures` scritture come un DB bloccato da un altro processo
+    def __init__(self, failures):
+        super().__init__()
+        self.failures = failures
+
+    def write_batch(self, readings, valves):
+        if self.failures:
+            self.failures -= 1
+            raise sqlite3.OperationalError("database is locked")
+        super().write_batch(readings, valves)
+
+
+def test_transient_errors_are_retried(db):
+    repo = _FlakyRepository(failures=2)
+    writer = WriteBehindWriter(repo, flush_interval=0.01, retry_backoff=0.001)
+    try:
+        writer.save_temperature("v1", 20.0, 1000.0)
+        assert writer.flush(5)
+        stats = writer.stats()
+        assert stats["flush_retries"] == 2
+        assert stats["readings_lost"] == 0
+        assert _count_readings(repo, "v1") == 1
+    finally:
+        writer.close()
+
+
+def test_batch_is_counted_as_lost_after_max_retries(db):
+    repo = _FlakyRepository(failures=100)
+    writer = WriteBehindWriter(repo, flush_interval=0.01, max_retries=2, retry_backoff=0.001)
+    try:
+        writer.save_temperature("v1", 20.0, 1000.0)
+        writer.save_valve("v1", 21.0, 1000.0)
+        assert writer.flush(5)
+        stats = writer.stats()
+        assert stats["flush_retries"] == 2
+        assert stats["readings_lost"] == 1
+        assert stats["valves_lost"] == 1
+    finally:
+        repo.failures = 0
+        writer.close()
@@ -6,22 +6,96 @@ import sys
 import re
 import os
 import signal
+import asyncio
+import csv
+import io
+import logging
+import urllib.error
+import urllib.parse
+import urllib.request
+from array import array
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, HTTPException, Query
 from fastapi.templating import Jinja2Templates
 from pathlib import Path
-from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi import Request, Form
+from typing import Any
+from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse, Response
+from fastapi import Request, Form, Body, File, UploadFile
 
 from thermostat.db.database import get_connection
 from thermostat.db.repository import ThermostatRepository
-from thermostat.api.schema import RoomCreate, ValveRegister, SetpointModel
+from thermostat.db.async_repository import AsyncThermostatRepository
+from thermostat.db.rollups import RESOLUTIONS
+from thermostat.db import export
+from thermostat.api.schema import (
+    RoomCreate, ValveRegister, SetpointModel, BatchResult, RowError, validate_rows, MAX_BATCH_ROWS,
+)
+from thermostat.api.live import LiveHub
+from thermostat.api.cache import ResponseCache, dump_json, etag_matches
+from thermostat import metrics
+
+logger = logging.getLogger(__name__)
+
+
+# le rotte usano la variante async: letture e scritture su executor dedicati
+repo = AsyncThermostatRepository(ThermostatRepository())
+# stato live delle valvole per la dashboard (subscriber MQTT + fan-out SSE)
+live = LiveHub()
+repo.repository.add_listener(live.on_repository_event)
+# corpi serializzati di /valves, /rooms e / validi finché il DB non cambia
+cache = ResponseCache()
+
+# metriche dell'API, esposte su /metrics insieme a quelle del controller (se configurato)
+REQUEST_SECONDS = metrics.REGISTRY.histogram(
+    "thermostat_api_request_seconds", "Durata delle richieste HTTP fino all'invio degli header",
+    ("method", "route", "status"), buckets=metrics.REQUEST_BUCKETS,
+)
+LIVE_CLIENTS = metrics.REGISTRY.gauge("thermostat_api_live_clients", "Client SSE collegati a /live")
+LIVE_CLIENTS.set_function(lambda: live.stats()["clients"])
+CACHE_REQUESTS = metrics.REGISTRY.counter(
+    "thermostat_api_cache_total", "Risposte memoizzate servite dalla cache (hit) o ricostruite (miss)", ("key", "result"),
+)
+CACHE_REQUESTS.set_function(cache.counts)
+CONTROLLER_UP = metrics.REGISTRY.gauge("thermostat_api_controller_scrape_up", "1 se /metrics del controller è raggiungibile")
+# listener del controller avviato con --metrics-port (es. http://127.0.0.1:9100/metrics)
+CONTROLLER_METRICS_URL = os.getenv("CONTROLLER_METRICS_URL")
+# listener dei controller per le statistiche mobili (/stats/...), separati da virgola in
+# modalità cluster (un worker per porta); default: la base di CONTROLLER_METRICS_URL
+CONTROLLER_URLS = [
+    u.strip().rstrip("/")
+    for u in os.getenv("CONTROLLER_URLS", (CONTROLLER_METRICS_URL or "").rsplit("/metrics", 1)[0]).split(",")
+    if u.strip()
+]
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # una sola lettura delle valvole all'avvio, poi lo stato arriva via MQTT
+    live.load(await repo.get_valves())
+    live.start()
+    yield
+    await live.stop()
+    repo.close()
+    cache.close()
+
+
+app = FastAPI(title="Smart Thermostat API", lifespan=lifespan)
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    # durata per rotta (template del path, non il path effettivo) e status
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    REQUEST_SECONDS.observe(
+        time.perf_counter() - start, request.method, route.path if route else "unmatched", str(response.status_code)
+    )
+    return response
 
-
-app = FastAPI(title="Smart Thermostat API")
 # path dei template Jinja2
 templates = Jinja2Templates(directory=str(Path(__file__).resolve().parent / "templates"))
-repo = ThermostatRepository()
 
 # Client paho usato dall'API per pubblicare comandi (non per sottoscrizioni)
 mqtt_client = mqtt.Client()
@@ -32,63 +106,310 @@ mqtt_client.loop_start()
 # key: nome scelto dall'utente, value: subprocess.Popen
 _sim_procs: dict[str, subprocess.Popen] = {}
 
+# valori ammessi per il parametro resolution degli endpoint di storico
+RESOLUTION_CHOICES = ("auto", "raw") + tuple(RESOLUTIONS)
+
 
 def _valid_id(s: str) -> bool:
     # validazione semplice per gli id usati nella UI (solo lettere numeri _ e -)
     return re.match(r'^[A-Za-z0-9_\-]+$', s) is not None
 
 
+async def _cached_response(request, key, scope, build, media_type="application/json"):
+    # risposta memoizzata con ETag; 304 se il client ha già la versione corrente
+    # il token interroga SQLite: lo leggiamo sull'executor delle letture
+    token = await repo.read(cache.token, scope)
+    etag, body = await cache.get(key, token, build)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type=media_type, headers=headers)
+
+
 @app.get("/valves")
-def get_valves():
+async def get_valves(request: Request):
     # ritorna elenco di valvole salvate nel DB (JSON)
-    return repo.get_valves()
+    async def build():
+        return dump_json(await repo.get_valves())
+
+    return await _cached_response(request, "valves", "data", build)
+
+
+@app.get("/live")
+async def live_stream():
+    # stream SSE: snapshot iniziale e poi solo i campi cambiati delle valvole
+    return StreamingResponse(
+        live.stream(live.subscribe()),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _controller_metrics():
+    with urllib.request.urlopen(CONTROLLER_METRICS_URL, timeout=2.0) as resp:
+        return resp.read().decode()
+
+
+def _controller_stats(path):
+    # statistiche dal primo controller che conosce la valvola/stanza; None se nessuno
+    # (nel cluster ogni worker ha solo il proprio slice); OSError se nessuno è raggiungibile
+    reachable = False
+    error = None
+    for base in CONTROLLER_URLS:
+        try:
+            with urllib.request.urlopen(base + path, timeout=2.0) as resp:
+                return json.loads(resp.read())
+        except urllib.error.HTTPError as exc:
+            reachable = True
+            if exc.code != 404:
+                error = exc
+        except OSError as exc:
+            error = exc
+    if error is not None and not reachable:
+        raise error
+    return None
+
+
+async def _stats_response(path, not_found):
+    if not CONTROLLER_URLS:
+        raise HTTPException(status_code=503, detail="Listener del controller non configurato (CONTROLLER_URLS)")
+    try:
+        data = await asyncio.to_thread(_controller_stats, path)
+    except OSError as exc:
+        logger.warning("Statistiche del controller non disponibili: %s", exc)
+        raise HTTPException(status_code=503, detail="Controller non raggiungibile")
+    if data is None:
+        raise HTTPException(status_code=404, detail=not_found)
+    return data
+
+
+@app.get("/valves/{valve_id}/stats")
+async def valve_stats(valve_id: str):
+    # statistiche mobili (1h, 24h) tenute in memoria dal controller: nessuna query sul DB
+    return await _stats_response(f"/stats/valves/{urllib.parse.quote(valve_id, safe='')}", "Nessuna statistica per la valvola")
+
+
+@app.get("/rooms/{room_id}/stats")
+async def room_stats(room_id: str):
+    # come /valves/{id}/stats, sulla temperatura aggregata e le decisioni della stanza
+    return await _stats_response(f"/stats/rooms/{urllib.parse.quote(room_id, safe='')}", "Nessuna statistica per la stanza")
+
+
+@app.get("/metrics")
+async def get_metrics():
+    # metriche dell'API seguite da quelle del controller (nomi disgiunti, concatenabili)
+    controller = ""
+    if CONTROLLER_METRICS_URL:
+        try:
+            controller = await asyncio.to_thread(_controller_metrics)
+            CONTROLLER_UP.set(1)
+        except OSError as exc:
+            logger.warning("Metriche del controller non disponibili: %s", exc)
+            CONTROLLER_UP.set(0)
+    return Response(metrics.REGISTRY.render() + controller, media_type=metrics.CONTENT_TYPE)
 
 
 @app.get("/valves/{valve_id}/history")
-def get_history(valve_id: str, from_ts: float = None, to_ts: float = None, limit: int = 50):
-    # restituisce lo storico di una valvola con filtri opzionali
-    history = repo.get_valve_history(valve_id, from_ts, to_ts, limit)
+async def get_history(valve_id: str, from_ts: float = None, to_ts: float = None, limit: int = 50, resolution: str = "auto"):
+    # restituisce lo storico di una valvola con filtri opzionali; con resolution=auto
+    # per intervalli lunghi vengono usati i rollup (punti con min/max/count)
+    if resolution not in RESOLUTION_CHOICES:
+        raise HTTPException(status_code=400, detail=f"resolution deve essere uno tra {', '.join(RESOLUTION_CHOICES)}")
+    history = await repo.get_valve_history(valve_id, from_ts, to_ts, limit, resolution)
     if not history:
         # 404 se non ci sono dati
         raise HTTPException(status_code=404, detail="Valvola non trovata o nessun dato disponibile")
     return history
 
 
+@app.get("/export")
+async def export_history(
+    format: str = Query("csv"),
+    valve_id: str | None = Query(None),
+    room_id: str | None = Query(None),
+    from_ts: float | None = Query(None),
+    to_ts: float | None = Query(None),
+):
+    # export in streaming dello storico (csv, ndjson o arrow se pyarrow è installato):
+    # le righe vengono lette a blocchi e inviate senza costruire il risultato in memoria
+    formats = export.available_formats()
+    if format not in formats:
+        raise HTTPException(status_code=400, detail=f"format deve essere uno tra {', '.join(formats)}")
+    media_type = export.FORMATS[format][0]
+    filename = f"readings.{format}"
+    return StreamingResponse(
+        export.stream_export(format, valve_id, room_id, from_ts, to_ts),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
 @app.post("/rooms", status_code=201)
-def create_room(payload: RoomCreate):
+async def create_room(payload: RoomCreate):
     # crea/aggiorna una stanza
-    repo.save_room(payload.id, payload.name, payload.target_temp, payload.hysteresis)
+    await repo.save_room(payload.id, payload.name, payload.target_temp, payload.hysteresis)
     return {"message": "room created", "room_id": payload.id}
 
 
+def _check_batch_size(rows):
+    if len(rows) > MAX_BATCH_ROWS:
+        raise HTTPException(status_code=413, detail=f"Massimo {MAX_BATCH_ROWS} righe per batch")
+
+
+async def _read_csv(file: UploadFile):
+    # righe del CSV caricato come dict; le celle vuote sono omesse così valgono i default del modello
+    try:
+        text = (await file.read()).decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Il CSV deve essere codificato in UTF-8")
+    return [{k: v for k, v in row.items() if k and v not in (None, "")} for row in csv.DictReader(io.StringIO(text))]
+
+
+async def _save_rooms(rows):
+    # valida riga per riga e salva tutte le stanze valide in un'unica transazione
+    _check_batch_size(rows)
+    valid, errors = await asyncio.to_thread(validate_rows, RoomCreate, rows)
+    await repo.save_rooms([m.model_dump(include={"id", "name", "target_temp", "hysteresis"}) for _, m in valid])
+    return BatchResult(saved=len(valid), errors=errors)
+
+
+async def _register_valves(rows):
+    # come _save_rooms; una valvola che riferisce una stanza inesistente è un errore di riga
+    _check_batch_size(rows)
+    valid, errors = await asyncio.to_thread(validate_rows, ValveRegister, rows)
+    known = {r["id"] for r in await repo.get_rooms()}
+    valves = []
+    for i, m in valid:
+        if m.room_id and m.room_id not in known:
+            errors.append(RowError(row=i, id=m.id, errors=[f"room_id: stanza {m.room_id} inesistente"]))
+        else:
+            valves.append((m.id, m.room_id))
+    errors.sort(key=lambda e: e.row)
+    await repo.register_valves(valves)
+    return BatchResult(saved=len(valves), errors=errors)
+
+
+@app.post("/rooms/batch", response_model=BatchResult)
+async def create_rooms_batch(rows: list[Any] = Body(...)):
+    # provisioning di molte stanze (lista JSON di oggetti come POST /rooms); gli elementi
+    # non oggetto diventano errori di riga in validate_rows invece di un 422 per tutto il batch
+    return await _save_rooms(rows)
+
+
+@app.post("/rooms/batch/csv", response_model=BatchResult)
+async def create_rooms_batch_csv(file: UploadFile = File(...)):
+    # come /rooms/batch da un CSV con intestazione id,name,target_temp,hysteresis
+    return await _save_rooms(await _read_csv(file))
+
+
+@app.post("/valves/batch", response_model=BatchResult)
+async def register_valves_batch(rows: list[Any] = Body(...)):
+    # provisioning di molte valvole (lista JSON di oggetti come POST /valves), come /rooms/batch
+    return await _register_valves(rows)
+
+
+@app.post("/valves/batch/csv", response_model=BatchResult)
+async def register_valves_batch_csv(file: UploadFile = File(...)):
+    # come /valves/batch da un CSV con intestazione id,room_id
+    return await _register_valves(await _read_csv(file))
+
+
 @app.get("/rooms")
-def list_rooms():
-    # lista stanze
-    return repo.get_rooms()
+async def list_rooms(request: Request):
+    # lista stanze (invalidata solo dalle modifiche di configurazione)
+    async def build():
+        return dump_json(await repo.get_rooms())
+
+    return await _cached_response(request, "rooms", "config", build)
 
 
 @app.post("/valves", status_code=201)
-def register_valve(payload: ValveRegister):
+async def register_valve(payload: ValveRegister):
     # registra una valvola: se viene fornita una room la assegna
     if payload.room_id:
-        repo.assign_valve_to_room(payload.id, payload.room_id)
+        await repo.assign_valve_to_room(payload.id, payload.room_id)
     else:
-        repo.save_valve(payload.id, 22.0, time.time())
+        await repo.save_valve(payload.id, 22.0, time.time())
     return {"message": "valve registered", "valve_id": payload.id}
 
 
+def _json_column(values):
+    # array piatto -> lista JSON (NaN = nessun dato -> null)
+    return [None if v != v else round(v, 3) for v in values]
+
+
+def _matrix_json(m):
+    # matrice colonnare: per ogni statistica una lista di righe (una per stanza)
+    n = m["buckets"]
+
+    def rows(values):
+        return [_json_column(values[i * n:(i + 1) * n]) for i in range(len(m["rooms"]))]
+
+    return dump_json({
+        "rooms": m["rooms"],
+        "start": m["start"],
+        "bucket": m["bucket"],
+        "buckets": n,
+        "mean": rows(m["mean"]),
+        "min": rows(m["min"]),
+        "max": rows(m["max"]),
+        "count": [list(m["count"][i * n:(i + 1) * n]) for i in range(len(m["rooms"]))],
+    })
+
+
+@app.get("/rooms/matrix")
+async def rooms_matrix(
+    from_ts: float | None = Query(None),
+    to_ts: float | None = Query(None),
+    buckets: int = Query(500, ge=1, le=5000),
+    rooms: str | None = Query(None),
+    format: str = Query("json"),
+):
+    # panoramica dell'edificio in una sola richiesta: stanze x bucket di tempo con media/min/max.
+    # json: formato colonnare (una riga per stanza); f32: float32 little-endian mean|min|max
+    # concatenati (stanze x bucket, NaN = nessun dato) con i metadati negli header X-Matrix-*
+    if format not in ("json", "f32"):
+        raise HTTPException(status_code=400, detail="format deve essere json o f32")
+    to_ts = time.time() if to_ts is None else to_ts
+    from_ts = to_ts - 86400 if from_ts is None else from_ts
+    if from_ts >= to_ts:
+        raise HTTPException(status_code=400, detail="from_ts deve precedere to_ts")
+    room_ids = [r for r in rooms.split(",") if r] if rooms else None
+    m = await repo.get_rooms_matrix(from_ts, to_ts, buckets, room_ids)
+
+    if format == "f32":
+        columns = [array("f", m[k]) for k in ("mean", "min", "max")]
+        if sys.byteorder == "big":
+            for column in columns:
+                column.byteswap()
+        body = b"".join(c.tobytes() for c in columns)
+        headers = {
+            "X-Matrix-Rooms": ",".join(m["rooms"]),
+            "X-Matrix-Start": str(m["start"]),
+            "X-Matrix-Bucket": str(m["bucket"]),
+            "X-Matrix-Buckets": str(m["buckets"]),
+        }
+        return Response(content=body, media_type="application/octet-stream", headers=headers)
+
+    # serializzazione fuori dal loop: con centinaia di stanze sono centinaia di migliaia di celle
+    body = await asyncio.to_thread(_matrix_json, m)
+    return Response(content=body, media_type="application/json")
+
+
 @app.get("/rooms/{room_id}/history")
-def room_history(room_id: str, from_ts: float | None = Query(None), to_ts: float | None = Query(None), limit: int = Query(50)):
-    # storico aggregato per stanza (usa join tra valves e temperature_readings)
-    room = repo.get_room(room_id)
+async def room_history(room_id: str, from_ts: float | None = Query(None), to_ts: float | None = Query(None), limit: int = Query(50), resolution: str = Query("auto")):
+    # storico aggregato per stanza (join tra valves e partizioni, oppure rollup per stanza)
+    if resolution not in RESOLUTION_CHOICES:
+        raise HTTPException(status_code=400, detail=f"resolution deve essere uno tra {', '.join(RESOLUTION_CHOICES)}")
+    room = await repo.get_room(room_id)
     if room is None:
         raise HTTPException(status_code=404, detail="Room not found")
-    history = repo.get_room_history(room_id, from_ts, to_ts, limit)
+    history = await repo.get_room_history(room_id, from_ts, to_ts, limit, resolution)
     return {"room_id": room_id, "history": history}
 
 
 @app.put("/valves/{valve_id}/setpoint")
-def update_setpoint(valve_id: str, data: SetpointModel):
+async def update_setpoint(valve_id: str, data: SetpointModel):
     # endpoint API per inviare un setpoint: pubblica su topic MQTT
     setpoint = data.setpoint
     topic = f"home/thermostat/setpoint/{valve_id}"
@@ -100,45 +421,49 @@ def update_setpoint(valve_id: str, data: SetpointModel):
 
 
 @app.get("/", response_class=HTMLResponse)
-def dashboard(request: Request):
-    # pagina HTML principale: passa stanze e valvole al template
-    rooms = repo.get_rooms()
-    valves = repo.get_valves()
-    return templates.TemplateResponse("DashBoard.html", {"request": request, "rooms": rooms, "valves": valves})
+async def dashboard(request: Request):
+    # pagina HTML principale: passa stanze e valvole al template (render memoizzato)
+    async def build():
+        rooms, valves = await asyncio.gather(repo.get_rooms(), repo.get_valves())
+        html = templates.get_template("DashBoard.html").render(request=request, rooms=rooms, valves=valves)
+        return html.encode()
+
+    # scope "config": lo stato delle valvole nella pagina viene sostituito dallo snapshot di /live
+    return await _cached_response(request, "dashboard", "config", build, media_type="text/html")
 
 
 @app.post("/web/valves/register")
-def web_register_valve(id: str = Form(...), room_id: str | None = Form(None)):
+async def web_register_valve(id: str = Form(...), room_id: str | None = Form(None)):
     # form web per registrare una valvola
     if room_id:
-        repo.assign_valve_to_room(id, room_id)
+        await repo.assign_valve_to_room(id, room_id)
     else:
-        repo.save_valve(id, 22.0, time.time())
+        await repo.save_valve(id, 22.0, time.time())
     return RedirectResponse(url="/", status_code=303)
 
 
 @app.post("/web/rooms/register")
-def web_register_room(id: str = Form(...), name: str = Form(...), target_temp: float = Form(21.0), hysteresis: float = Form(0.5)):
+async def web_register_room(id: str = Form(...), name: str = Form(...), target_temp: float = Form(21.0), hysteresis: float = Form(0.5)):
     # form web per registrare una stanza
-    repo.save_room(id, name, target_temp, hysteresis)
+    await repo.save_room(id, name, target_temp, hysteresis)
     return RedirectResponse(url="/", status_code=303)
 
 
 @app.post("/web/valves/{valve_id}/assign")
-def web_assign_valve(valve_id: str, room_id: str = Form(...)):
+async def web_assign_valve(valve_id: str, room_id: str = Form(...)):
     # assegna una valvola a una stanza via web form
-    repo.assign_valve_to_room(valve_id, room_id)
+    await repo.assign_valve_to_room(valve_id, room_id)
     return {"message": "assigned", "valve_id": valve_id, "room_id": room_id}
 
 
 @app.post("/web/valves/{valve_id}/command")
-def web_command_valve(valve_id: str, heating: str = Form(...), duration: int = Form(600)):
+async def web_command_valve(valve_id: str, heating: str = Form(...), duration: int = Form(600)):
     # riceve il comando dalla UI: heating può essere 'true'/'false' o '1'/'0'
     h = True if str(heating).lower() in ("1", "true", "yes", "on") else False
     # calcola timestamp di scadenza dell'override (None se duration<=0)
     expires = time.time() + int(duration) if duration and int(duration) > 0 else None
     # salva l'override sul DB
-    repo.set_valve_override(valve_id, h, expires)
+    await repo.set_valve_override(valve_id, h, expires)
 
     # pubblica anche il comando MQTT in modo che il simulatore riceva immediatamente
     topic = f"home/valves/{valve_id}/command"
@@ -148,7 +473,7 @@ def web_command_valve(valve_id: str, heating: str = Form(...), duration: int = F
 
 
 @app.post("/web/valves/{valve_id}/setpoint")
-def update_setpoint_web(valve_id: str, setpoint: float = Form(...)):
+async def update_setpoint_web(valve_id: str, setpoint: float = Form(...)):
     # form web per inviare setpoint
     topic = f"home/thermostat/setpoint/{valve_id}"
     payload = {"setpoint": setpoint}
@@ -159,28 +484,28 @@ def update_setpoint_web(valve_id: str, setpoint: float = Form(...)):
 
 
 @app.post("/web/valves/{valve_id}/delete")
-def web_delete_valve(valve_id: str):
+async def web_delete_valve(valve_id: str):
     # cancella valvola e relativo storico poi redirect alla dashboard
-    repo.delete_valve(valve_id)
+    await repo.delete_valve(valve_id)
     return RedirectResponse(url="/", status_code=303)
 
 
 @app.post("/web/rooms/{room_id}/edit")
-def web_edit_room(room_id: str, name: str = Form(...), target_temp: float = Form(21.0), hysteresis: float = Form(0.5)):
+async def web_edit_room(room_id: str, name: str = Form(...), target_temp: float = Form(21.0), hysteresis: float = Form(0.5)):
     # modifica i parametri di una stanza
-    repo.update_room(room_id, name, target_temp, hysteresis)
+    await repo.update_room(room_id, name, target_temp, hysteresis)
     return RedirectResponse(url="/", status_code=303)
 
 
 @app.post("/web/rooms/{room_id}/delete")
-def web_delete_room(room_id: str):
+async def web_delete_room(room_id: str):
     # elimina una stanza e deslega valvole
-    repo.delete_room(room_id)
+    await repo.delete_room(room_id)
     return RedirectResponse(url="/", status_code=303)
 
 
 @app.post("/web/simulators/start")
-def web_start_simulator(valves: str = Form(...), name: str = Form("sim")):
+async def web_start_simulator(valves: str = Form(...), name: str = Form("sim")):
     # avvia un processo Python che esegue il modulo simulatore con gli id passati
     ids = [v.strip() for v in valves.split(',') if v.strip()]
     if not ids:
@@ -199,7 +524,7 @@ def web_start_simulator(valves: str = Form(...), name: str = Form("sim")):
     cmd = [sys.executable, "-m", "valve_simulator.valve"] + ids
     p = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
     # breve controllo: se il processo esce subito segnaliamo errore
-    time.sleep(0.2)
+    await asyncio.sleep(0.2)
     if p.poll() is not None:
         rc = p.returncode
         raise HTTPException(status_code=500, detail=f"simulator process exited immediately (rc={rc})")
@@ -208,7 +533,7 @@ def web_start_simulator(valves: str = Form(...), name: str = Form("sim")):
 
 
 @app.post("/web/simulators/stop")
-def web_stop_simulator(name: str = Form(None), pid: int | None = Form(None)):
+async def web_stop_simulator(name: str = Form(None), pid: int | None = Form(None)):
     # arresta un simulatore preferendo la ricerca per nome
     if name:
         p = _sim_procs.get(name)
@@ -220,7 +545,8 @@ def web_stop_simulator(name: str = Form(None), pid: int | None = Form(None)):
             return {"message": "already stopped", "name": name}
         p.terminate()
         try:
-            p.wait(timeout=5)
+            # l'attesa della terminazione non deve bloccare il loop
+            await asyncio.to_thread(p.wait, 5)
         except subprocess.TimeoutExpired:
             p.kill()
         del _sim_procs[name]
@@ -240,7 +566,7 @@ def web_stop_simulator(name: str = Form(None), pid: int | None = Form(None)):
 
 
 @app.get("/web/simulators")
-def web_list_simulators():
+async def web_list_simulators():
     # lista dei simulatori attivi tracciati in memoria
     items = []
     for name, p in _sim_procs.items():
@@ -0,0 +1,101 @@
+import hashlib
+import json
+import sqlite3
+import threading
+
+from thermostat.db import database
+
+
+def dump_json(data):
+    # stessa serializzazione di JSONResponse di FastAPI
+    return json.dumps(data, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode()
+
+
+class ResponseCache:
+    """Cache dei corpi di risposta serializzati, invalidata da un token di modifica del DB.
+
+    Il token si basa su `PRAGMA data_version` letto da una connessione dedicata
+    che non scrive mai: il valore cambia solo quando un'altra connessione (di
+    qualsiasi processo) fa commit, e leggerlo non tocca le tabelle. Per le chiavi
+    che dipendono solo dalla configurazione (stanze) il token è `meta.config_rev`,
+    riletto solo quando data_version è cambiato: le scritture continue delle
+    letture di temperatura non invalidano la lista stanze.
+
+    Gli scope seguono le tabelle lette dalla risposta: `/rooms` e la dashboard
+    (i cui valori delle valvole vengono sostituiti dallo snapshot di `/live`)
+    usano "config"; `/valves` usa "data" perché `last_seen` e lo stato delle
+    valvole cambiano a ogni flush del writer, quindi il suo hit rate è limitato
+    dalla frequenza dei flush. Hit e miss per chiave sono contati in `counts()`
+    (metrica `thermostat_api_cache_total`).
+
+    `token()` esegue query SQLite bloccanti: l'API lo chiama sull'executor delle
+    letture del repository, non sul loop asyncio.
+
+    L'ETag è un hash del corpo, quindi resta valido anche dopo un riavvio dell'API.
+    """
+
+    def __init__(self):
+        self._conn = None
+        self._path = None
+        self._lock = threading.Lock()
+        self._data_version = None
+        self._config_rev = None
+        # key -> (token, etag, body)
+        self._entries = {}
+        # (key, "hit"|"miss") -> richieste
+        self._counts = {}
+
+    def _observer(self):
+        # connessione di osservazione (riaperta se cambia il percorso del DB)
+        if self._conn is None or self._path != database.DB_NAME:
+            if self._conn is not None:
+                self._conn.close()
+            self._path = database.DB_NAME
+            self._conn = sqlite3.connect(self._path, timeout=5.0, check_same_thread=False)
+            self._data_version = self._config_rev = None
+        return self._conn
+
+    def token(self, scope="data"):
+        # scope "data": cambia a ogni commit; scope "config": solo con config_rev
+        with self._lock:
+            conn = self._observer()
+            version = conn.execute("PRAGMA data_version").fetchone()[0]
+            if version != self._data_version or self._config_rev is None:
+                self._data_version = version
+                row = conn.execute("SELECT value FROM meta WHERE key = 'config_rev'").fetchone()
+                self._config_rev = row[0] if row else 0
+            if scope == "config":
+                return ("config", self._config_rev)
+            return ("data", version, self._config_rev)
+
+    async def get(self, key, token, build):
+        # (etag, body) per key: ricostruisce il corpo con `await build()` solo se il token è cambiato
+        entry = self._entries.get(key)
+        hit = entry is not None and entry[0] == token
+        self._counts[key, "hit" if hit else "miss"] = self._counts.get((key, "hit" if hit else "miss"), 0) + 1
+        if hit:
+            return entry[1], entry[2]
+        body = await build()
+        etag = '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+        self._entries[key] = (token, etag, body)
+        return etag, body
+
+    def counts(self):
+        # richieste servite dalla cache o ricostruite, per chiave
+        return dict(self._counts)
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def etag_matches(if_none_match, etag):
+    # confronto debole come da RFC 9110 (ignora il prefisso W/)
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+    return etag in tags
@@ -0,0 +1,220 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+from thermostat.core.registry import ValveState
+from thermostat.mqtt import codec
+from thermostat.mqtt.client import BROKER, PORT
+
+logger = logging.getLogger(__name__)
+
+# campi della valvola inviati alla dashboard (stessi nomi di repository.get_valves)
+FIELDS = ("setpoint", "last_seen", "room_id", "override_heating", "override_expires", "state", "temperature")
+
+
+class LiveHub:
+    """Fan-out condiviso degli aggiornamenti delle valvole verso la dashboard (SSE).
+
+    Un solo subscriber MQTT in-process mantiene in memoria lo stato di tutte le
+    valvole (caricato una volta dal DB all'avvio) e accumula solo i campi cambiati.
+    Ogni `flush_interval` secondi le modifiche vengono serializzate una sola volta
+    e accodate a tutti i client connessi: il carico sul DB non dipende più dal
+    numero di dashboard aperte. Un client la cui coda è piena viene disconnesso;
+    il browser si riconnette da solo e riceve un nuovo snapshot.
+    """
+
+    def __init__(self, client=None, flush_interval=0.5, queue_size=64, keepalive=15.0, offline_timeout=10.0):
+        self.client = client if client is not None else mqtt.Client()
+        self.client.on_connect = self.on_connect
+        self.client.on_message = self.on_message
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self.keepalive = keepalive
+        # stesso valore di ThermostatController.OFFLINE_TIMEOUT (s)
+        self.offline_timeout = offline_timeout
+        # valve_id -> dict dei campi correnti
+        self.valves = {}
+        # valve_id -> campi modificati dall'ultimo flush
+        self._pending = {}
+        # stato e pending sono aggiornati dal thread paho e letti dal loop asyncio
+        self._lock = threading.Lock()
+        # code dei client SSE connessi (usate solo dal loop asyncio)
+        self._subscribers = set()
+        self._task = None
+        self.dropped = 0
+
+    def load(self, valves):
+        # stato iniziale (una sola lettura del DB all'avvio dell'API)
+        with self._lock:
+            self.valves = {v["id"]: {f: v.get(f) for f in FIELDS} for v in valves}
+
+    def start(self, connect=True):
+        # avvia il task di flush sul loop corrente e il subscriber MQTT
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        if connect:
+            self.client.connect(BROKER, PORT, 60)
+            self.client.loop_start()
+
+    async def stop(self, connect=True):
+        if connect:
+            self.client.loop_stop()
+            self.client.disconnect()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        for queue in list(self._subscribers):
+            self._close(queue)
+
+    def on_connect(self, client, userdata, flags, rc):
+        client.subscribe("home/valves/+/temperature")
+        client.subscribe("home/valves/+/command")
+        client.subscribe("home/thermostat/setpoint/+")
+        client.subscribe("home/gateways/+/batch")
+        client.subscribe("home/gateways/+/commands")
+
+    def on_message(self, client, userdata, msg):
+        # thread di rete paho: aggiorna lo stato in memoria, nessun accesso al DB
+        parts = msg.topic.split("/")
+        if len(parts) != 4:
+            return
+        try:
+            # telemetria e comandi possono essere JSON o binari (thermostat.mqtt.codec)
+            if parts[1] == "valves" and parts[3] == "temperature":
+                temperature, _ = codec.decode_temperature(msg.payload)
+                self.update(parts[2], temperature=temperature, last_seen=time.time())
+            elif parts[1] == "valves" and parts[3] == "command":
+                heating = codec.decode_command(msg.payload)
+                if heating is not None:
+                    state = ValveState.HEATING if heating else ValveState.IDLE
+                    self.update(parts[2], state=state.value)
+            elif parts[1] == "gateways" and parts[3] == "batch":
+                now = time.time()
+                for vid, temperature, _ in codec.decode_batch(msg.payload):
+                    self.update(vid, temperature=temperature, last_seen=now)
+            elif parts[1] == "gateways" and parts[3] == "commands":
+                for vid, heating in codec.decode_commands(msg.payload):
+                    state = ValveState.HEATING if heating else ValveState.IDLE
+                    self.update(vid, state=state.value)
+            elif parts[1] == "thermostat" and parts[2] == "setpoint":
+                payload = json.loads(msg.payload)
+                if "setpoint" in payload:
+                    self.update(parts[3], setpoint=payload["setpoint"])
+        except (UnicodeDecodeError, ValueError, AttributeError, KeyError, TypeError, IndexError):
+            return
+
+    def on_repository_event(self, event, data):
+        # modifiche fatte dall'API stessa (override, assegnazioni, cancellazioni)
+        if event == "override_set":
+            self.update(data["valve_id"], override_heating=1 if data["heating"] else 0, override_expires=data["expires"])
+        elif event == "override_cleared":
+            self.update(data["valve_id"], override_heating=None, override_expires=None)
+        elif event == "valve_assigned":
+            self.update(data["valve_id"], room_id=data["room_id"])
+        elif event == "valve_deleted":
+            with self._lock:
+                self.valves.pop(data["valve_id"], None)
+                self._pending[data["valve_id"]] = {"deleted": True}
+        elif event == "room_deleted":
+            with self._lock:
+                for vid, valve in self.valves.items():
+                    if valve["room_id"] == data["room_id"]:
+                        self._set(vid, {"room_id": None})
+
+    def update(self, valve_id, **fields):
+        with self._lock:
+            self._set(valve_id, fields)
+
+    def _set(self, valve_id, fields):
+        # registra solo i campi effettivamente cambiati (lock già acquisito)
+        valve = self.valves.get(valve_id)
+        if valve is None:
+            valve = self.valves[valve_id] = dict.fromkeys(FIELDS)
+        changed = {k: v for k, v in fields.items() if valve.get(k) != v}
+        if not changed:
+            return
+        valve.update(changed)
+        pending = self._pending.get(valve_id)
+        if pending is None or "deleted" in pending:
+            self._pending[valve_id] = changed
+        else:
+            pending.update(changed)
+
+    def _expire(self, now):
+        # stati derivati dal tempo, come nel controller: valvole offline e override scaduti
+        timeout = self.offline_timeout
+        with self._lock:
+            for vid, valve in self.valves.items():
+                seen = valve["last_seen"]
+                if seen is not None and now - seen > timeout and valve["state"] != ValveState.OFFLINE.value:
+                    self._set(vid, {"state": ValveState.OFFLINE.value})
+                expires = valve["override_expires"]
+                if expires is not None and expires <= now:
+                    self._set(vid, {"override_heating": None, "override_expires": None})
+
+    def snapshot(self):
+        # evento iniziale per un nuovo client: lo stato completo dalla memoria
+        with self._lock:
+            valves = [dict(v, id=vid) for vid, v in self.valves.items()]
+        return f"event: snapshot\ndata: {json.dumps(valves)}\n\n"
+
+    def subscribe(self):
+        queue = asyncio.Queue(self.queue_size)
+        queue.put_nowait(self.snapshot())
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self._subscribers.discard(queue)
+
+    def _close(self, queue):
+        # svuota la coda e inserisce il terminatore: lo stream del client si chiude
+        self._subscribers.discard(queue)
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(None)
+
+    def _publish(self, message):
+        # fan-out dello stesso messaggio già serializzato; i client lenti vengono scollegati
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self.dropped += 1
+                logger.info("[Live] client lento disconnesso (coda piena)")
+                self._close(queue)
+
+    async def _run(self):
+        last_sent = last_expire = time.monotonic()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            now = time.monotonic()
+            if now - last_expire >= 1.0:
+                self._expire(time.time())
+                last_expire = now
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if pending:
+                self._publish(f"event: delta\ndata: {json.dumps(pending)}\n\n")
+                last_sent = now
+            elif now - last_sent >= self.keepalive:
+                # commento SSE: mantiene aperta la connessione attraverso i proxy
+                self._publish(": keepalive\n\n")
+                last_sent = now
+
+    async def stream(self, queue):
+        # generatore per la StreamingResponse di un client
+        try:
+            while True:
+                message = await queue.get()
+                if message is None:
+                    return
+                yield message
+        finally:
+            self.unsubscribe(queue)
+
+    def stats(self):
+        return {"clients": len(self._subscribers), "valves": len(self.valves), "dropped": self.dropped}
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError
 
 class RoomCreate(BaseModel):
     id: str = Field(..., example="living")
@@ -13,4 +13,31 @@ class ValveRegister(BaseModel):
 
 
 class SetpointModel(BaseModel):
-    setpoint: float
\ No newline at end of file
+    setpoint: float
+
+# numero massimo di righe accettate da un singolo batch di provisioning
+MAX_BATCH_ROWS = 50000
+
+
+class RowError(BaseModel):
+    row: int
+    id: str | None = None
+    errors: list[str]
+
+
+class BatchResult(BaseModel):
+    saved: int
+    errors: list[RowError] = []
+
+
+def validate_rows(model, rows):
+    # valida le righe una per una: ritorna ([(indice, modello)] validi, errori per riga)
+    valid, errors = [], []
+    for i, row in enumerate(rows):
+        try:
+            valid.append((i, model.model_validate(row)))
+        except ValidationError as e:
+            messages = [f"{'.'.join(str(p) for p in err['loc']) or 'row'}: {err['msg']}" for err in e.errors()]
+            row_id = row.get("id") if isinstance(row, dict) else None
+            errors.append(RowError(row=i, id=row_id if isinstance(row_id, str) else None, errors=messages))
+    return valid, errors
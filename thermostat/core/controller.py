@@ -10,95 +10,238 @@ import time
 import json
 import logging
 import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from thermostat.db.repository import ThermostatRepository
+from thermostat.db.writer import WriteBehindWriter
+from thermostat.core.state import StateCache
+from thermostat.core.registry import ValveRegistry, ValveState
+from thermostat.core.rooms import RoomEngine
+from thermostat.core.stats import RollingStats
+from thermostat.core.scheduler import DeadlineScheduler
+from thermostat import metrics
+from thermostat.logging_config import log_reading
+from thermostat.mqtt import codec
 
 logger = logging.getLogger(__name__)
+# riga per singola lettura, campionata per valvola (logging_config.log_reading)
+readings_logger = logging.getLogger("thermostat.readings")
 
+# fasi di una lettura: parse (MQTTClient), read (registro e cache di stato, nessuna
+# query sul DB), decision, publish, persist (accodamento al writer); per i batch dei
+# gateway batch_parse, batch_decision, batch_publish e batch_persist sull'intero batch;
+# per le stanze room_decision e room_publish a ogni decisione di stanza
+STAGE_SECONDS = metrics.REGISTRY.histogram(
+    "thermostat_stage_seconds", "Durata delle fasi di elaborazione di una lettura", ("stage",)
+)
+COMMANDS = metrics.REGISTRY.counter(
+    "thermostat_commands_total", "Decisioni di comando per esito", ("outcome",)
+)
+VALVES = metrics.REGISTRY.gauge("thermostat_valves", "Valvole note al controller per stato", ("state",))
+WRITER_QUEUE = metrics.REGISTRY.gauge("thermostat_writer_queue_depth", "Elementi in coda nel writer write-behind")
+WRITER_ROWS = metrics.REGISTRY.counter(
+    "thermostat_writer_rows_total", "Righe scritte dal writer write-behind", ("table",)
+)
+WRITER_DROPPED = metrics.REGISTRY.counter(
+    "thermostat_writer_dropped_total", "Elementi scartati per coda write-behind piena"
+)
+WRITER_LOST = metrics.REGISTRY.counter(
+    "thermostat_writer_lost_total", "Righe perse dopo i tentativi di flush falliti del writer write-behind", ("table",)
+)
 
-class ValveState(Enum):
-    # Stati possibili di una valvola gestiti dal controller
-    IDLE = 0
-    HEATING = 1
-    OFFLINE = 2
+# controller attivi nel processo (più d'uno con i ThreadWorker del cluster)
+_controllers = weakref.WeakSet()
 
 
-class Valve:
-    # Oggetto leggero che rappresenta una valvola in memoria
-    def __init__(self, valve_id, setpoint=22.0):
-        # id della valvola
-        self.valve_id = valve_id
-        # setpoint efficace (può essere sovrascritto dal setpoint della stanza)
-        self.setpoint = setpoint
-        # ultima temperatura ricevuta
-        self.current_temp = None
-        # stato logico (IDLE, HEATING, OFFLINE)
-        self.state = ValveState.IDLE
-        # timestamp dell'ultimo messaggio ricevuto
-        self.last_seen = time.time()
+def _collect(fn):
+    # somma dei valori {label: n} di tutti i controller attivi
+    def collect():
+        total = {}
+        for controller in list(_controllers):
+            for key, value in fn(controller).items():
+                total[key] = total.get(key, 0) + value
+        return total
+    return collect
 
-    def update_temperature(self, temperature):
-        # aggiorna la temperatura corrente e il timestamp di last_seen
-        self.current_temp = temperature
-        self.last_seen = time.time()
+
+VALVES.set_function(_collect(lambda c: {(s.name,): c.valves.state.count(s.value) for s in ValveState}))
+COMMANDS.set_function(_collect(lambda c: {(k,): v for k, v in c.command_stats().items()}))
+WRITER_QUEUE.set_function(_collect(lambda c: {(): c.writer.stats()["queue_depth"]}))
+WRITER_ROWS.set_function(_collect(lambda c: {
+    ("readings",): c.writer.stats()["readings_written"], ("valves",): c.writer.stats()["valves_written"],
+}))
+WRITER_DROPPED.set_function(_collect(lambda c: {(): c.writer.stats()["dropped"]}))
+WRITER_LOST.set_function(_collect(lambda c: {
+    ("readings",): c.writer.stats()["readings_lost"], ("valves",): c.writer.stats()["valves_lost"],
+}))
 
 
 class ThermostatController:
     # Controller principale: mantiene lo stato delle valvole, prende decisioni
     def __init__(self, mqtt_client):
-        # dizionario valve_id -> Valve
-        self.valves = {}
+        # registro colonnare valve_id -> vista (setpoint, current_temp, last_seen, state)
+        self.valves = ValveRegistry()
         # client MQTT (usato per pubblicare comandi)
         self.mqtt_client = mqtt_client
         # repository per persistenza su DB
         self.repository = ThermostatRepository()
+        # coda write-behind: letture e stato valvole scritti a batch da un thread dedicato
+        self.writer = WriteBehindWriter(self.repository)
         # timeout per considerare una valvola offline (s)
         self.OFFLINE_TIMEOUT = 10.0
-        # intervallo tra sweep per controllo offline (s)
-        self.SWEEP_INTERVAL = 5.0
-        # avvia thread background per rilevamento offline
-        t = threading.Thread(target=self._offline_sweep, daemon=True)
-        t.start()
+        # i comandi vengono pubblicati solo se la decisione cambia; uno uguale
+        # all'ultimo viene ripetuto al più ogni COMMAND_KEEPALIVE secondi (s)
+        self.COMMAND_KEEPALIVE = 60.0
+        # intervallo minimo tra due cambi di comando della stessa valvola (0 = nessun limite) (s)
+        self.COMMAND_MIN_INTERVAL = 0.0
+        # controllo a livello di stanza: le letture delle valvole assegnate aggiornano la
+        # temperatura aggregata della stanza (mean/min/weighted, vedi RoomEngine) e la
+        # stanza viene decisa una volta ogni ROOM_TICK secondi, con i comandi a tutte le valvole (s)
+        self.room_engine = RoomEngine()
+        self.ROOM_TICK = 1.0
+        # valvole delle stanze raggiunte tramite gateway: valve_id -> (gateway_id, codec)
+        self.valve_gateways = {}
+        # statistiche mobili in memoria (temperatura, tempo in riscaldamento, cambi di stato)
+        # per valvola e per stanza, servite dal listener HTTP senza query sul DB (vedi http_routes)
+        self.valve_stats = RollingStats()
+        self.room_stats = RollingStats()
+        # retention dello storico: partizioni più vecchie di RETENTION_DAYS giorni eliminate (None = mai)
+        self.RETENTION_DAYS = None
+        self.RETENTION_INTERVAL = 3600.0
+        # codec dei comandi negoziato con l'annuncio della valvola (assente = JSON)
+        self.valve_codecs = {}
+        # contatori dei comandi (vedi command_stats)
+        self._cmd_lock = threading.Lock()
+        self._cmd_counts = {"sent": 0, "keepalive": 0, "suppressed": 0, "rate_limited": 0}
+        # scadenze (offline e fine override) gestite da uno heap invece di uno sweep periodico;
+        # le callback girano sul thread dello scheduler e non fanno I/O sul DB
+        self.scheduler = DeadlineScheduler()
+        # manutenzione sul DB (retention, rimozione degli override scaduti) su un thread
+        # dedicato, così le scadenze offline e di stanza non aspettano dietro a una query lenta
+        self._maintenance = ThreadPoolExecutor(max_workers=1, thread_name_prefix="controller-maintenance")
+        # modello in memoria di stanze/assegnazioni/override usato dal percorso caldo
+        self.state = StateCache(self.repository)
+        self.state.add_listener(self._on_state_event)
+        try:
+            self.state.load()
+        except Exception:
+            logger.exception("Errore caricamento iniziale della cache di stato")
+        self.state.start_polling()
+        _controllers.add(self)
 
     def handle_temperature(self, valve_id, temperature):
-        # isteresi di default (può essere sovrascritta dalla stanza)
+        timer = STAGE_SECONDS.timer()
+        valve, heating = self._evaluate(valve_id, temperature, timer)
+
+        if heating is None:
+            # valvola di una stanza: il comando arriva dalla decisione della stanza, sul topic della valvola
+            self.valve_gateways.pop(valve_id, None)
+        else:
+            # Pubblica comando sul topic di comando della valvola (solo se cambiato o per keepalive)
+            self._send_command(valve, heating)
+        timer.mark("publish")
+
+        # accodiamo la lettura di temperatura (scritta in batch dal writer)
+        self.writer.save_temperature(valve_id, temperature, valve.last_seen)
+        # Persistiamo lo stato calcolato della valvola (es. HEATING/IDLE/OFFLINE)
+        try:
+            self.writer.save_valve(valve_id, valve.setpoint, valve.last_seen, valve.state.value)
+        except Exception:
+            logger.exception("Errore salvataggio stato valvola")
+        timer.mark("persist")
+
+    def handle_batch(self, gateway_id, readings, batch_codec=codec.JSON):
+        """Elabora come un'unica unità un batch di letture [(valve_id, temperatura), ...] di un gateway.
+
+        Le decisioni sono le stesse di handle_temperature, ma i comandi da inviare
+        vengono pubblicati in un solo messaggio su `home/gateways/{gw}/commands`
+        (nel codec del batch ricevuto) e letture e stato delle valvole vengono
+        accodati al writer come un solo elemento, scritto in un'unica transazione.
+        Anche i comandi delle decisioni di stanza per queste valvole passano dal gateway.
+        Ritorna il numero di comandi pubblicati.
+        """
+        timer = STAGE_SECONDS.timer()
+        now = time.time()
+        commands = []
+        counts = {}
+        rows = []
+        states = {}
+        for valve_id, temperature in readings:
+            valve, heating = self._evaluate(valve_id, temperature, metrics.NULL_TIMER)
+            if heating is None:
+                self.valve_gateways[valve_id] = (gateway_id, batch_codec)
+            else:
+                outcome = self._command_outcome(valve, heating, now)
+                counts[outcome] = counts.get(outcome, 0) + 1
+                if outcome in ("sent", "keepalive"):
+                    commands.append((valve_id, heating))
+                    valve.last_command = heating
+                    valve.last_command_ts = now
+            rows.append((valve_id, temperature, valve.last_seen))
+            states[valve_id] = (valve_id, valve.setpoint, valve.last_seen, valve.state.value)
+        timer.mark("batch_decision")
+
+        if commands:
+            self.mqtt_client.publish(f"home/gateways/{gateway_id}/commands", batch_codec.encode_commands(commands))
+        self._count_commands(counts)
+        timer.mark("batch_publish")
+
+        try:
+            self.writer.save_batch(rows, list(states.values()))
+        except Exception:
+            logger.exception("Errore salvataggio batch del gateway %s", gateway_id)
+        timer.mark("batch_persist")
+        return len(commands)
+
+    def _evaluate(self, valve_id, temperature, timer):
+        # aggiorna la valvola con la lettura e decide il comando; ritorna (valve, heating),
+        # con heating None per le valvole di una stanza (decise da _decide_room)
+        # isteresi delle valvole senza stanza
         HYSTERESIS = 0.5
 
         # Se non conosciamo la valvola la instanziamo in memoria
         if valve_id not in self.valves:
             logger.info("Nuova valvola rilevata: %s", valve_id)
-            self.valves[valve_id] = Valve(valve_id)
-
-        valve = self.valves[valve_id]
+            valve = self.valves.add(valve_id)
+        else:
+            valve = self.valves[valve_id]
         # aggiorniamo temperatura e last_seen
         valve.update_temperature(temperature)
+        # spostiamo la scadenza offline della valvola (O(log N))
+        self.scheduler.schedule(("offline", valve_id), valve.last_seen + self.OFFLINE_TIMEOUT, self._expire_offline)
 
-        # salviamo informazioni base sul DB e la lettura di temperatura
-        self.repository.save_valve(valve_id, valve.setpoint, valve.last_seen)
-        self.repository.save_temperature(valve_id, temperature)
+        room = self.state.get_room_for_valve(valve_id)
+        if room:
+            # valvola di una stanza: aggiorniamo solo la temperatura aggregata, setpoint,
+            # isteresi e comando sono decisi per l'intera stanza al prossimo tick
+            for room_id in self.room_engine.update(room["id"], valve_id, temperature):
+                self._schedule_room(room_id)
+            timer.mark("read")
+            if readings_logger.isEnabledFor(logging.INFO) and log_reading(valve_id):
+                readings_logger.info(
+                    "[Controller] %s | Temp: %s | Room: %s | State: %s",
+                    valve_id,
+                    valve.current_temp,
+                    room["id"],
+                    valve.state.value,
+                    extra={"valve_id": valve_id},
+                )
+            self.valve_stats.record(valve_id, temperature, valve.state.value, valve.last_seen)
+            return valve, None
+        if valve_id in self.room_engine:
+            # non più assegnata a una stanza: esce dall'aggregato
+            for room_id in self.room_engine.remove(valve_id):
+                self._schedule_room(room_id)
 
         # valore di default per il comando heating
         heating = False
+        previous_state = valve.state
 
-        # calcoliamo setpoint e isteresi effettivi.
-        # se la valvola è assegnata a una stanza, usiamo il setpoint della stanza.
         effective_setpoint = valve.setpoint
         effective_hysteresis = HYSTERESIS
-        try:
-            vrow = self.repository.get_valve(valve_id)
-            if vrow and vrow.get('room_id'):
-                room = self.repository.get_room(vrow.get('room_id'))
-                if room:
-                    # se la stanza esiste, prendi target_temp e hysteresis
-                    effective_setpoint = room.get('target_temp', effective_setpoint)
-                    effective_hysteresis = room.get('hysteresis', effective_hysteresis)
-                    # aggiorna anche l'oggetto in memoria per coerenza con UI
-                    valve.setpoint = effective_setpoint
-        except Exception:
-            # non blocchiamo il flusso su errori DB: logghiamo e procediamo
-            logger.exception("Errore ottenimento room per valvola %s", valve_id)
 
-        # Verifica se esiste un override manuale salvato nel DB
-        override = self.repository.get_valve_override(valve_id)
+        # Verifica se esiste un override manuale (dalla cache in memoria)
+        override = self.state.get_override(valve_id)
         if override:
             expires = override.get("expires")
             # se expires è None => override persistente fino a cancellazione
@@ -107,9 +250,9 @@ class ThermostatController:
                 heating = bool(override.get("heating"))
                 valve.state = ValveState.HEATING if heating else ValveState.IDLE
             else:
-                # override scaduto: rimuovilo e procedi con la logica normale
-                self.repository.clear_valve_override(valve_id)
+                # override scaduto ma non ancora rimosso dallo scheduler: logica normale
                 override = None
+        timer.mark("read")
 
         # Logica di controllo con isteresi: si evita il toggle continuo
         if not override:
@@ -128,51 +271,310 @@ class ThermostatController:
         # estraiamo dati di override per il log (se presenti)
         ov_heating = override.get("heating") if override else None
         ov_expires = override.get("expires") if override else None
-        logger.info(
-            "[Controller] %s | Temp: %s | Setpoint: %s | State: %s | Heating: %s | OverrideHeating: %s | OverrideExpires: %s",
-            valve_id,
-            valve.current_temp,
-            effective_setpoint,
-            valve.state.value,
-            heating,
-            ov_heating,
-            ov_expires,
-        )
-
-        # Pubblica comando sul topic di comando della valvola
-        topic_command = f"home/valves/{valve_id}/command"
-        payload = {"heating": heating}
-        self.mqtt_client.publish(topic_command, json.dumps(payload))
+        if readings_logger.isEnabledFor(logging.INFO) and log_reading(valve_id, valve.state != previous_state):
+            readings_logger.info(
+                "[Controller] %s | Temp: %s | Setpoint: %s | State: %s | Heating: %s | OverrideHeating: %s | OverrideExpires: %s",
+                valve_id,
+                valve.current_temp,
+                effective_setpoint,
+                valve.state.value,
+                heating,
+                ov_heating,
+                ov_expires,
+                extra={"valve_id": valve_id},
+            )
+        self.valve_stats.record(valve_id, temperature, valve.state.value, valve.last_seen)
+        timer.mark("decision")
+        return valve, heating
 
-        # Persistiamo lo stato calcolato della valvola (es. HEATING/IDLE/OFFLINE)
-        try:
-            self.repository.save_valve(valve_id, valve.setpoint, valve.last_seen, valve.state.value)
-        except Exception:
-            logger.exception("Errore salvataggio stato valvola")
+    def _schedule_room(self, room_id):
+        # la stanza ha nuove letture (o nuova configurazione): decisione al prossimo tick
+        self.scheduler.schedule(("room", room_id), time.time() + self.ROOM_TICK, self._decide_room)
+
+    def _decide_room(self, key):
+        # callback dello scheduler: una decisione con isteresi sulla temperatura aggregata
+        # della stanza, poi il comando a ogni valvola (rispettando gli override per valvola)
+        room_id = key[1]
+        room = self.state.rooms.get(room_id)
+        if room is None:
+            self.room_engine.drop_room(room_id)
+            return
+        timer = STAGE_SECONDS.timer()
+        temperature, members, previous = self.room_engine.take(room_id)
+        target = room.get("target_temp")
+        if temperature is None or target is None:
+            return
+        hysteresis = room.get("hysteresis")
+        if hysteresis is None:
+            hysteresis = 0.5
+        if temperature < target - hysteresis:
+            heating = True
+        elif temperature > target + hysteresis:
+            heating = False
+        else:
+            # nella finestra di isteresi la stanza mantiene la decisione precedente
+            heating = bool(previous)
+        self.room_engine.set_heating(room_id, heating)
+        self.room_stats.record(room_id, temperature, ValveState.HEATING.value if heating else ValveState.IDLE.value, time.time())
+        if heating != previous:
+            logger.info(
+                "[Controller] Stanza %s | Temp (%s): %.2f | Target: %s | Valvole: %d | Heating: %s",
+                room_id, self.room_engine.aggregation, temperature, target, len(members), heating,
+            )
+        timer.mark("room_decision")
+        self._fan_out(members, heating, target)
+        timer.mark("room_publish")
+
+    def _fan_out(self, members, heating, target):
+        # comandi della decisione di stanza: sul topic della valvola oppure raggruppati per gateway
+        now = time.time()
+        counts = {}
+        grouped = {}
+        for vid in members:
+            valve = self.valves.get(vid)
+            if valve is None:
+                continue
+            valve_heating = heating
+            override = self.state.get_override(vid)
+            if override and (override.get("expires") is None or override["expires"] > now):
+                valve_heating = bool(override.get("heating"))
+            state = ValveState.HEATING if valve_heating else ValveState.IDLE
+            valve.setpoint = target
+            if valve.state != state:
+                valve.state = state
+                self.writer.save_valve(vid, target, valve.last_seen, state.value)
+                self.valve_stats.record(vid, None, state.value, now)
+            outcome = self._command_outcome(valve, valve_heating, now)
+            counts[outcome] = counts.get(outcome, 0) + 1
+            if outcome in ("suppressed", "rate_limited"):
+                continue
+            valve.last_command = valve_heating
+            valve.last_command_ts = now
+            gateway = self.valve_gateways.get(vid)
+            if gateway is None:
+                payload = self.valve_codecs.get(vid, codec.JSON).encode_command(valve_heating)
+                self.mqtt_client.publish(f"home/valves/{vid}/command", payload)
+            else:
+                grouped.setdefault(gateway, []).append((vid, valve_heating))
+        for (gateway_id, batch_codec), commands in grouped.items():
+            self.mqtt_client.publish(f"home/gateways/{gateway_id}/commands", batch_codec.encode_commands(commands))
+        self._count_commands(counts)
 
-    def _offline_sweep(self):
-        # thread che periodicamente controlla last_seen e marca OFFLINE le valvole
-        while True:
+    def _command_outcome(self, valve, heating, now):
+        # esito della decisione di comando: "sent" (cambio) e "keepalive" vanno pubblicati,
+        # "suppressed" (duplicato) e "rate_limited" (cambio troppo ravvicinato) no
+        last = valve.last_command
+        elapsed = now - valve.last_command_ts
+        if last == heating:
+            return "suppressed" if elapsed < self.COMMAND_KEEPALIVE else "keepalive"
+        if last is not None and elapsed < self.COMMAND_MIN_INTERVAL:
+            # cambio troppo ravvicinato: verrà inviato a una delle prossime letture
+            return "rate_limited"
+        return "sent"
+
+    def _send_command(self, valve, heating):
+        # pubblica il comando se diverso dall'ultimo inviato o se è ora di un keepalive
+        now = time.time()
+        outcome = self._command_outcome(valve, heating, now)
+        if outcome in ("suppressed", "rate_limited"):
+            self._count_command(outcome)
+            return False
+        topic_command = f"home/valves/{valve.valve_id}/command"
+        payload = self.valve_codecs.get(valve.valve_id, codec.JSON).encode_command(heating)
+        self.mqtt_client.publish(topic_command, payload)
+        valve.last_command = heating
+        valve.last_command_ts = now
+        self._count_command(outcome)
+        return True
+
+    def _count_command(self, outcome):
+        with self._cmd_lock:
+            self._cmd_counts[outcome] += 1
+
+    def _count_commands(self, counts):
+        # come _count_command per più esiti insieme ({esito: n}), un solo lock
+        with self._cmd_lock:
+            for outcome, n in counts.items():
+                self._cmd_counts[outcome] += n
+
+    def command_stats(self):
+        # contatori dei comandi: sent (cambi), keepalive, suppressed (duplicati), rate_limited
+        with self._cmd_lock:
+            return dict(self._cmd_counts)
+
+    def _expire_offline(self, key):
+        # callback dello scheduler: nessuna lettura per OFFLINE_TIMEOUT secondi
+        vid = key[1]
+        valve = self.valves.get(vid)
+        if valve is None:
+            return
+        now = time.time()
+        if now - valve.last_seen < self.OFFLINE_TIMEOUT:
+            # lettura arrivata mentre la scadenza veniva estratta
+            return
+        # la valvola non conta più nella temperatura della sua stanza
+        for room_id in self.room_engine.remove(vid):
+            self._schedule_room(room_id)
+        if valve.state != ValveState.OFFLINE:
+            logger.info(
+                "Marking valve %s as OFFLINE (last_seen %.1fs ago)", vid, now - valve.last_seen
+            )
+            valve.state = ValveState.OFFLINE
+            self.valve_stats.record(vid, None, ValveState.OFFLINE.value, now)
+            # al ritorno online il comando va reinviato anche se invariato
+            valve.last_command = None
             try:
-                now = time.time()
-                for vid, valve in list(self.valves.items()):
-                    if valve.last_seen is None:
-                        continue
-                    # se non ricevuta per più di OFFLINE_TIMEOUT la marcchiamo OFFLINE
-                    if now - valve.last_seen > self.OFFLINE_TIMEOUT:
-                        if valve.state != ValveState.OFFLINE:
-                            logger.info(
-                                "Marking valve %s as OFFLINE (last_seen %.1fs ago)", vid, now - valve.last_seen
-                            )
-                            valve.state = ValveState.OFFLINE
-                            try:
-                                # persistiamo lo stato OFFLINE
-                                self.repository.save_valve(vid, valve.setpoint, valve.last_seen, valve.state.value)
-                            except Exception:
-                                logger.exception("Errore salvataggio stato valvola during offline sweep")
+                # persistiamo lo stato OFFLINE
+                self.writer.save_valve(vid, valve.setpoint, valve.last_seen, valve.state.value)
             except Exception:
-                logger.exception("Errore nel ciclo di sweep offline")
-            time.sleep(self.SWEEP_INTERVAL)
+                logger.exception("Errore salvataggio stato valvola OFFLINE")
+
+    def _schedule_override(self, valve_id, override):
+        # programma la rimozione dell'override alla sua scadenza (se ne ha una)
+        key = ("override", valve_id)
+        if override is None or override.get("expires") is None:
+            self.scheduler.cancel(key)
+        else:
+            self.scheduler.schedule(key, override["expires"], self._expire_override)
+
+    def _expire_override(self, key):
+        # callback dello scheduler: l'override manuale è scaduto
+        vid = key[1]
+        override = self.state.get_override(vid)
+        if override is None or override.get("expires") is None:
+            return
+        if override["expires"] > time.time():
+            # l'override è stato prolungato nel frattempo
+            self._schedule_override(vid, override)
+            return
+        logger.info("Override scaduto per %s", vid)
+        self._maintenance.submit(self._clear_override, vid)
+
+    def _clear_override(self, vid):
+        # sul thread di manutenzione: l'evento override_cleared riallinea cache e comandi
+        try:
+            self.repository.clear_valve_override(vid)
+        except Exception:
+            logger.exception("Errore rimozione override scaduto per %s", vid)
+
+    def _decide_room_now(self, room_id):
+        # configurazione o override cambiati: la stanza viene decisa subito (sul thread
+        # dello scheduler, come le decisioni al tick) invece che al prossimo tick
+        self.scheduler.schedule(("room", room_id), time.time(), self._decide_room)
+
+    def _on_state_event(self, event, data):
+        # mantiene allineate le scadenze degli override e le stanze con la cache di stato
+        if event == "room_saved":
+            self._decide_room_now(data["room"]["id"])
+        elif event == "room_deleted":
+            self.room_engine.drop_room(data["room_id"])
+        elif event in ("valve_assigned", "valve_deleted"):
+            for room_id in self.room_engine.remove(data["valve_id"]):
+                self._schedule_room(room_id)
+        if event in ("override_set", "override_cleared", "valve_deleted"):
+            vid = data["valve_id"]
+            self._schedule_override(vid, self.state.get_override(vid))
+            # l'override può aver cambiato lo stato reale della valvola (l'API pubblica
+            # direttamente il comando): il prossimo comando va inviato comunque
+            valve = self.valves.get(vid)
+            if valve is not None:
+                valve.last_command = None
+            room_id = self.state.valve_rooms.get(vid)
+            if room_id is not None:
+                # valvola di una stanza: il comando (override o decisione della stanza) parte subito
+                self._decide_room_now(room_id)
+        elif event == "reloaded":
+            for room_id in self.room_engine.reload(self.state.valve_rooms, self.state.rooms):
+                self._schedule_room(room_id)
+            overrides = self.state.overrides
+            for key in [k for k in self.scheduler.keys() if k[0] == "override"]:
+                if key[1] not in overrides:
+                    self.scheduler.cancel(key)
+            for vid, override in list(overrides.items()):
+                self._schedule_override(vid, override)
+            urgent = set(data.get("rooms_changed", ()))
+            for vid in data.get("overrides_changed", ()):
+                valve = self.valves.get(vid)
+                if valve is not None:
+                    valve.last_command = None
+                room_id = self.state.valve_rooms.get(vid)
+                if room_id is not None:
+                    urgent.add(room_id)
+            for room_id in urgent:
+                self._decide_room_now(room_id)
+
+    def start_retention(self, days):
+        # attiva la retention periodica dello storico (programmata dallo scheduler,
+        # eseguita sul thread di manutenzione)
+        self.RETENTION_DAYS = days
+        self.scheduler.schedule(("retention",), time.time(), self._run_retention)
+
+    def _run_retention(self, key):
+        # callback dello scheduler: la retention elimina e archivia partizioni, non la
+        # eseguiamo sul thread delle scadenze
+        self._maintenance.submit(self._apply_retention, key)
+
+    def _apply_retention(self, key):
+        try:
+            dropped = self.repository.apply_retention(self.RETENTION_DAYS)
+            if dropped:
+                logger.info("Retention: eliminate le partizioni %s", ", ".join(dropped))
+        except Exception:
+            logger.exception("Errore nella retention dello storico")
+        self.scheduler.schedule(key, time.time() + self.RETENTION_INTERVAL, self._run_retention)
+
+    def release_valves(self, owns):
+        # dopo un ribilanciamento del cluster smettiamo di sorvegliare (offline)
+        # le valvole per cui owns(valve_id) è falso; ritorna quante sono state rilasciate
+        released = 0
+        for vid in list(self.valves.ids):
+            if not owns(vid) and self.scheduler.cancel(("offline", vid)):
+                released += 1
+        return released
+
+    def valve_summary(self, valve_id, now=None):
+        # statistiche mobili della valvola (KeyError se sconosciuta)
+        data = self.valve_stats.snapshot(valve_id, time.time() if now is None else now)
+        data["id"] = valve_id
+        data["state"] = ValveState(data["state"]).name if data["state"] >= 0 else None
+        return data
+
+    def room_summary(self, room_id, now=None):
+        # statistiche mobili della stanza più la temperatura aggregata corrente (KeyError se mai decisa)
+        data = self.room_stats.snapshot(room_id, time.time() if now is None else now)
+        data["id"] = room_id
+        data["state"] = ValveState(data["state"]).name if data["state"] >= 0 else None
+        data["temperature"] = self.room_engine.temperature(room_id)
+        data["aggregation"] = self.room_engine.aggregation
+        return data
+
+    def http_routes(self):
+        # rotte JSON per il listener HTTP del controller (metrics.MetricsServer.routes)
+        def dump(data):
+            return "application/json", json.dumps(data)
+
+        return {
+            "/stats/valves/": lambda valve_id: dump(self.valve_summary(valve_id)),
+            "/stats/rooms/": lambda room_id: dump(self.room_summary(room_id)),
+            "/stats/rooms": lambda: dump([self.room_summary(r) for r in self.room_stats.keys()]),
+        }
+
+    def configure_rooms(self, aggregation, tick):
+        # modo di aggregazione della temperatura di stanza e intervallo tra due decisioni
+        self.room_engine.set_aggregation(aggregation)
+        self.ROOM_TICK = tick
+
+    def set_valve_codec(self, valve_id, valve_codec):
+        # codec dei comandi verso la valvola; al cambio il prossimo comando va reinviato
+        if self.valve_codecs.get(valve_id, codec.JSON) is valve_codec:
+            return
+        if valve_codec is codec.JSON:
+            self.valve_codecs.pop(valve_id, None)
+        else:
+            self.valve_codecs[valve_id] = valve_codec
+        valve = self.valves.get(valve_id)
+        if valve is not None:
+            valve.last_command = None
 
     def update_setpoint(self, valve_id, new_setpoint):
         # cambiare il setpoint in memoria e sul DB (se la valvola è nota)
@@ -181,8 +583,31 @@ class ThermostatController:
             logger.info("[Controller] Setpoint aggiornato per %s: %s", valve_id, new_setpoint)
 
             # aggiornamento nel DB
-            self.repository.save_valve(
+            self.writer.save_valve(
                 valve_id, new_setpoint, self.valves[valve_id].last_seen
             )
         else:
-            logger.warning("[Controller] Valvola %s non trovata", valve_id)
\ No newline at end of file
+            logger.warning("[Controller] Valvola %s non trovata", valve_id)
+
+    def update_room_target(self, room_id, target):
+        # nuovo target della stanza (topic room_setpoint): la stanza viene decisa appena salvato
+        room = self.state.rooms.get(room_id)
+        if room is None:
+            logger.warning("[Controller] Stanza %s non trovata", room_id)
+            return
+        self._maintenance.submit(self._update_room_target, room, target)
+
+    def _update_room_target(self, room, target):
+        # sul thread di manutenzione: l'evento room_saved aggiorna la cache e decide la stanza
+        try:
+            self.repository.update_room(room["id"], room.get("name"), target, room.get("hysteresis"))
+            logger.info("[Controller] Target aggiornato per la stanza %s: %s", room["id"], target)
+        except Exception:
+            logger.exception("Errore aggiornamento target della stanza %s", room["id"])
+
+    def stop(self):
+        # ferma scheduler, manutenzione e poll della cache, poi svuota la coda write-behind
+        self.scheduler.stop()
+        self._maintenance.shutdown(wait=True)
+        self.state.stop_polling()
+        self.writer.close()
@@ -0,0 +1,39 @@
+import collections
+import threading
+
+
+class LatencyRecorder:
+    """Campioni di latenza (secondi) sugli ultimi `size` messaggi con calcolo dei percentili."""
+
+    def __init__(self, size=10000):
+        self._samples = collections.deque(maxlen=size)
+        self._lock = threading.Lock()
+        # numero totale di campioni registrati (anche quelli usciti dalla finestra)
+        self.count = 0
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+            self.count += 1
+
+    def samples(self):
+        # copia dei campioni nella finestra corrente (es. per unire più recorder)
+        with self._lock:
+            return list(self._samples)
+
+    def percentiles(self, points=(50, 90, 99, 99.9)):
+        # ritorna {percentile: latenza in ms} sulla finestra corrente
+        with self._lock:
+            data = sorted(self._samples)
+        if not data:
+            return {}
+        result = {}
+        for p in points:
+            idx = min(len(data) - 1, int(round(p / 100.0 * (len(data) - 1))))
+            result[p] = data[idx] * 1000.0
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self.count = 0
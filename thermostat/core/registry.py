@@ -0,0 +1,161 @@
+from array import array
+from enum import Enum
+import threading
+import time
+
+
+class ValveState(Enum):
+    # Stati possibili di una valvola gestiti dal controller
+    IDLE = 0
+    HEATING = 1
+    OFFLINE = 2
+
+
+# lookup valore intero -> ValveState senza passare da Enum.__call__
+_STATES = tuple(ValveState)
+_NAN = float("nan")
+
+
+class ValveView:
+    """Vista leggera su una valvola del registro (nessun dato proprio oltre all'indice).
+
+    Espone gli stessi attributi del vecchio oggetto `Valve` (setpoint, current_temp,
+    state, last_seen) leggendo e scrivendo direttamente nelle colonne del registro.
+    """
+
+    __slots__ = ("_registry", "_index", "valve_id")
+
+    def __init__(self, registry, index, valve_id):
+        self._registry = registry
+        self._index = index
+        self.valve_id = valve_id
+
+    @property
+    def setpoint(self):
+        return self._registry.setpoint[self._index]
+
+    @setpoint.setter
+    def setpoint(self, value):
+        self._registry.setpoint[self._index] = value
+
+    @property
+    def current_temp(self):
+        # NaN nella colonna significa "nessuna lettura ricevuta"
+        value = self._registry.current_temp[self._index]
+        return None if value != value else value
+
+    @current_temp.setter
+    def current_temp(self, value):
+        self._registry.current_temp[self._index] = _NAN if value is None else value
+
+    @property
+    def state(self):
+        return _STATES[self._registry.state[self._index]]
+
+    @state.setter
+    def state(self, value):
+        self._registry.state[self._index] = value.value
+
+    @property
+    def last_seen(self):
+        return self._registry.last_seen[self._index]
+
+    @last_seen.setter
+    def last_seen(self, value):
+        self._registry.last_seen[self._index] = value
+
+    @property
+    def last_command(self):
+        # ultimo comando heating pubblicato (None se mai inviato o da reinviare)
+        value = self._registry.last_command[self._index]
+        return None if value < 0 else bool(value)
+
+    @last_command.setter
+    def last_command(self, value):
+        self._registry.last_command[self._index] = -1 if value is None else int(bool(value))
+
+    @property
+    def last_command_ts(self):
+        return self._registry.last_command_ts[self._index]
+
+    @last_command_ts.setter
+    def last_command_ts(self, value):
+        self._registry.last_command_ts[self._index] = value
+
+    def update_temperature(self, temperature):
+        # aggiorna la temperatura corrente e il timestamp di last_seen
+        self.current_temp = temperature
+        self.last_seen = time.time()
+
+
+class ValveRegistry:
+    """Registro colonnare delle valvole note al controller.
+
+    Una mappa valve_id -> indice e array paralleli (setpoint, current_temp,
+    last_seen, state, ultimo comando inviato) al posto di un oggetto Python per valvola: con 100k+
+    valvole la memoria per valvola scende a poche decine di byte.
+    Le valvole non vengono mai rimosse, quindi gli indici sono stabili.
+    """
+
+    def __init__(self):
+        # valve_id -> indice nelle colonne
+        self._index = {}
+        # indice -> valve_id
+        self.ids = []
+        self.setpoint = array("d")
+        self.current_temp = array("d")
+        self.last_seen = array("d")
+        self.state = array("b")
+        # ultimo comando pubblicato: -1 nessuno, 0 heating off, 1 heating on
+        self.last_command = array("b")
+        self.last_command_ts = array("d")
+        # protegge solo l'aggiunta di nuove valvole (append sulle colonne)
+        self._lock = threading.Lock()
+
+    def add(self, valve_id, setpoint=22.0):
+        # registra una nuova valvola (idempotente) e ne ritorna la vista
+        with self._lock:
+            idx = self._index.get(valve_id)
+            if idx is None:
+                idx = len(self.ids)
+                self.setpoint.append(setpoint)
+                self.current_temp.append(_NAN)
+                self.last_seen.append(time.time())
+                self.state.append(ValveState.IDLE.value)
+                self.last_command.append(-1)
+                self.last_command_ts.append(0.0)
+                self.ids.append(valve_id)
+                # pubblichiamo l'indice solo dopo aver esteso tutte le colonne
+                self._index[valve_id] = idx
+        return ValveView(self, idx, valve_id)
+
+    def index_of(self, valve_id):
+        # indice della valvola oppure None
+        return self._index.get(valve_id)
+
+    def get(self, valve_id, default=None):
+        idx = self._index.get(valve_id)
+        if idx is None:
+            return default
+        return ValveView(self, idx, valve_id)
+
+    def view(self, index):
+        # vista a partire dall'indice
+        return ValveView(self, index, self.ids[index])
+
+    def __contains__(self, valve_id):
+        return valve_id in self._index
+
+    def __getitem__(self, valve_id):
+        return ValveView(self, self._index[valve_id], valve_id)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(list(self.ids))
+
+    def items(self):
+        # coppie (valve_id, vista) come dict.items()
+        for idx in range(len(self.ids)):
+            yield self.ids[idx], ValveView(self, idx, self.ids[idx])
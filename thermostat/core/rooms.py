@@ -0,0 +1,209 @@
+import threading
+
+# modi di aggregazione della temperatura di stanza
+AGGREGATIONS = ("mean", "min", "weighted")
+
+
+class RoomAggregate:
+    """Temperatura aggregata di una stanza, aggiornata in O(1) a ogni lettura.
+
+    Somme pesate per media e media pesata (peso 1 in modalità "mean") e valvola
+    con la temperatura minima; il minimo viene ricalcolato sulle valvole della
+    stanza solo quando la valvola minima sale o esce.
+    """
+
+    __slots__ = ("temps", "weights", "sum_wt", "sum_w", "min_valve", "heating", "dirty")
+
+    def __init__(self):
+        # valve_id -> ultima temperatura / peso usato nelle somme
+        self.temps = {}
+        self.weights = {}
+        self.sum_wt = 0.0
+        self.sum_w = 0.0
+        self.min_valve = None
+        # ultima decisione della stanza (None = mai decisa)
+        self.heating = None
+        # letture o configurazione cambiate dall'ultima decisione
+        self.dirty = False
+
+    def set(self, valve_id, temperature, weight):
+        old = self.temps.get(valve_id)
+        if old is None:
+            self.sum_wt += weight * temperature
+            self.sum_w += weight
+            self.weights[valve_id] = weight
+        else:
+            self.sum_wt += self.weights[valve_id] * (temperature - old)
+        current_min = self.temps[self.min_valve] if self.min_valve is not None else None
+        self.temps[valve_id] = temperature
+        if current_min is None or temperature <= current_min:
+            self.min_valve = valve_id
+        elif valve_id == self.min_valve:
+            # la valvola minima è salita: il minimo può essere un'altra
+            self._recompute_min()
+
+    def discard(self, valve_id):
+        temperature = self.temps.pop(valve_id, None)
+        if temperature is None:
+            return False
+        weight = self.weights.pop(valve_id)
+        if self.temps:
+            self.sum_wt -= weight * temperature
+            self.sum_w -= weight
+        else:
+            # stanza vuota: azzeriamo anche l'errore accumulato dalle somme incrementali
+            self.sum_wt = self.sum_w = 0.0
+        if valve_id == self.min_valve:
+            self._recompute_min()
+        return True
+
+    def _recompute_min(self):
+        self.min_valve = min(self.temps, key=self.temps.get) if self.temps else None
+
+    def value(self, aggregation):
+        # temperatura della stanza oppure None se nessuna valvola ha riportato
+        if not self.temps:
+            return None
+        if aggregation == "min":
+            return self.temps[self.min_valve]
+        return self.sum_wt / self.sum_w if self.sum_w > 0 else None
+
+
+class RoomEngine:
+    """Aggregati di temperatura delle stanze per il controllo a livello di stanza.
+
+    Le letture delle valvole assegnate a una stanza aggiornano l'aggregato della
+    stanza e la segnano da decidere ("dirty"); il controller decide una volta per
+    stanza per tick con `take`. Una valvola è conteggiata in una sola stanza:
+    se cambia stanza o va offline esce dall'aggregato e la stanza di prima torna
+    da decidere. I pesi della modalità "weighted" arrivano dall'annuncio delle
+    valvole (default 1). Thread-safe: letture e tick girano su thread diversi.
+    """
+
+    def __init__(self, aggregation="mean"):
+        self._check(aggregation)
+        self.aggregation = aggregation
+        # valve_id -> peso dichiarato
+        self.weights = {}
+        # room_id -> RoomAggregate
+        self._rooms = {}
+        # valve_id -> room_id in cui la valvola è conteggiata
+        self._valve_room = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _check(aggregation):
+        if aggregation not in AGGREGATIONS:
+            raise ValueError(f"aggregazione di stanza non valida: {aggregation}")
+
+    def _weight(self, valve_id):
+        return self.weights.get(valve_id, 1.0) if self.aggregation == "weighted" else 1.0
+
+    def __contains__(self, valve_id):
+        return valve_id in self._valve_room
+
+    def update(self, room_id, valve_id, temperature):
+        # registra una lettura; ritorna le stanze appena diventate da decidere (da programmare)
+        with self._lock:
+            woken = []
+            previous = self._valve_room.get(valve_id)
+            if previous is not None and previous != room_id:
+                self._discard(valve_id, woken)
+            room = self._rooms.get(room_id)
+            if room is None:
+                room = self._rooms[room_id] = RoomAggregate()
+            room.set(valve_id, temperature, self._weight(valve_id))
+            self._valve_room[valve_id] = room_id
+            if not room.dirty:
+                room.dirty = True
+                woken.append(room_id)
+            return woken
+
+    def remove(self, valve_id):
+        # la valvola esce dall'aggregato (offline, riassegnata, cancellata)
+        with self._lock:
+            woken = []
+            self._discard(valve_id, woken)
+            return woken
+
+    def _discard(self, valve_id, woken):
+        room_id = self._valve_room.pop(valve_id, None)
+        room = self._rooms.get(room_id)
+        if room is not None and room.discard(valve_id) and not room.dirty:
+            room.dirty = True
+            woken.append(room_id)
+
+    def drop_room(self, room_id):
+        # stanza cancellata: le sue valvole tornano al controllo per valvola
+        with self._lock:
+            room = self._rooms.pop(room_id, None)
+            if room is not None:
+                for vid in room.temps:
+                    self._valve_room.pop(vid, None)
+
+    def reload(self, valve_rooms, rooms):
+        # dopo un ricaricamento della configurazione: via le stanze cancellate e le valvole
+        # riassegnate, tutte le altre stanze da decidere di nuovo; ritorna quelle da programmare
+        with self._lock:
+            for room_id in [r for r in self._rooms if r not in rooms]:
+                for vid in self._rooms.pop(room_id).temps:
+                    self._valve_room.pop(vid, None)
+            woken = []
+            for vid, room_id in list(self._valve_room.items()):
+                if valve_rooms.get(vid) != room_id:
+                    self._discard(vid, woken)
+            for room_id, room in self._rooms.items():
+                if room.temps and not room.dirty:
+                    room.dirty = True
+                    woken.append(room_id)
+            return woken
+
+    def take(self, room_id):
+        # per la decisione: (temperatura aggregata, valvole, ultima decisione) e azzera "dirty"
+        with self._lock:
+            room = self._rooms.get(room_id)
+            if room is None:
+                return None, (), None
+            room.dirty = False
+            return room.value(self.aggregation), list(room.temps), room.heating
+
+    def set_heating(self, room_id, heating):
+        with self._lock:
+            room = self._rooms.get(room_id)
+            if room is not None:
+                room.heating = heating
+
+    def temperature(self, room_id):
+        with self._lock:
+            room = self._rooms.get(room_id)
+            return room.value(self.aggregation) if room is not None else None
+
+    def room_ids(self):
+        with self._lock:
+            return list(self._rooms)
+
+    def set_weight(self, valve_id, weight):
+        # peso della valvola per la modalità "weighted" (es. potenza del radiatore)
+        with self._lock:
+            if weight is None or weight == 1.0:
+                self.weights.pop(valve_id, None)
+            else:
+                self.weights[valve_id] = float(weight)
+            self._reinsert(valve_id)
+
+    def set_aggregation(self, aggregation):
+        # cambia il modo di aggregazione ricalcolando le somme di tutte le stanze
+        self._check(aggregation)
+        with self._lock:
+            self.aggregation = aggregation
+            for vid in list(self._valve_room):
+                self._reinsert(vid)
+
+    def _reinsert(self, valve_id):
+        # riapplica la lettura corrente della valvola con il peso attuale
+        room = self._rooms.get(self._valve_room.get(valve_id))
+        if room is None:
+            return
+        temperature = room.temps[valve_id]
+        room.discard(valve_id)
+        room.set(valve_id, temperature, self._weight(valve_id))
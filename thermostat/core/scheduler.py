@@ -0,0 +1,96 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineScheduler:
+    """Scheduler di scadenze basato su heap con cancellazione pigra.
+
+    Ogni chiave (es. ("offline", valve_id)) ha al più una scadenza attiva:
+    `schedule` la sostituisce in O(log N) spingendo una nuova voce nello heap,
+    le voci superate vengono scartate quando arrivano in cima. Un thread dedicato
+    dorme fino alla prossima scadenza ed esegue la callback esattamente quando dovuta.
+    """
+
+    # oltre questo rapporto voci/chiavi lo heap viene ricostruito senza voci obsolete
+    COMPACT_RATIO = 4
+
+    def __init__(self, name="deadline-scheduler"):
+        self._heap = []
+        # chiave -> (scadenza, callback) attiva
+        self._active = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def schedule(self, key, deadline, callback):
+        # imposta (o sposta) la scadenza della chiave; callback(key) verrà chiamata a deadline
+        with self._cond:
+            self._active[key] = (deadline, callback)
+            heapq.heappush(self._heap, (deadline, next(self._seq), key))
+            if len(self._heap) > self.COMPACT_RATIO * len(self._active) + 1024:
+                self._compact()
+            # svegliamo il thread solo se la nuova scadenza è ora la prima
+            if self._heap[0][0] == deadline:
+                self._cond.notify()
+
+    def cancel(self, key):
+        # annulla la scadenza della chiave (la voce nello heap diventa obsoleta)
+        with self._cond:
+            return self._active.pop(key, None) is not None
+
+    def deadline(self, key):
+        # scadenza attiva della chiave oppure None
+        entry = self._active.get(key)
+        return entry[0] if entry else None
+
+    def keys(self):
+        # copia delle chiavi con scadenza attiva
+        with self._cond:
+            return list(self._active)
+
+    def __len__(self):
+        return len(self._active)
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    def _compact(self):
+        # ricostruisce lo heap con le sole voci attive
+        self._heap = [(d, next(self._seq), k) for k, (d, _) in self._active.items()]
+        heapq.heapify(self._heap)
+
+    def _run(self):
+        with self._cond:
+            while not self._stopped:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                deadline, _, key = self._heap[0]
+                delay = deadline - time.time()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+                entry = self._active.get(key)
+                if entry is None or entry[0] != deadline:
+                    # voce obsoleta (scadenza spostata o annullata)
+                    continue
+                del self._active[key]
+                callback = entry[1]
+                # la callback gira senza lock così può ri-schedulare
+                self._cond.release()
+                try:
+                    callback(key)
+                except Exception:
+                    logger.exception("Errore nella callback di scadenza per %s", key)
+                finally:
+                    self._cond.acquire()
@@ -0,0 +1,133 @@
+import logging
+import threading
+
+from thermostat.db.database import get_connection
+
+logger = logging.getLogger(__name__)
+
+
+class StateCache:
+    """Modello in memoria di stanze, assegnazioni valvola->stanza e override manuali.
+
+    Viene caricato all'avvio e aggiornato dagli eventi del repository dello stesso
+    processo. Le scritture fatte da altri processi (es. l'API) vengono rilevate con
+    un poll di `PRAGMA data_version` (costo nullo se il DB non è cambiato) seguito,
+    solo se necessario, dalla lettura di `meta.config_rev`.
+    """
+
+    def __init__(self, repository):
+        self.repository = repository
+        # room_id -> dict stanza
+        self.rooms = {}
+        # valve_id -> room_id
+        self.valve_rooms = {}
+        # valve_id -> {"heating": bool, "expires": float|None}
+        self.overrides = {}
+        # revisione della configurazione a cui corrisponde il contenuto della cache
+        self.revision = 0
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._poll_thread = None
+        self._stop = threading.Event()
+        repository.add_listener(self._on_repository_event)
+
+    def add_listener(self, callback):
+        # callback(event, data) chiamata dopo ogni modifica applicata alla cache
+        self._listeners.append(callback)
+
+    def _emit(self, event, data):
+        for callback in list(self._listeners):
+            try:
+                callback(event, data)
+            except Exception:
+                logger.exception("Errore nel listener della cache per %s", event)
+
+    def load(self):
+        # carica (o ricarica) l'intero modello dal DB e lo sostituisce atomicamente
+        with self._lock:
+            revision = self.repository.get_config_revision()
+            rooms = {r["id"]: r for r in self.repository.get_rooms()}
+            valve_rooms = {}
+            overrides = {}
+            for v in self.repository.get_valves():
+                if v["room_id"]:
+                    valve_rooms[v["id"]] = v["room_id"]
+                if v["override_heating"] is not None:
+                    overrides[v["id"]] = {"heating": bool(v["override_heating"]), "expires": v["override_expires"]}
+            # valvole il cui override è cambiato rispetto al contenuto precedente
+            changed = {
+                vid for vid in set(overrides) | set(self.overrides)
+                if overrides.get(vid) != self.overrides.get(vid)
+            }
+            # stanze nuove o con configurazione (target, isteresi) cambiata
+            rooms_changed = {rid for rid, room in rooms.items() if self.rooms.get(rid) != room}
+            self.rooms = rooms
+            self.valve_rooms = valve_rooms
+            self.overrides = overrides
+            self.revision = revision
+        logger.info("Cache stato caricata: %d stanze, %d assegnazioni, %d override (rev %s)",
+                    len(rooms), len(valve_rooms), len(overrides), revision)
+        self._emit("reloaded", {"revision": revision, "overrides_changed": changed, "rooms_changed": rooms_changed})
+
+    def get_room_for_valve(self, valve_id):
+        # stanza assegnata alla valvola (dict) oppure None
+        room_id = self.valve_rooms.get(valve_id)
+        if room_id is None:
+            return None
+        return self.rooms.get(room_id)
+
+    def get_override(self, valve_id):
+        # override manuale della valvola oppure None
+        return self.overrides.get(valve_id)
+
+    def _on_repository_event(self, event, data):
+        # applica alla cache le scritture fatte dal repository di questo processo
+        with self._lock:
+            if event == "room_saved":
+                room = data["room"]
+                self.rooms[room["id"]] = room
+            elif event == "room_deleted":
+                room_id = data["room_id"]
+                self.rooms.pop(room_id, None)
+                self.valve_rooms = {v: r for v, r in self.valve_rooms.items() if r != room_id}
+            elif event == "valve_assigned":
+                if data["room_id"]:
+                    self.valve_rooms[data["valve_id"]] = data["room_id"]
+                else:
+                    self.valve_rooms.pop(data["valve_id"], None)
+            elif event == "valve_deleted":
+                self.valve_rooms.pop(data["valve_id"], None)
+                self.overrides.pop(data["valve_id"], None)
+            elif event == "override_set":
+                self.overrides[data["valve_id"]] = {"heating": data["heating"], "expires": data["expires"]}
+            elif event == "override_cleared":
+                self.overrides.pop(data["valve_id"], None)
+            # se nessun altro ha scritto nel frattempo la cache è allineata alla nuova revisione,
+            # altrimenti il poll rileverà la differenza e ricaricherà tutto
+            if data.get("revision") == self.revision + 1:
+                self.revision = data["revision"]
+        self._emit(event, data)
+
+    def start_polling(self, interval=1.0):
+        # avvia il thread che rileva le modifiche fatte da altri processi
+        if self._poll_thread is not None:
+            return
+        self._poll_thread = threading.Thread(target=self._poll, args=(interval,), name="state-cache-poll", daemon=True)
+        self._poll_thread.start()
+
+    def stop_polling(self):
+        self._stop.set()
+
+    def _poll(self, interval):
+        # data_version cambia solo quando un'altra connessione ha fatto commit
+        last_version = None
+        while not self._stop.wait(interval):
+            try:
+                version = get_connection().execute("PRAGMA data_version").fetchone()[0]
+                if version == last_version:
+                    continue
+                last_version = version
+                if self.repository.get_config_revision() != self.revision:
+                    self.load()
+            except Exception:
+                logger.exception("Errore nel poll della cache di stato")
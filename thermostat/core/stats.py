@@ -0,0 +1,204 @@
+from array import array
+import math
+import threading
+
+# finestre mobili di default: (nome, ampiezza del bucket in s, numero di bucket)
+WINDOWS = (("1h", 600, 6), ("24h", 3600, 24))
+
+# valore di stato che conta come riscaldamento (ValveState.HEATING.value)
+HEATING = 1
+_UNKNOWN = -1
+
+
+class _Window:
+    """Ring buffer di `n` bucket da `width` secondi per ogni chiave, su colonne `array`.
+
+    Lo slot del bucket b è b % n; ogni chiave ricorda l'ultimo bucket scritto e
+    gli slot dei bucket saltati vengono azzerati al primo aggiornamento successivo
+    (al più n per aggiornamento, ammortizzati O(1)). In lettura i bucket più
+    vecchi di n * width secondi vengono ignorati.
+    """
+
+    __slots__ = ("name", "width", "n", "last_bucket", "count", "sum", "min", "max", "heating", "observed", "transitions")
+
+    def __init__(self, name, width, n):
+        self.name = name
+        self.width = width
+        self.n = n
+        # per chiave: ultimo bucket scritto (-1 = mai)
+        self.last_bucket = array("q")
+        # per chiave e slot (indice chiave * n + slot)
+        self.count = array("I")
+        self.sum = array("d")
+        self.min = array("f")
+        self.max = array("f")
+        # secondi in riscaldamento e secondi coperti da eventi nel bucket
+        self.heating = array("f")
+        self.observed = array("f")
+        self.transitions = array("H")
+
+    def grow(self):
+        n = self.n
+        self.last_bucket.append(-1)
+        self.count.extend(array("I", [0]) * n)
+        self.sum.extend(array("d", [0.0]) * n)
+        self.min.extend(array("f", [math.inf]) * n)
+        self.max.extend(array("f", [-math.inf]) * n)
+        self.heating.extend(array("f", [0.0]) * n)
+        self.observed.extend(array("f", [0.0]) * n)
+        self.transitions.extend(array("H", [0]) * n)
+
+    def _clear(self, j):
+        self.count[j] = 0
+        self.sum[j] = 0.0
+        self.min[j] = math.inf
+        self.max[j] = -math.inf
+        self.heating[j] = 0.0
+        self.observed[j] = 0.0
+        self.transitions[j] = 0
+
+    def add(self, i, ts, temperature, heating_dt, observed_dt, transition):
+        n = self.n
+        base = i * n
+        bucket = int(ts // self.width)
+        last = self.last_bucket[i]
+        if bucket > last:
+            if last < 0 or bucket - last >= n:
+                for k in range(n):
+                    self._clear(base + k)
+            else:
+                for b in range(last + 1, bucket + 1):
+                    self._clear(base + b % n)
+            self.last_bucket[i] = bucket
+        elif bucket < last:
+            # orologio tornato indietro: contiamo l'evento nell'ultimo bucket
+            bucket = last
+        j = base + bucket % n
+        if temperature is not None:
+            self.count[j] += 1
+            self.sum[j] += temperature
+            if temperature < self.min[j]:
+                self.min[j] = temperature
+            if temperature > self.max[j]:
+                self.max[j] = temperature
+        if observed_dt and ts - observed_dt >= bucket * self.width:
+            # caso comune: l'intervallo dall'evento precedente è tutto nel bucket corrente
+            self.observed[j] += observed_dt
+            if heating_dt:
+                self.heating[j] += heating_dt
+        elif observed_dt:
+            # l'intervallo (ts - observed_dt, ts] viene ripartito tra i bucket che copre,
+            # al più gli ultimi n: un buco lungo (valvola offline) non gonfia il bucket corrente
+            start = max(ts - observed_dt, (bucket - n + 1) * self.width)
+            share = heating_dt / observed_dt
+            b = int(start // self.width)
+            while start < ts:
+                edge = min(ts, (b + 1) * self.width)
+                k = base + b % n
+                self.observed[k] += edge - start
+                if heating_dt:
+                    self.heating[k] += (edge - start) * share
+                start = edge
+                b += 1
+        if transition and self.transitions[j] < 0xFFFF:
+            self.transitions[j] += 1
+
+    def summary(self, i, now):
+        n = self.n
+        base = i * n
+        current = int(now // self.width)
+        last = min(self.last_bucket[i], current)
+        count = 0
+        total = 0.0
+        lo = math.inf
+        hi = -math.inf
+        heating = observed = 0.0
+        transitions = 0
+        for b in range(max(last - n + 1, current - n + 1), last + 1):
+            j = base + b % n
+            count += self.count[j]
+            total += self.sum[j]
+            lo = min(lo, self.min[j])
+            hi = max(hi, self.max[j])
+            heating += self.heating[j]
+            observed += self.observed[j]
+            transitions += self.transitions[j]
+        return {
+            "count": count,
+            "mean": round(total / count, 3) if count else None,
+            "min": round(lo, 2) if count else None,
+            "max": round(hi, 2) if count else None,
+            "heating_s": round(heating, 1),
+            "observed_s": round(observed, 1),
+            "duty_cycle": round(heating / observed, 4) if observed > 0 else None,
+            "transitions": transitions,
+        }
+
+
+class RollingStats:
+    """Statistiche mobili in memoria per chiave (valvola o stanza), aggiornate in O(1).
+
+    Per ogni finestra di `windows` un ring buffer di bucket con conteggio, somma,
+    minimo e massimo delle temperature, secondi in riscaldamento, secondi
+    osservati e cambi di stato. Il tempo tra due eventi della stessa chiave viene
+    attribuito allo stato precedente e ripartito tra i bucket che copre, fino
+    all'ampiezza della finestra.
+    Le colonne sono `array` come nel ValveRegistry: con le finestre di default
+    circa 900 byte per chiave. Le chiavi non vengono mai rimosse.
+    """
+
+    def __init__(self, windows=WINDOWS):
+        self.windows = [_Window(*w) for w in windows]
+        # chiave -> indice nelle colonne
+        self._index = {}
+        self._last_ts = array("d")
+        self._last_state = array("b")
+        self._lock = threading.Lock()
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __len__(self):
+        return len(self._index)
+
+    def keys(self):
+        return list(self._index)
+
+    def _add(self, key):
+        i = len(self._index)
+        for window in self.windows:
+            window.grow()
+        self._last_ts.append(0.0)
+        self._last_state.append(_UNKNOWN)
+        self._index[key] = i
+        return i
+
+    def record(self, key, temperature, state, ts):
+        # evento della chiave: lettura (temperature) e/o stato corrente (HEATING = riscaldamento)
+        with self._lock:
+            i = self._index.get(key)
+            if i is None:
+                i = self._add(key)
+            last_ts = self._last_ts[i]
+            last_state = self._last_state[i]
+            observed_dt = heating_dt = 0.0
+            if last_ts and ts > last_ts:
+                observed_dt = ts - last_ts
+                if last_state == HEATING:
+                    heating_dt = observed_dt
+            transition = last_state != _UNKNOWN and state != last_state
+            for window in self.windows:
+                window.add(i, ts, temperature, heating_dt, observed_dt, transition)
+            if ts > last_ts:
+                self._last_ts[i] = ts
+            self._last_state[i] = state
+
+    def snapshot(self, key, now):
+        # statistiche della chiave per finestra; KeyError se la chiave non ha eventi
+        with self._lock:
+            i = self._index[key]
+            return {
+                "last_ts": self._last_ts[i],
+                "state": self._last_state[i],
+                "windows": {w.name: w.summary(i, now) for w in self.windows},
+            }
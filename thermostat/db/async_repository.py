@@ -0,0 +1,101 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from thermostat.db.repository import ThermostatRepository
+
+
+class AsyncThermostatRepository:
+    """Variante asyncio di `ThermostatRepository` per le rotte FastAPI.
+
+    Le chiamate bloccanti girano su executor dedicati invece che sul threadpool
+    condiviso di FastAPI: le letture su `read_workers` thread (ognuno con la
+    propria connessione persistente, in WAL le letture non si bloccano a vicenda)
+    e le scritture su un unico thread, visto che SQLite ammette un solo writer
+    alla volta. Una scrittura lenta occupa quindi solo il thread di scrittura e
+    non toglie slot alle letture come `/valves` o gli storici.
+    """
+
+    def __init__(self, repository=None, read_workers=4, write_workers=1):
+        # repository sincrono sottostante (i listener restano registrati su di lui)
+        self.repository = repository if repository is not None else ThermostatRepository()
+        self._reads = ThreadPoolExecutor(max_workers=read_workers, thread_name_prefix="db-read")
+        self._writes = ThreadPoolExecutor(max_workers=write_workers, thread_name_prefix="db-write")
+
+    async def _read(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._reads, functools.partial(fn, *args))
+
+    async def _write(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writes, functools.partial(fn, *args))
+
+    async def read(self, fn, *args):
+        # esegue una lettura bloccante esterna al repository (es. il token di ResponseCache)
+        return await self._read(fn, *args)
+
+    def close(self):
+        # attende le scritture in corso e ferma gli executor
+        self._writes.shutdown(wait=True)
+        self._reads.shutdown(wait=True)
+
+    # letture
+
+    async def get_valves(self):
+        return await self._read(self.repository.get_valves)
+
+    async def get_valve(self, valve_id):
+        return await self._read(self.repository.get_valve, valve_id)
+
+    async def get_valve_history(self, valve_id, from_ts=None, to_ts=None, limit=50, resolution="auto"):
+        return await self._read(self.repository.get_valve_history, valve_id, from_ts, to_ts, limit, resolution)
+
+    async def get_rooms(self):
+        return await self._read(self.repository.get_rooms)
+
+    async def get_room(self, room_id):
+        return await self._read(self.repository.get_room, room_id)
+
+    async def get_room_history(self, room_id, from_ts=None, to_ts=None, limit=50, resolution="auto"):
+        return await self._read(self.repository.get_room_history, room_id, from_ts, to_ts, limit, resolution)
+
+    async def get_rooms_matrix(self, from_ts, to_ts, max_buckets=500, room_ids=None):
+        return await self._read(self.repository.get_rooms_matrix, from_ts, to_ts, max_buckets, room_ids)
+
+    async def get_valve_override(self, valve_id):
+        return await self._read(self.repository.get_valve_override, valve_id)
+
+    async def get_config_revision(self):
+        return await self._read(self.repository.get_config_revision)
+
+    # scritture
+
+    async def save_valve(self, valve_id, setpoint, last_seen, state=None):
+        return await self._write(self.repository.save_valve, valve_id, setpoint, last_seen, state)
+
+    async def save_room(self, room_id, name, target_temp, hysteresis):
+        return await self._write(self.repository.save_room, room_id, name, target_temp, hysteresis)
+
+    async def save_rooms(self, rooms):
+        return await self._write(self.repository.save_rooms, rooms)
+
+    async def update_room(self, room_id, name, target_temp, hysteresis):
+        return await self._write(self.repository.update_room, room_id, name, target_temp, hysteresis)
+
+    async def delete_room(self, room_id):
+        return await self._write(self.repository.delete_room, room_id)
+
+    async def assign_valve_to_room(self, valve_id, room_id):
+        return await self._write(self.repository.assign_valve_to_room, valve_id, room_id)
+
+    async def register_valves(self, valves):
+        return await self._write(self.repository.register_valves, valves)
+
+    async def delete_valve(self, valve_id):
+        return await self._write(self.repository.delete_valve, valve_id)
+
+    async def set_valve_override(self, valve_id, heating, expires_ts):
+        return await self._write(self.repository.set_valve_override, valve_id, heating, expires_ts)
+
+    async def clear_valve_override(self, valve_id):
+        return await self._write(self.repository.clear_valve_override, valve_id)
@@ -1,11 +1,133 @@
+import os
 import sqlite3
+import threading
+
+from thermostat.db import rollups
+from thermostat.db.partitions import partitions, READINGS_VIEW
 
 DB_NAME = "thermostat.db"
 
+# PRAGMA applicati una sola volta per ogni connessione aperta dal manager
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA busy_timeout=5000",
+)
+
+# indici delle tabelle fisse: (nome, tabella, colonne); gli indici delle partizioni
+# dello storico sono in partitions.PARTITION_INDEXES
+INDEXES = (
+    # ricerche e join per stanza (storico stanza, rollup, provisioning)
+    ("idx_valves_room_id", "valves", "room_id"),
+)
+
+
+class ConnectionManager:
+    """Gestore di connessioni sqlite persistenti, una per thread e per processo.
+
+    Le connessioni restano aperte per tutta la vita del thread e vengono
+    riaperte automaticamente dopo un fork o se cambia il percorso del DB.
+    Quelle dei thread terminati vengono chiuse alla prima apertura successiva
+    (o con `prune`): i thread dei pool di executor vanno e vengono.
+    """
+
+    def __init__(self):
+        # storage per-thread: ogni thread ha la propria connessione
+        self._local = threading.local()
+        # thread -> connessione aperta (per close_all e per chiudere quelle dei thread terminati)
+        self._conns = {}
+        self._lock = threading.Lock()
+        # pid del processo che ha creato le connessioni
+        self._pid = os.getpid()
+
+    def _open(self, path):
+        # check_same_thread=False solo per poterla chiudere da un altro thread (close_all, prune):
+        # la connessione è usata esclusivamente dal thread che l'ha aperta
+        conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _reset_after_fork(self):
+        # dopo un fork le connessioni del padre non vanno usate né chiuse
+        self._local = threading.local()
+        with self._lock:
+            self._conns = {}
+        self._pid = os.getpid()
+
+    def get(self, path=None):
+        # ritorna la connessione del thread corrente aprendola se necessario
+        path = path or DB_NAME
+        if os.getpid() != self._pid:
+            self._reset_after_fork()
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.path == path:
+            return conn
+        if conn is not None:
+            # il percorso del DB è cambiato: chiudiamo la vecchia connessione
+            self._discard(conn)
+        self.prune()
+        conn = self._open(path)
+        self._local.conn = conn
+        self._local.path = path
+        with self._lock:
+            self._conns[threading.current_thread()] = conn
+        return conn
+
+    def _discard(self, conn):
+        with self._lock:
+            self._conns = {t: c for t, c in self._conns.items() if c is not conn}
+        self._close(conn)
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def prune(self):
+        # chiude le connessioni dei thread terminati; ritorna quante ne ha chiuse
+        with self._lock:
+            dead = [t for t in self._conns if not t.is_alive()]
+            conns = [self._conns.pop(t) for t in dead]
+        for conn in conns:
+            self._close(conn)
+        return len(conns)
+
+    def open_count(self):
+        with self._lock:
+            return len(self._conns)
+
+    def close(self):
+        # chiude la connessione del thread corrente (se presente)
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            self._discard(conn)
+            self._local.conn = None
+
+    def close_all(self):
+        # chiude tutte le connessioni note (es. allo shutdown)
+        with self._lock:
+            conns, self._conns = list(self._conns.values()), {}
+        for conn in conns:
+            self._close(conn)
+        self._local = threading.local()
+
+
+connections = ConnectionManager()
+
 
 def get_connection():
-    # ritorna una connessione sqlite al DB locale
-    return sqlite3.connect(DB_NAME)
+    # ritorna la connessione sqlite persistente del thread corrente
+    return connections.get(DB_NAME)
+
+
+def close_connections():
+    # chiude tutte le connessioni del processo corrente
+    connections.close_all()
 
 
 def init_db():
@@ -23,15 +145,13 @@ def init_db():
     """
     )
 
-    # tabella storico temperature
+    # catalogo delle partizioni dello storico temperature (vedi partitions.py)
     cursor.execute(
         """
-    CREATE TABLE IF NOT EXISTS temperature_readings (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    valve_id TEXT,
-    temperature REAL,
-    timestamp REAL,
-    FOREIGN KEY(valve_id) REFERENCES valves(id))
+    CREATE TABLE IF NOT EXISTS reading_partitions (
+        name TEXT PRIMARY KEY,
+        start_ts REAL,
+        end_ts REAL)
     """
     )
 
@@ -46,6 +166,15 @@ def init_db():
     """
     )
 
+    # metadati chiave/valore (es. revisione della configurazione usata dalle cache)
+    cursor.execute(
+        """
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value INTEGER)
+    """
+    )
+
     # semplice migrazione: aggiunta di colonne se non presenti
     cursor.execute("PRAGMA table_info(valves)")
     cols = [r[1] for r in cursor.fetchall()]
@@ -58,7 +187,23 @@ def init_db():
     if "state" not in cols:
         cursor.execute("ALTER TABLE valves ADD COLUMN state INTEGER DEFAULT 0")
 
-    # indice per ricerche per stanza
-    cursor.execute("CREATE INDEX IF NOT EXISTS idx_valves_room_id ON valves(room_id)")
+    # indici delle tabelle fisse
+    for name, table, columns in INDEXES:
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+
+    # migrazione: la vecchia tabella temperature_readings diventa un insieme di partizioni
+    # e temperature_readings resta come vista di compatibilità
+    partitions.migrate_legacy(cursor)
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (READINGS_VIEW,))
+    if cursor.fetchone() is None:
+        partitions.rebuild_view(cursor)
+    # indici coprenti su tutte le partizioni (anche quelle create prima che esistessero)
+    partitions.ensure_indexes(cursor)
+
+    # rollup 1m/15m/1h per valvola e stanza: alla prima creazione li ricostruiamo dallo storico
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'rollups_valve'")
+    missing_rollups = cursor.fetchone() is None
+    rollups.create_tables(cursor)
+    if missing_rollups:
+        rollups.backfill(cursor)
     conn.commit()
-    conn.close()
\ No newline at end of file
@@ -0,0 +1,148 @@
+import argparse
+import csv
+import io
+import json
+import sqlite3
+import sys
+
+from thermostat.db import database
+from thermostat.db.partitions import partitions
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:  # pyarrow è opzionale: senza, il formato arrow non è disponibile
+    pyarrow = None
+
+COLUMNS = ("valve_id", "temperature", "timestamp")
+CHUNK_SIZE = 5000
+
+
+def open_connection():
+    # connessione dedicata all'export: lo streaming HTTP può riprendere il generatore
+    # da thread diversi del threadpool, quindi non usiamo il pool per-thread
+    return sqlite3.connect(database.DB_NAME, timeout=5.0, check_same_thread=False)
+
+
+def iter_chunks(conn, valve_id=None, room_id=None, from_ts=None, to_ts=None, chunk_size=CHUNK_SIZE):
+    # letture (valve_id, temperature, timestamp) a blocchi di chunk_size righe,
+    # partizione per partizione dalla più vecchia, senza materializzare il risultato
+    cursor = conn.cursor()
+    names = [p[0] for p in partitions.list(cursor, from_ts, to_ts)]
+    where, params = [], []
+    if valve_id is not None:
+        where.append("valve_id = ?")
+        params.append(valve_id)
+    if room_id is not None:
+        where.append("valve_id IN (SELECT id FROM valves WHERE room_id = ?)")
+        params.append(room_id)
+    if from_ts is not None:
+        where.append("timestamp >= ?")
+        params.append(from_ts)
+    if to_ts is not None:
+        where.append("timestamp <= ?")
+        params.append(to_ts)
+    clause = (" WHERE " + " AND ".join(where)) if where else ""
+    for name in names:
+        try:
+            cursor.execute(f"SELECT valve_id, temperature, timestamp FROM {name}{clause}", params)
+        except sqlite3.OperationalError as e:
+            # partizione eliminata dalla retention durante l'export
+            if "no such table" in str(e):
+                continue
+            raise
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+
+
+def encode_csv(chunks):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(COLUMNS)
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buf.getvalue().encode()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode()
+
+
+def encode_ndjson(chunks):
+    for rows in chunks:
+        yield "".join(
+            json.dumps({"valve_id": r[0], "temperature": r[1], "timestamp": r[2]}) + "\n" for r in rows
+        ).encode()
+
+
+def encode_arrow(chunks):
+    # Arrow IPC stream: uno schema seguito da un record batch per blocco
+    schema = pyarrow.schema(
+        [("valve_id", pyarrow.string()), ("temperature", pyarrow.float64()), ("timestamp", pyarrow.float64())]
+    )
+    buf = io.BytesIO()
+    writer = pyarrow.ipc.new_stream(buf, schema)
+    for rows in chunks:
+        columns = list(zip(*rows))
+        writer.write_batch(pyarrow.record_batch([pyarrow.array(c, type=f.type) for c, f in zip(columns, schema)], schema=schema))
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    writer.close()
+    yield buf.getvalue()
+
+
+# formato -> (media type, encoder)
+FORMATS = {
+    "csv": ("text/csv", encode_csv),
+    "ndjson": ("application/x-ndjson", encode_ndjson),
+    "arrow": ("application/vnd.apache.arrow.stream", encode_arrow),
+}
+
+
+def available_formats():
+    return [f for f in FORMATS if f != "arrow" or pyarrow is not None]
+
+
+def stream_export(fmt, valve_id=None, room_id=None, from_ts=None, to_ts=None, chunk_size=CHUNK_SIZE):
+    # generatore di bytes nel formato richiesto; la connessione viene chiusa a fine stream
+    # (anche se il client si disconnette a metà)
+    if fmt not in available_formats():
+        raise ValueError(f"formato non supportato: {fmt}")
+    encoder = FORMATS[fmt][1]
+    conn = open_connection()
+    try:
+        yield from encoder(iter_chunks(conn, valve_id, room_id, from_ts, to_ts, chunk_size))
+    finally:
+        conn.close()
+
+
+def main():
+    # CLI: export dello storico su file o stdout
+    parser = argparse.ArgumentParser(description="Export in streaming dello storico temperature")
+    parser.add_argument("--db", default=database.DB_NAME)
+    parser.add_argument("--format", choices=tuple(FORMATS), default="csv")
+    parser.add_argument("--valve", default=None)
+    parser.add_argument("--room", default=None)
+    parser.add_argument("--from-ts", type=float, default=None)
+    parser.add_argument("--to-ts", type=float, default=None)
+    parser.add_argument("-o", "--output", default="-", help="file di destinazione (- = stdout)")
+    args = parser.parse_args()
+
+    if args.format not in available_formats():
+        parser.error("il formato arrow richiede pyarrow")
+    database.DB_NAME = args.db
+    out = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    try:
+        for data in stream_export(args.format, args.valve, args.room, args.from_ts, args.to_ts):
+            out.write(data)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
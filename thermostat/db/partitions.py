@@ -0,0 +1,281 @@
+import argparse
+import bisect
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# granularità delle nuove partizioni: "day" oppure "week" (UTC)
+PARTITION_SPAN = "day"
+PARTITION_PREFIX = "readings_"
+# nome della vista di compatibilità che unisce le partizioni più recenti
+READINGS_VIEW = "temperature_readings"
+# partizioni incluse nella vista: SQLite limita una SELECT composta a 500 termini
+# (SQLITE_MAX_COMPOUND_SELECT), oltre i quali la CREATE VIEW fallisce
+VIEW_PARTITIONS = 400
+# indici creati su ogni partizione: (suffisso del nome, colonne).
+# (valve_id, timestamp, temperature) copre lo storico per valvola e il join per stanza
+# senza accedere alla tabella
+PARTITION_INDEXES = (("valve_ts", "valve_id, timestamp, temperature"),)
+
+_DAY = 86400
+_WEEK = 7 * _DAY
+# il giorno 0 dell'epoch (1970-01-01) era un giovedì: spostiamo l'inizio settimana a lunedì
+_WEEK_OFFSET = 4 * _DAY
+
+
+def partition_bounds(ts, span=PARTITION_SPAN):
+    # intervallo [start, end) della partizione che contiene ts
+    if span == "week":
+        start = ((int(ts) - _WEEK_OFFSET) // _WEEK) * _WEEK + _WEEK_OFFSET
+        return start, start + _WEEK
+    start = (int(ts) // _DAY) * _DAY
+    return start, start + _DAY
+
+
+def partition_name(start):
+    return PARTITION_PREFIX + time.strftime("%Y%m%d", time.gmtime(start))
+
+
+class ReadingPartitions:
+    """Storico temperature partizionato per giorno o settimana.
+
+    Ogni partizione è una tabella `readings_YYYYMMDD` (valve_id, temperature,
+    timestamp) registrata nel catalogo `reading_partitions` con il proprio
+    intervallo [start_ts, end_ts). Le query vengono instradate solo alle partizioni
+    che intersecano l'intervallo richiesto e la retention elimina una partizione
+    intera con un DROP TABLE invece di DELETE riga per riga.
+    `temperature_readings` resta disponibile come vista UNION ALL delle ultime
+    `VIEW_PARTITIONS` partizioni; lo storico completo si legge tramite `list()`, come
+    fanno repository, rollup ed export.
+    """
+
+    def __init__(self, span=PARTITION_SPAN):
+        self.span = span
+        # cache in-process del catalogo: liste parallele ordinate per start
+        self._starts = []
+        self._entries = []
+        self._lock = threading.Lock()
+
+    def _load(self, cursor):
+        cursor.execute("SELECT name, start_ts, end_ts FROM reading_partitions ORDER BY start_ts")
+        entries = [(r[1], r[2], r[0]) for r in cursor.fetchall()]
+        with self._lock:
+            self._entries = entries
+            self._starts = [e[0] for e in entries]
+
+    def invalidate(self):
+        # forza la rilettura del catalogo (es. dopo un DROP fatto da un altro processo)
+        with self._lock:
+            self._entries = []
+            self._starts = []
+
+    def _lookup(self, ts):
+        with self._lock:
+            idx = bisect.bisect_right(self._starts, ts) - 1
+            if idx >= 0:
+                start, end, name = self._entries[idx]
+                if start <= ts < end:
+                    return name
+        return None
+
+    def _bounds(self, name):
+        with self._lock:
+            for start, end, entry in self._entries:
+                if entry == name:
+                    return start, end
+        raise KeyError(name)
+
+    def partition_for(self, cursor, ts, update_view=True):
+        # nome della partizione che contiene ts, creandola se necessario
+        name = self._lookup(ts)
+        if name is not None:
+            return name
+        self._load(cursor)
+        name = self._lookup(ts)
+        if name is not None:
+            return name
+        start, end = partition_bounds(ts, self.span)
+        name = partition_name(start)
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {name} (valve_id TEXT, temperature REAL, timestamp REAL)"
+        )
+        self.create_indexes(cursor, name)
+        cursor.execute(
+            "INSERT OR IGNORE INTO reading_partitions (name, start_ts, end_ts) VALUES (?, ?, ?)",
+            (name, start, end),
+        )
+        if update_view:
+            self.rebuild_view(cursor)
+        self._load(cursor)
+        logger.info("Creata partizione %s", name)
+        return name
+
+    def create_indexes(self, cursor, name):
+        # crea gli indici mancanti di una partizione
+        for suffix, columns in PARTITION_INDEXES:
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{name}_{suffix} ON {name} ({columns})")
+
+    def ensure_indexes(self, cursor):
+        # allinea gli indici di tutte le partizioni a PARTITION_INDEXES (usato da init_db)
+        names = [r[0] for r in self.list(cursor)]
+        for name in names:
+            self.create_indexes(cursor, name)
+        return names
+
+    def insert_many(self, cursor, rows):
+        # inserisce righe (valve_id, temperature, timestamp) raggruppandole per partizione
+        groups = {}
+        for row in rows:
+            groups.setdefault(self.partition_for(cursor, row[2]), []).append(row)
+        for name, group in groups.items():
+            try:
+                cursor.executemany(f"INSERT INTO {name} (valve_id, temperature, timestamp) VALUES (?, ?, ?)", group)
+            except sqlite3.OperationalError as e:
+                if "no such table" not in str(e):
+                    raise
+                # partizione eliminata da un altro processo: ricreiamola
+                self.invalidate()
+                for row in group:
+                    part = self.partition_for(cursor, row[2])
+                    cursor.execute(f"INSERT INTO {part} (valve_id, temperature, timestamp) VALUES (?, ?, ?)", row)
+
+    def list(self, cursor, from_ts=None, to_ts=None, newest_first=False):
+        # partizioni (name, start_ts, end_ts) che intersecano [from_ts, to_ts]
+        query = "SELECT name, start_ts, end_ts FROM reading_partitions WHERE 1 = 1"
+        params = []
+        if from_ts is not None:
+            query += " AND end_ts > ?"
+            params.append(from_ts)
+        if to_ts is not None:
+            query += " AND start_ts <= ?"
+            params.append(to_ts)
+        query += " ORDER BY start_ts DESC" if newest_first else " ORDER BY start_ts"
+        cursor.execute(query, tuple(params))
+        return cursor.fetchall()
+
+    def rebuild_view(self, cursor):
+        # ricrea la vista temperature_readings come UNION ALL delle partizioni più recenti
+        cursor.execute("SELECT type FROM sqlite_master WHERE name = ?", (READINGS_VIEW,))
+        row = cursor.fetchone()
+        if row is not None and row[0] == "table":
+            # schema precedente non ancora migrato (vedi migrate_legacy)
+            return
+        cursor.execute("SELECT name FROM reading_partitions ORDER BY start_ts DESC LIMIT ?", (VIEW_PARTITIONS,))
+        names = [r[0] for r in reversed(cursor.fetchall())]
+        cursor.execute(f"DROP VIEW IF EXISTS {READINGS_VIEW}")
+        if names:
+            body = " UNION ALL ".join(f"SELECT valve_id, temperature, timestamp FROM {n}" for n in names)
+        else:
+            body = "SELECT NULL AS valve_id, NULL AS temperature, NULL AS timestamp WHERE 0"
+        cursor.execute(f"CREATE VIEW {READINGS_VIEW} AS {body}")
+
+    def drop_before(self, cursor, ts):
+        # elimina le partizioni interamente precedenti a ts (O(1) per partizione)
+        cursor.execute("SELECT name FROM reading_partitions WHERE end_ts <= ?", (ts,))
+        names = [r[0] for r in cursor.fetchall()]
+        for name in names:
+            cursor.execute(f"DROP TABLE IF EXISTS {name}")
+            cursor.execute("DELETE FROM reading_partitions WHERE name = ?", (name,))
+        if names:
+            self.rebuild_view(cursor)
+            self.invalidate()
+        return names
+
+    def archive_before(self, cursor, ts, archive_path):
+        # copia le partizioni precedenti a ts in un file sqlite separato e le elimina
+        cursor.execute("SELECT name FROM reading_partitions WHERE end_ts <= ?", (ts,))
+        names = [r[0] for r in cursor.fetchall()]
+        if not names:
+            return []
+        cursor.execute("ATTACH DATABASE ? AS archive", (archive_path,))
+        try:
+            for name in names:
+                cursor.execute(f"CREATE TABLE IF NOT EXISTS archive.{name} AS SELECT * FROM main.{name} WHERE 0")
+                cursor.execute(f"INSERT INTO archive.{name} SELECT * FROM main.{name}")
+        finally:
+            cursor.connection.commit()
+            cursor.execute("DETACH DATABASE archive")
+        return self.drop_before(cursor, ts)
+
+    def migrate_legacy(self, cursor):
+        # converte una tabella temperature_readings monolitica (vecchio schema) in partizioni
+        cursor.execute("SELECT type FROM sqlite_master WHERE name = ?", (READINGS_VIEW,))
+        row = cursor.fetchone()
+        if row is None or row[0] != "table":
+            return 0
+        cursor.execute(f"SELECT COUNT(*) FROM {READINGS_VIEW}")
+        count = cursor.fetchone()[0]
+        # giorni effettivamente presenti nei dati (niente partizioni vuote per i buchi)
+        cursor.execute(
+            f"SELECT DISTINCT CAST(timestamp / {_DAY} AS INTEGER) FROM {READINGS_VIEW} WHERE timestamp IS NOT NULL"
+        )
+        days = sorted(r[0] for r in cursor.fetchall())
+        moved = 0
+        done = set()
+        for day in days:
+            # la vista verrà creata al termine, al posto della vecchia tabella
+            name = self.partition_for(cursor, day * _DAY, update_view=False)
+            if name in done:
+                continue
+            done.add(name)
+            start, end = self._bounds(name)
+            cursor.execute(
+                f"INSERT INTO {name} (valve_id, temperature, timestamp) "
+                f"SELECT valve_id, temperature, timestamp FROM {READINGS_VIEW} "
+                "WHERE timestamp >= ? AND timestamp < ?",
+                (start, end),
+            )
+            moved += cursor.rowcount
+        if moved != count:
+            logger.warning("Migrazione partizioni: %d righe senza timestamp scartate", count - moved)
+        # la vista viene ricreata al posto della vecchia tabella
+        cursor.execute(f"DROP TABLE {READINGS_VIEW}")
+        self.rebuild_view(cursor)
+        logger.info("Migrazione partizioni completata: %d righe", moved)
+        return moved
+
+
+partitions = ReadingPartitions()
+
+
+def main():
+    # CLI di manutenzione: elenco, migrazione e retention delle partizioni
+    from thermostat.db import database
+
+    parser = argparse.ArgumentParser(description="Gestione delle partizioni dello storico temperature")
+    parser.add_argument("--db", default=database.DB_NAME)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("list")
+    # la migrazione dello schema precedente viene applicata da init_db
+    sub.add_parser("migrate")
+    drop = sub.add_parser("drop")
+    drop.add_argument("--older-than-days", type=float, required=True)
+    drop.add_argument("--archive", default=None, help="file sqlite in cui archiviare prima di eliminare")
+    args = parser.parse_args()
+
+    database.DB_NAME = args.db
+    # init_db applica anche la migrazione dei DB con lo schema precedente
+    database.init_db()
+    conn = database.get_connection()
+    with conn:
+        cursor = conn.cursor()
+        if args.cmd == "list":
+            for name, start, end in partitions.list(cursor):
+                cursor.execute(f"SELECT COUNT(*) FROM {name}")
+                print(f"{name}  {time.strftime('%Y-%m-%d', time.gmtime(start))}  rows={cursor.fetchone()[0]}")
+        elif args.cmd == "drop":
+            cutoff = time.time() - args.older_than_days * _DAY
+            if args.archive:
+                names = partitions.archive_before(cursor, cutoff, args.archive)
+            else:
+                names = partitions.drop_before(cursor, cutoff)
+            print("dropped: " + (", ".join(names) or "-"))
+        else:
+            print("migrated")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,55 +1,109 @@
 import time
+import logging
+from thermostat.db import rollups
 from thermostat.db.database import get_connection
+from thermostat.db.partitions import partitions
+
+logger = logging.getLogger(__name__)
+
+
+def _bump_config_revision(cursor):
+    # incrementa il contatore di revisione della configurazione (stanze, assegnazioni,
+    # override) nella stessa transazione della scrittura e ne ritorna il nuovo valore
+    cursor.execute(
+        "INSERT INTO meta (key, value) VALUES ('config_rev', 1) "
+        "ON CONFLICT(key) DO UPDATE SET value = value + 1"
+    )
+    cursor.execute("SELECT value FROM meta WHERE key = 'config_rev'")
+    return cursor.fetchone()[0]
 
 
 class ThermostatRepository:
     """Livello di accesso al database SQLite.
 
     Contiene metodi per salvare e leggere valvole, stanze e letture di temperatura.
-    I metodi sono volutamente semplici e usano connessioni sqlite ad hoc.
+    Le connessioni sono persistenti (una per thread, vedi `database.ConnectionManager`):
+    i metodi di scrittura usano la connessione come context manager così che
+    un errore esegua il rollback senza lasciare transazioni aperte.
+
+    Le scritture di configurazione incrementano `meta.config_rev` e notificano i
+    listener registrati con `add_listener` (es. la cache di stato del controller).
     """
 
+    def __init__(self):
+        # callback(event, data) chiamate dopo ogni modifica di configurazione
+        self._listeners = []
+
+    def add_listener(self, callback):
+        # registra una callback per gli eventi di configurazione
+        self._listeners.append(callback)
+
+    def _notify(self, event, **data):
+        for callback in list(self._listeners):
+            try:
+                callback(event, data)
+            except Exception:
+                logger.exception("Errore nel listener del repository per %s", event)
+
+    def get_config_revision(self):
+        # revisione corrente della configurazione (0 se mai modificata)
+        conn = get_connection()
+        row = conn.execute("SELECT value FROM meta WHERE key = 'config_rev'").fetchone()
+        return row[0] if row else 0
+
     def save_valve(self, valve_id, setpoint, last_seen, state=None):
         # salva o aggiorna una riga nella tabella valves preservando room_id
         conn = get_connection()
-        cursor = conn.cursor()
-
-        # Inseriamo solo se manca la riga (INSERT OR IGNORE) per non perdere room_id
-        cursor.execute(
-            "INSERT OR IGNORE INTO valves (id, setpoint, last_seen) VALUES (?, ?, ?)",
-            (valve_id, setpoint, last_seen),
-        )
+        with conn:
+            cursor = conn.cursor()
 
-        # Aggiorniamo i campi setpoint/last_seen e opzionalmente lo stato
-        if state is None:
-            cursor.execute(
-                "UPDATE valves SET setpoint = ?, last_seen = ? WHERE id = ?",
-                (setpoint, last_seen, valve_id),
-            )
-        else:
+            # Inseriamo solo se manca la riga (INSERT OR IGNORE) per non perdere room_id
             cursor.execute(
-                "UPDATE valves SET setpoint = ?, last_seen = ?, state = ? WHERE id = ?",
-                (setpoint, last_seen, state, valve_id),
+                "INSERT OR IGNORE INTO valves (id, setpoint, last_seen) VALUES (?, ?, ?)",
+                (valve_id, setpoint, last_seen),
             )
 
-        conn.commit()
-        conn.close()
-
-    def save_temperature(self, valve_id, temperature):
-        # registra una lettura di temperatura nella tabella temperature_readings
+            # Aggiorniamo i campi setpoint/last_seen e opzionalmente lo stato
+            if state is None:
+                cursor.execute(
+                    "UPDATE valves SET setpoint = ?, last_seen = ? WHERE id = ?",
+                    (setpoint, last_seen, valve_id),
+                )
+            else:
+                cursor.execute(
+                    "UPDATE valves SET setpoint = ?, last_seen = ?, state = ? WHERE id = ?",
+                    (setpoint, last_seen, state, valve_id),
+                )
+
+    def save_temperature(self, valve_id, temperature, timestamp=None):
+        # registra una lettura di temperatura nella partizione del giorno corrispondente
         conn = get_connection()
-        cursor = conn.cursor()
-
-        cursor.execute(
-            """
-        INSERT INTO temperature_readings (valve_id, temperature, timestamp)
-        VALUES (?, ?, ?)
-        """,
-            (valve_id, temperature, time.time()),
-        )
-
-        conn.commit()
-        conn.close()
+        with conn:
+            cursor = conn.cursor()
+            row = (valve_id, temperature, time.time() if timestamp is None else timestamp)
+            partitions.insert_many(cursor, [row])
+            rollups.update(cursor, [row])
+
+    def write_batch(self, readings, valves):
+        # scrive in un'unica transazione un batch di letture (valve_id, temperature, timestamp)
+        # e di aggiornamenti valvole (valve_id, setpoint, last_seen, state|None)
+        conn = get_connection()
+        with conn:
+            cursor = conn.cursor()
+            if readings:
+                partitions.insert_many(cursor, readings)
+                # rollup aggiornati nella stessa transazione delle letture
+                rollups.update(cursor, readings)
+            if valves:
+                cursor.executemany(
+                    "INSERT OR IGNORE INTO valves (id, setpoint, last_seen) VALUES (?, ?, ?)",
+                    [(v[0], v[1], v[2]) for v in valves],
+                )
+                # state NULL => lasciamo invariato lo stato salvato
+                cursor.executemany(
+                    "UPDATE valves SET setpoint = ?, last_seen = ?, state = COALESCE(?, state) WHERE id = ?",
+                    [(v[1], v[2], v[3], v[0]) for v in valves],
+                )
 
     def get_valves(self):
         # restituisce tutte le valvole con campi utili per la UI
@@ -59,7 +113,6 @@ class ThermostatRepository:
             "SELECT id, setpoint, last_seen, room_id, override_heating, override_expires, state FROM valves"
         )
         rows = cursor.fetchall()
-        conn.close()
         return [
             {
                 "id": r[0],
@@ -82,7 +135,6 @@ class ThermostatRepository:
             (valve_id,),
         )
         row = cursor.fetchone()
-        conn.close()
         if not row:
             return None
         return {
@@ -95,49 +147,77 @@ class ThermostatRepository:
             "state": row[6],
         }
 
-    def get_valve_history(self, valve_id, from_ts=None, to_ts=None, limit=50):
-        # restituisce lo storico delle letture per una valvola con filtri opzionali
+    def get_valve_history(self, valve_id, from_ts=None, to_ts=None, limit=50, resolution="auto"):
+        # restituisce lo storico delle letture per una valvola con filtri opzionali;
+        # resolution: auto | raw | 1m | 15m | 1h (vedi rollups.resolve)
         conn = get_connection()
         cursor = conn.cursor()
 
-        query = """
-        SELECT temperature, timestamp
-        FROM temperature_readings
-        WHERE valve_id = ?
-        """
-        params = [valve_id]
+        bucket = rollups.resolve(cursor, "valve", valve_id, from_ts, to_ts, limit, resolution)
+        if bucket is not None:
+            return rollups.query(
+                cursor, "valve", valve_id, bucket, from_ts or 0, time.time() if to_ts is None else to_ts, limit
+            )
 
-        if from_ts is not None:
-            query += " AND timestamp >= ?"
-            params.append(from_ts)
-        if to_ts is not None:
-            query += " AND timestamp <= ?"
-            params.append(to_ts)
+        # interroghiamo solo le partizioni nell'intervallo, dalla più recente,
+        # fermandoci quando abbiamo raccolto `limit` righe
+        rows = []
+        for name, _, _ in partitions.list(cursor, from_ts, to_ts, newest_first=True):
+            query = f"""
+            SELECT temperature, timestamp
+            FROM {name}
+            WHERE valve_id = ?
+            """
+            params = [valve_id]
 
-        query += " ORDER BY timestamp DESC LIMIT ?"
-        params.append(limit)
+            if from_ts is not None:
+                query += " AND timestamp >= ?"
+                params.append(from_ts)
+            if to_ts is not None:
+                query += " AND timestamp <= ?"
+                params.append(to_ts)
 
-        cursor.execute(query, tuple(params))
-        rows = cursor.fetchall()
-        conn.close()
+            query += " ORDER BY timestamp DESC LIMIT ?"
+            params.append(limit - len(rows))
+
+            cursor.execute(query, tuple(params))
+            rows.extend(cursor.fetchall())
+            if len(rows) >= limit:
+                break
 
         return [{"temperature": r[0], "timestamp": r[1]} for r in rows]
 
     def save_room(self, room_id, name, target_temp, hysteresis):
         # crea o aggiorna una stanza
         conn = get_connection()
-        cursor = conn.cursor()
+        with conn:
+            cursor = conn.cursor()
 
-        cursor.execute(
-            """
-        INSERT OR REPLACE INTO rooms (id, name, target_temp, hysteresis)
-        VALUES (?, ?, ?, ?)
-        """,
-            (room_id, name, target_temp, hysteresis),
-        )
-
-        conn.commit()
-        conn.close()
+            cursor.execute(
+                """
+            INSERT OR REPLACE INTO rooms (id, name, target_temp, hysteresis)
+            VALUES (?, ?, ?, ?)
+            """,
+                (room_id, name, target_temp, hysteresis),
+            )
+            rev = _bump_config_revision(cursor)
+        room = {"id": room_id, "name": name, "target_temp": target_temp, "hysteresis": hysteresis}
+        self._notify("room_saved", room=room, revision=rev)
+
+    def save_rooms(self, rooms):
+        # crea o aggiorna molte stanze (dict id/name/target_temp/hysteresis) in un'unica transazione
+        if not rooms:
+            return
+        conn = get_connection()
+        with conn:
+            cursor = conn.cursor()
+            cursor.executemany(
+                "INSERT OR REPLACE INTO rooms (id, name, target_temp, hysteresis) VALUES (?, ?, ?, ?)",
+                [(r["id"], r["name"], r["target_temp"], r["hysteresis"]) for r in rooms],
+            )
+            rev = _bump_config_revision(cursor)
+        for room in rooms:
+            self._notify("room_saved", room=dict(room), revision=rev)
 
     def get_rooms(self):
         # ritorna tutte le stanze
@@ -146,7 +226,6 @@ class ThermostatRepository:
 
         cursor.execute("SELECT id, name, target_temp, hysteresis FROM rooms")
         rows = cursor.fetchall()
-        conn.close()
 
         rooms = []
         for row in rows:
@@ -163,7 +242,6 @@ class ThermostatRepository:
             (room_id,),
         )
         row = cursor.fetchone()
-        conn.close()
 
         if row:
             return {"id": row[0], "name": row[1], "target_temp": row[2], "hysteresis": row[3]}
@@ -173,87 +251,116 @@ class ThermostatRepository:
     def assign_valve_to_room(self, valve_id, room_id):
         # associa una valvola a una stanza; se la valvola non esiste la crea
         conn = get_connection()
-        cursor = conn.cursor()
-
-        cursor.execute("""
-        UPDATE valves
-        SET room_id = ?
-        WHERE id = ?
-        """, (room_id, valve_id))
-
-        if cursor.rowcount == 0:
-            # la valvola non esiste: inseriscila con setpoint di default
-            import time as _t
-
-            cursor.execute(
-                """
-            INSERT INTO valves (id, setpoint, last_seen, room_id)
-            VALUES (?, ?, ?, ?)
-            """,
-                (valve_id, 22.0, _t.time(), room_id),
+        with conn:
+            cursor = conn.cursor()
+
+            cursor.execute("""
+            UPDATE valves
+            SET room_id = ?
+            WHERE id = ?
+            """, (room_id, valve_id))
+
+            if cursor.rowcount == 0:
+                # la valvola non esiste: inseriscila con setpoint di default
+                import time as _t
+
+                cursor.execute(
+                    """
+                INSERT INTO valves (id, setpoint, last_seen, room_id)
+                VALUES (?, ?, ?, ?)
+                """,
+                    (valve_id, 22.0, _t.time(), room_id),
+                )
+            rev = _bump_config_revision(cursor)
+        self._notify("valve_assigned", valve_id=valve_id, room_id=room_id, revision=rev)
+
+    def register_valves(self, valves):
+        # registra molte valvole (valve_id, room_id|None) in un'unica transazione: le valvole
+        # esistenti mantengono setpoint e stato, room_id None lascia invariata la stanza
+        if not valves:
+            return
+        conn = get_connection()
+        with conn:
+            cursor = conn.cursor()
+            now = time.time()
+            cursor.executemany(
+                "INSERT INTO valves (id, setpoint, last_seen, room_id) VALUES (?, 22.0, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET room_id = COALESCE(excluded.room_id, room_id)",
+                [(vid, now, room_id) for vid, room_id in valves],
             )
-        conn.commit()
-        conn.close()
+            rev = _bump_config_revision(cursor)
+        for vid, room_id in valves:
+            if room_id:
+                self._notify("valve_assigned", valve_id=vid, room_id=room_id, revision=rev)
 
     def delete_valve(self, valve_id):
         # elimina valvola e relativo storico temperature
         conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM valves WHERE id = ?", (valve_id,))
-        cursor.execute("DELETE FROM temperature_readings WHERE valve_id = ?", (valve_id,))
-        conn.commit()
-        conn.close()
+        with conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM valves WHERE id = ?", (valve_id,))
+            for name, _, _ in partitions.list(cursor):
+                cursor.execute(f"DELETE FROM {name} WHERE valve_id = ?", (valve_id,))
+            cursor.execute("DELETE FROM rollups_valve WHERE valve_id = ?", (valve_id,))
+            rev = _bump_config_revision(cursor)
+        self._notify("valve_deleted", valve_id=valve_id, revision=rev)
 
     def update_room(self, room_id, name: str, target_temp: float, hysteresis: float):
         # aggiorna i campi di una stanza
         conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE rooms SET name = ?, target_temp = ?, hysteresis = ? WHERE id = ?",
-            (name, target_temp, hysteresis, room_id),
-        )
-        conn.commit()
-        conn.close()
+        with conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE rooms SET name = ?, target_temp = ?, hysteresis = ? WHERE id = ?",
+                (name, target_temp, hysteresis, room_id),
+            )
+            if cursor.rowcount == 0:
+                return
+            rev = _bump_config_revision(cursor)
+        room = {"id": room_id, "name": name, "target_temp": target_temp, "hysteresis": hysteresis}
+        self._notify("room_saved", room=room, revision=rev)
 
     def delete_room(self, room_id):
         # rimuove una stanza e deslega le valvole associate
         conn = get_connection()
-        cursor = conn.cursor()
-        # annulla room_id sulle valvole che la usano
-        cursor.execute("UPDATE valves SET room_id = NULL WHERE room_id = ?", (room_id,))
-        cursor.execute("DELETE FROM rooms WHERE id = ?", (room_id,))
-        conn.commit()
-        conn.close()
+        with conn:
+            cursor = conn.cursor()
+            # annulla room_id sulle valvole che la usano
+            cursor.execute("UPDATE valves SET room_id = NULL WHERE room_id = ?", (room_id,))
+            cursor.execute("DELETE FROM rooms WHERE id = ?", (room_id,))
+            rev = _bump_config_revision(cursor)
+        self._notify("room_deleted", room_id=room_id, revision=rev)
 
     def set_valve_override(self, valve_id, heating: bool, expires_ts: float | None):
         # imposta un override manuale sulla valvola (heating boolean e timestamp di scadenza opzionale)
         conn = get_connection()
-        cursor = conn.cursor()
-
-        # assicurati che la riga della valvola esista
-        cursor.execute(
-            "INSERT OR IGNORE INTO valves (id, setpoint, last_seen) VALUES (?, ?, ?)",
-            (valve_id, 22.0, time.time()),
-        )
+        with conn:
+            cursor = conn.cursor()
 
-        cursor.execute(
-            "UPDATE valves SET override_heating = ?, override_expires = ? WHERE id = ?",
-            (1 if heating else 0, expires_ts, valve_id),
-        )
+            # assicurati che la riga della valvola esista
+            cursor.execute(
+                "INSERT OR IGNORE INTO valves (id, setpoint, last_seen) VALUES (?, ?, ?)",
+                (valve_id, 22.0, time.time()),
+            )
 
-        conn.commit()
-        conn.close()
+            cursor.execute(
+                "UPDATE valves SET override_heating = ?, override_expires = ? WHERE id = ?",
+                (1 if heating else 0, expires_ts, valve_id),
+            )
+            rev = _bump_config_revision(cursor)
+        self._notify("override_set", valve_id=valve_id, heating=bool(heating), expires=expires_ts, revision=rev)
 
     def clear_valve_override(self, valve_id):
         # rimuove l'override manuale per la valvola
         conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE valves SET override_heating = NULL, override_expires = NULL WHERE id = ?",
-            (valve_id,),
-        )
-        conn.commit()
-        conn.close()
+        with conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE valves SET override_heating = NULL, override_expires = NULL WHERE id = ?",
+                (valve_id,),
+            )
+            rev = _bump_config_revision(cursor)
+        self._notify("override_cleared", valve_id=valve_id, revision=rev)
 
     def get_valve_override(self, valve_id):
         # legge l'override se presente e lo restituisce in formato dict
@@ -261,32 +368,72 @@ class ThermostatRepository:
         cursor = conn.cursor()
         cursor.execute("SELECT override_heating, override_expires FROM valves WHERE id = ?", (valve_id,))
         row = cursor.fetchone()
-        conn.close()
         if row and row[0] is not None:
             return {"heating": bool(row[0]), "expires": row[1]}
         return None
 
-    def get_room_history(self, room_id, from_ts=None, to_ts=None, limit=50):
+    def get_room_history(self, room_id, from_ts=None, to_ts=None, limit=50, resolution="auto"):
         # restituisce lo storico delle temperature per tutte le valvole assegnate a una stanza
         conn = get_connection()
         cursor = conn.cursor()
 
-        cursor.execute(
-            """
-        SELECT t.temperature, t.timestamp
-        FROM temperature_readings t
-        JOIN valves v ON t.valve_id = v.id 
-        WHERE v.room_id = ? AND t.timestamp BETWEEN ? AND ?
-        ORDER BY t.timestamp DESC
-        LIMIT ?
-        """,
-            (room_id, from_ts, to_ts, limit),
-        )
+        bucket = rollups.resolve(cursor, "room", room_id, from_ts, to_ts, limit, resolution)
+        if bucket is not None:
+            return rollups.query(
+                cursor, "room", room_id, bucket, from_ts or 0, time.time() if to_ts is None else to_ts, limit
+            )
 
-        rows = cursor.fetchall()
-        conn.close()
+        # i filtri sul tempo sono opzionali come per lo storico della valvola
+        # (prima None produceva BETWEEN NULL AND NULL e quindi nessun risultato)
+        where = "v.room_id = ?"
+        params = [room_id]
+        if from_ts is not None:
+            where += " AND t.timestamp >= ?"
+            params.append(from_ts)
+        if to_ts is not None:
+            where += " AND t.timestamp <= ?"
+            params.append(to_ts)
+
+        rows = []
+        for name, _, _ in partitions.list(cursor, from_ts, to_ts, newest_first=True):
+            cursor.execute(
+                f"""
+            SELECT t.temperature, t.timestamp
+            FROM {name} t
+            JOIN valves v ON t.valve_id = v.id
+            WHERE {where}
+            ORDER BY t.timestamp DESC
+            LIMIT ?
+            """,
+                (*params, limit - len(rows)),
+            )
+            rows.extend(cursor.fetchall())
+            if len(rows) >= limit:
+                break
 
         history = []
         for row in rows:
             history.append({"temperature": row[0], "timestamp": row[1]})
-        return history
\ No newline at end of file
+        return history
+
+    def get_rooms_matrix(self, from_ts, to_ts, max_buckets=500, room_ids=None):
+        # matrice stanze x bucket di tempo dai rollup di stanza (vedi rollups.room_matrix);
+        # senza room_ids include tutte le stanze registrate
+        conn = get_connection()
+        cursor = conn.cursor()
+        if room_ids is None:
+            cursor.execute("SELECT id FROM rooms ORDER BY id")
+            room_ids = [r[0] for r in cursor.fetchall()]
+        return rollups.room_matrix(cursor, room_ids, from_ts, to_ts, max_buckets)
+
+    def apply_retention(self, max_age_days, archive_path=None):
+        # elimina (o archivia) le partizioni più vecchie di max_age_days giorni;
+        # i rollup a 1 minuto seguono lo storico grezzo, 15m e 1h vengono conservati
+        cutoff = time.time() - max_age_days * 86400
+        conn = get_connection()
+        with conn:
+            cursor = conn.cursor()
+            rollups.delete_before(cursor, rollups.RESOLUTIONS["1m"], cutoff)
+            if archive_path:
+                return partitions.archive_before(cursor, cutoff, archive_path)
+            return partitions.drop_before(cursor, cutoff)
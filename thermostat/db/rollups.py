@@ -0,0 +1,212 @@
+import math
+import time
+from array import array
+
+from thermostat.db.partitions import partitions
+
+# risoluzioni mantenute (secondi) e relativi nomi usati dall'API
+RESOLUTIONS = {"1m": 60, "15m": 900, "1h": 3600}
+_STEPS = sorted(RESOLUTIONS.values())
+
+_UPSERT = """
+INSERT INTO {table} (resolution, {key}, bucket, t_min, t_max, t_sum, n)
+{source}
+ON CONFLICT(resolution, {key}, bucket) DO UPDATE SET
+    t_min = MIN(t_min, excluded.t_min),
+    t_max = MAX(t_max, excluded.t_max),
+    t_sum = t_sum + excluded.t_sum,
+    n = n + excluded.n
+"""
+
+
+def create_tables(cursor):
+    # tabelle di rollup per valvola e per stanza: min/max/somma/conteggio per bucket
+    for table, key in (("rollups_valve", "valve_id"), ("rollups_room", "room_id")):
+        cursor.execute(
+            f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+            resolution INTEGER,
+            {key} TEXT,
+            bucket REAL,
+            t_min REAL,
+            t_max REAL,
+            t_sum REAL,
+            n INTEGER,
+            PRIMARY KEY (resolution, {key}, bucket)) WITHOUT ROWID
+        """
+        )
+
+
+def update(cursor, readings):
+    # aggiornamento incrementale dei rollup per un batch di letture (valve_id, temperature, timestamp)
+    agg = {}
+    for valve_id, temperature, ts in readings:
+        if temperature is None or ts is None:
+            continue
+        for res in _STEPS:
+            k = (res, valve_id, ts - ts % res)
+            a = agg.get(k)
+            if a is None:
+                agg[k] = [temperature, temperature, temperature, 1]
+            else:
+                if temperature < a[0]:
+                    a[0] = temperature
+                if temperature > a[1]:
+                    a[1] = temperature
+                a[2] += temperature
+                a[3] += 1
+    if not agg:
+        return
+    rows = [(res, vid, bucket, a[0], a[1], a[2], a[3]) for (res, vid, bucket), a in agg.items()]
+    cursor.executemany(
+        _UPSERT.format(table="rollups_valve", key="valve_id", source="VALUES (?, ?, ?, ?, ?, ?, ?)"), rows
+    )
+    # la stanza è quella assegnata alla valvola al momento della scrittura
+    cursor.executemany(
+        _UPSERT.format(
+            table="rollups_room",
+            key="room_id",
+            source="SELECT ?, room_id, ?, ?, ?, ?, ? FROM valves WHERE id = ? AND room_id IS NOT NULL",
+        ),
+        [(r[0], r[2], r[3], r[4], r[5], r[6], r[1]) for r in rows],
+    )
+
+
+def backfill(cursor):
+    # ricostruisce i rollup a partire dalle partizioni esistenti (migrazione di DB già popolati)
+    for name, _, _ in partitions.list(cursor):
+        for res in _STEPS:
+            cursor.execute(
+                _UPSERT.format(
+                    table="rollups_valve",
+                    key="valve_id",
+                    source=f"""SELECT {res}, valve_id, timestamp - timestamp % {res} AS b,
+                        MIN(temperature), MAX(temperature), SUM(temperature), COUNT(temperature)
+                        FROM {name} WHERE temperature IS NOT NULL GROUP BY valve_id, b""",
+                )
+            )
+            cursor.execute(
+                _UPSERT.format(
+                    table="rollups_room",
+                    key="room_id",
+                    source=f"""SELECT {res}, v.room_id, t.timestamp - t.timestamp % {res} AS b,
+                        MIN(t.temperature), MAX(t.temperature), SUM(t.temperature), COUNT(t.temperature)
+                        FROM {name} t JOIN valves v ON t.valve_id = v.id
+                        WHERE v.room_id IS NOT NULL AND t.temperature IS NOT NULL GROUP BY v.room_id, b""",
+                )
+            )
+
+
+def delete_before(cursor, resolution, ts):
+    # retention dei rollup di una risoluzione
+    cursor.execute("DELETE FROM rollups_valve WHERE resolution = ? AND bucket < ?", (resolution, ts))
+    cursor.execute("DELETE FROM rollups_room WHERE resolution = ? AND bucket < ?", (resolution, ts))
+
+
+def _table(kind):
+    return ("rollups_valve", "valve_id") if kind == "valve" else ("rollups_room", "room_id")
+
+
+def count_readings(cursor, kind, key, from_ts, to_ts):
+    # stima del numero di letture grezze nell'intervallo usando i rollup orari
+    table, col = _table(kind)
+    cursor.execute(
+        f"SELECT COALESCE(SUM(n), 0) FROM {table} WHERE resolution = 3600 AND {col} = ? AND bucket >= ? AND bucket <= ?",
+        (key, from_ts - from_ts % 3600, to_ts),
+    )
+    return cursor.fetchone()[0]
+
+
+def choose_bucket(from_ts, to_ts, limit):
+    # bucket più fine (quindi risoluzione più grossolana necessaria) che rientra nel budget di punti
+    span = max(to_ts - from_ts, 1)
+    for res in _STEPS:
+        if span / res <= limit:
+            return res
+    # oltre la risoluzione oraria aggreghiamo i rollup orari in bucket multipli di un'ora
+    return int(math.ceil(span / limit / 3600.0)) * 3600
+
+
+def _source(bucket):
+    # risoluzione memorizzata più grossolana da cui si può aggregare `bucket`
+    return max(r for r in _STEPS if bucket % r == 0)
+
+
+def query(cursor, kind, key, bucket, from_ts, to_ts, limit):
+    # punti aggregati (dal più recente) per valvola o stanza con bucket di `bucket` secondi
+    table, col = _table(kind)
+    source = _source(bucket)
+    cursor.execute(
+        f"""
+        SELECT bucket - bucket % ? AS b, MIN(t_min), MAX(t_max), SUM(t_sum), SUM(n)
+        FROM {table}
+        WHERE resolution = ? AND {col} = ? AND bucket >= ? AND bucket <= ?
+        GROUP BY b
+        ORDER BY b DESC
+        LIMIT ?
+        """,
+        (bucket, source, key, from_ts - from_ts % source, to_ts, limit),
+    )
+    return [
+        {"temperature": r[3] / r[4], "timestamp": r[0], "min": r[1], "max": r[2], "count": r[4]}
+        for r in cursor.fetchall()
+    ]
+
+
+def resolve(cursor, kind, key, from_ts, to_ts, limit, resolution="auto"):
+    # sceglie la sorgente: None = tabella grezza, altrimenti la dimensione del bucket in secondi
+    if resolution == "raw":
+        return None
+    if resolution in RESOLUTIONS:
+        return RESOLUTIONS[resolution]
+    if from_ts is None:
+        # senza intervallo manteniamo il comportamento storico: ultime `limit` letture grezze
+        return None
+    to_ts = time.time() if to_ts is None else to_ts
+    if count_readings(cursor, kind, key, from_ts, to_ts) <= limit:
+        return None
+    return choose_bucket(from_ts, to_ts, limit)
+
+
+def room_matrix(cursor, room_ids, from_ts, to_ts, max_buckets):
+    """Matrice stanze x bucket di tempo (media/min/max/conteggio) in una sola query.
+
+    L'aggregazione avviene in SQL sui rollup di stanza; il risultato è colonnare:
+    per ogni statistica un array piatto di len(room_ids) * buckets valori in ordine
+    stanza per stanza, con NaN (conteggio 0) dove mancano dati.
+    """
+    size = choose_bucket(from_ts, to_ts, max_buckets)
+    source = _source(size)
+    start = from_ts - from_ts % size
+    n = int((to_ts - start) // size) + 1
+    cells = len(room_ids) * n
+    nan = float("nan")
+    mean, t_min, t_max = array("d", [nan]) * cells, array("d", [nan]) * cells, array("d", [nan]) * cells
+    count = array("l", [0]) * cells
+    row_of = {room_id: i * n for i, room_id in enumerate(room_ids)}
+    if room_ids:
+        cursor.execute(
+            f"""
+            SELECT room_id, CAST((bucket - ?) / ? AS INTEGER) AS b,
+                   MIN(t_min), MAX(t_max), SUM(t_sum) / SUM(n), SUM(n)
+            FROM rollups_room
+            WHERE resolution = ? AND bucket >= ? AND bucket <= ?
+              AND room_id IN ({",".join("?" * len(room_ids))})
+            GROUP BY room_id, b
+            """,
+            (start, size, source, start, to_ts, *room_ids),
+        )
+        for room_id, b, lo, hi, avg, cnt in cursor.fetchall():
+            if 0 <= b < n:
+                idx = row_of[room_id] + b
+                mean[idx], t_min[idx], t_max[idx], count[idx] = avg, lo, hi, cnt
+    return {
+        "rooms": list(room_ids),
+        "start": start,
+        "bucket": size,
+        "buckets": n,
+        "mean": mean,
+        "min": t_min,
+        "max": t_max,
+        "count": count,
+    }
@@ -0,0 +1,258 @@
+import atexit
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# tipi di elementi accodati al writer
+_READING = 0
+_VALVE = 1
+_BARRIER = 2
+_STOP = 3
+# letture e valvole di un batch di gateway, scritte sempre nella stessa transazione
+_BATCH = 4
+
+
+class WriteBehindWriter:
+    """Coda write-behind per letture di temperatura e aggiornamenti delle valvole.
+
+    Le scritture vengono accodate dal thread chiamante (es. il thread di rete paho)
+    e un thread dedicato le scrive in un'unica transazione con `executemany`
+    ogni `batch_size` elementi oppure ogni `flush_interval` secondi.
+    La coda è limitata: quando è piena `put` blocca il produttore (backpressure)
+    oppure, se è impostato `put_timeout`, scarta l'elemento e lo conteggia.
+    Un flush fallito per un errore transitorio di sqlite (es. "database is locked")
+    viene ritentato fino a `max_retries` volte con backoff esponenziale da
+    `retry_backoff` secondi; solo dopo il batch viene scartato e conteggiato in
+    `readings_lost`/`valves_lost`.
+    """
+
+    def __init__(
+        self,
+        repository,
+        batch_size=500,
+        flush_interval=0.2,
+        max_queue=10000,
+        put_timeout=None,
+        max_retries=5,
+        retry_backoff=0.05,
+    ):
+        self.repository = repository
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._closed = False
+        self._close_lock = threading.Lock()
+        # contatori esposti da stats()
+        self._stats_lock = threading.Lock()
+        self._enqueued = 0
+        self._dropped = 0
+        self._readings_written = 0
+        self._valves_written = 0
+        self._flushes = 0
+        self._flush_errors = 0
+        self._flush_retries = 0
+        self._readings_lost = 0
+        self._valves_lost = 0
+        self._flush_time_total = 0.0
+        self._flush_time_last = 0.0
+        self._flush_time_max = 0.0
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+        # garantisce lo svuotamento della coda all'uscita dell'interprete
+        atexit.register(self.close)
+
+    def save_temperature(self, valve_id, temperature, timestamp=None):
+        # accoda una lettura di temperatura
+        ts = time.time() if timestamp is None else timestamp
+        self._put((_READING, valve_id, temperature, ts))
+
+    def save_valve(self, valve_id, setpoint, last_seen, state=None):
+        # accoda un aggiornamento della riga valves (state None = invariato)
+        self._put((_VALVE, valve_id, setpoint, last_seen, state))
+
+    def save_batch(self, readings, valves):
+        # accoda come unico elemento le letture (valve_id, temperature, timestamp) e gli
+        # aggiornamenti (valve_id, setpoint, last_seen, state) di un batch di gateway
+        self._put((_BATCH, readings, valves))
+
+    def _put(self, item):
+        # il controllo di _closed e l'accodamento avvengono sotto _close_lock: un elemento
+        # accodato dopo che il thread ha svuotato la coda allo _STOP non verrebbe mai scritto
+        with self._close_lock:
+            if self._closed:
+                enqueued = None
+            else:
+                try:
+                    self._queue.put(item, timeout=self.put_timeout)
+                    enqueued = True
+                except queue.Full:
+                    enqueued = False
+        if enqueued is None:
+            # dopo la chiusura scriviamo in modo sincrono per non perdere dati
+            self._write([item])
+        elif enqueued:
+            with self._stats_lock:
+                self._enqueued += 1
+        else:
+            with self._stats_lock:
+                self._dropped += 1
+            logger.warning("Coda write-behind piena: elemento scartato")
+
+    def flush(self, timeout=None):
+        # attende che tutto ciò che è stato accodato finora sia scritto sul DB
+        done = threading.Event()
+        with self._close_lock:
+            if self._closed:
+                return True
+            self._queue.put((_BARRIER, done))
+        return done.wait(timeout)
+
+    def close(self, timeout=10.0):
+        # svuota la coda e ferma il thread writer (idempotente)
+        with self._close_lock:
+            if self._closed:
+                return
+            # da qui in poi _put scrive in modo sincrono, il thread svuota la coda
+            self._closed = True
+            self._queue.put((_STOP,))
+            self._thread.join(timeout)
+        try:
+            atexit.unregister(self.close)
+        except Exception:
+            pass
+
+    def stats(self):
+        # contatori per monitorare profondità della coda e latenza dei flush
+        with self._stats_lock:
+            flushes = self._flushes
+            return {
+                "queue_depth": self._queue.qsize(),
+                "enqueued": self._enqueued,
+                "dropped": self._dropped,
+                "readings_written": self._readings_written,
+                "valves_written": self._valves_written,
+                "flushes": flushes,
+                "flush_errors": self._flush_errors,
+                "flush_retries": self._flush_retries,
+                "readings_lost": self._readings_lost,
+                "valves_lost": self._valves_lost,
+                "flush_ms_last": self._flush_time_last * 1000.0,
+                "flush_ms_max": self._flush_time_max * 1000.0,
+                "flush_ms_avg": (self._flush_time_total / flushes * 1000.0) if flushes else 0.0,
+            }
+
+    def _run(self):
+        # ciclo del thread writer: raccoglie un batch e lo scrive
+        stop = False
+        while not stop:
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = []
+            barriers = []
+            deadline = time.monotonic() + self.flush_interval
+            item = first
+            while True:
+                kind = item[0]
+                if kind == _STOP:
+                    stop = True
+                elif kind == _BARRIER:
+                    barriers.append(item[1])
+                else:
+                    batch.append(item)
+                if stop or len(batch) >= self.batch_size:
+                    break
+                remaining = deadline - time.monotonic()
+                try:
+                    if barriers or remaining <= 0:
+                        # c'è qualcuno in attesa o il tempo è scaduto: prendi solo ciò che è già in coda
+                        item = self._queue.get_nowait()
+                    else:
+                        item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if stop:
+                # allo stop svuotiamo tutto ciò che resta in coda
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item[0] == _BARRIER:
+                        barriers.append(item[1])
+                    elif item[0] != _STOP:
+                        batch.append(item)
+            if batch:
+                self._write(batch)
+            for ev in barriers:
+                ev.set()
+
+    def _write(self, batch):
+        # scrive un batch in un'unica transazione
+        readings = []
+        valves = {}
+        for item in batch:
+            kind = item[0]
+            if kind == _READING:
+                readings.append((item[1], item[2], item[3]))
+            elif kind == _BATCH:
+                readings.extend(item[1])
+                for row in item[2]:
+                    valves[row[0]] = row
+            else:
+                _, vid, setpoint, last_seen, state = item
+                prev = valves.get(vid)
+                if state is None and prev is not None:
+                    # manteniamo l'ultimo stato noto dello stesso batch
+                    state = prev[3]
+                valves[vid] = (vid, setpoint, last_seen, state)
+        rows = list(valves.values())
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            try:
+                self.repository.write_batch(readings, rows)
+                break
+            except sqlite3.OperationalError as exc:
+                # errori transitori (DB bloccato da un altro processo, I/O): ritentiamo con
+                # backoff; la transazione fallita è già stata annullata per intero
+                if attempt >= self.max_retries:
+                    self._lose(readings, rows, f"{exc} dopo {attempt} tentativi")
+                    return
+                delay = self.retry_backoff * (2 ** attempt)
+                attempt += 1
+                logger.warning("Flush write-behind fallito (%s), nuovo tentativo %d tra %.2f s", exc, attempt, delay)
+                with self._stats_lock:
+                    self._flush_retries += 1
+                time.sleep(delay)
+            except Exception as exc:
+                # errore non transitorio (es. dati non validi): ritentare non servirebbe
+                self._lose(readings, rows, exc)
+                return
+        elapsed = time.perf_counter() - start
+        with self._stats_lock:
+            self._flushes += 1
+            self._readings_written += len(readings)
+            self._valves_written += len(valves)
+            self._flush_time_last = elapsed
+            self._flush_time_total += elapsed
+            if elapsed > self._flush_time_max:
+                self._flush_time_max = elapsed
+
+    def _lose(self, readings, rows, reason):
+        # batch definitivamente non scritto: lo segnaliamo e lo conteggiamo
+        logger.error(
+            "Flush write-behind scartato: %d letture e %d valvole perse (%s)", len(readings), len(rows), reason
+        )
+        with self._stats_lock:
+            self._flush_errors += 1
+            self._readings_lost += len(readings)
+            self._valves_lost += len(rows)
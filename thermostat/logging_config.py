@@ -1,25 +1,166 @@
-import os
+import atexit
+import json
+import logging
 import logging.handlers
+import os
+import queue
+import sys
+import time
 from logging.config import dictConfig
 
+# listener della modalità "queue" attivo (uno per processo)
+_listener = None
+
+
+class ReadingSampler:
+    """Limita le righe per singola lettura: al più una ogni `interval` secondi per valvola.
+
+    La decisione viene presa prima di chiamare il logger (vedi `log_reading`), così
+    per le righe scartate non viene nemmeno creato il LogRecord. I cambi di stato
+    passano sempre; con interval 0 passano tutte le righe.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.suppressed = 0
+        # valve_id -> istante dell'ultima riga scritta
+        self._last = {}
+
+    def allow(self, key, state_changed=False):
+        if self.interval <= 0:
+            return True
+        now = time.monotonic()
+        if not state_changed:
+            last = self._last.get(key)
+            if last is not None and now - last < self.interval:
+                self.suppressed += 1
+                return False
+        self._last[key] = now
+        return True
+
+
+# campionatore del processo (senza setup_logging passano tutte le righe)
+_sampler = ReadingSampler(0)
+
+
+def log_reading(valve_id, state_changed=False):
+    # True se la riga per lettura di questa valvola va scritta
+    return _sampler.allow(valve_id, state_changed)
+
+
+class JsonFormatter(logging.Formatter):
+    """Una riga JSON compatta per record (campi extra come valve_id inclusi)."""
+
+    # attributi standard di LogRecord da non ripetere come campi extra
+    _RESERVED = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+    def format(self, record):
+        data = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in self._RESERVED and not key.startswith("_"):
+                data[key] = value
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, separators=(",", ":"), default=str)
+
 
-def setup_logging():
+class LocalQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler per una coda nello stesso processo.
+
+    A differenza di QueueHandler non formatta il messaggio sul thread chiamante
+    (lo fa il thread del listener) e, se la coda è piena, scarta il record
+    contandolo invece di bloccare il percorso caldo.
+    """
+
+    def __init__(self, queue_):
+        super().__init__(queue_)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # coda in-process: il record (args inclusi) può passare così com'è
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _handlers_config(fmt, log_file, stream):
+    handlers = {"console": {"class": "logging.StreamHandler", "formatter": fmt}}
+    if stream is not None:
+        handlers["console"]["stream"] = stream
+    if log_file:
+        handlers["file"] = {
+            "class": "logging.handlers.RotatingFileHandler",
+            "filename": log_file,
+            "maxBytes": 10000000,
+            "backupCount": 3,
+            "formatter": fmt,
+        }
+    return handlers
+
+
+def stop_logging():
+    # ferma il listener della modalità queue scrivendo i record ancora in coda (idempotente)
+    global _listener
+    listener, _listener = _listener, None
+    if listener is None:
+        return
+    listener.stop()
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, LocalQueueHandler) and handler.dropped:
+            sys.stderr.write(f"logging: {handler.dropped} record scartati (coda piena)\n")
+
+
+def setup_logging(mode=None, fmt=None, readings_interval=None, log_file="thermostat.log", stream=None, queue_size=10000):
+    """Configura il logging del processo.
+
+    mode "sync" (default, LOG_MODE) usa gli handler direttamente sul thread
+    chiamante, come in precedenza; con "queue" i logger scrivono su una coda e un
+    thread QueueListener esegue formattazione, scrittura su file e rotazione.
+    fmt "text" o "json" (LOG_FORMAT). readings_interval (LOG_READINGS_INTERVAL,
+    default 0: tutte le righe) limita le righe per lettura di ogni valvola a una
+    ogni N secondi.
+    """
+    global _listener, _sampler
+    stop_logging()
     level = os.getenv("LOG_LEVEL", "INFO").upper()
+    mode = mode or os.getenv("LOG_MODE", "sync")
+    fmt = fmt or os.getenv("LOG_FORMAT", "text")
+    if readings_interval is None:
+        readings_interval = float(os.getenv("LOG_READINGS_INTERVAL", "0"))
+    handlers = _handlers_config(fmt, log_file, stream)
     dictConfig({
         "version": 1,
         "disable_existing_loggers": False,
         "formatters": {
-            "default": {"format": "%(asctime)s %(levelname)s %(name)s %(message)s"},
-        },
-        "handlers": {
-            "console": {"class": "logging.StreamHandler", "formatter": "default"},
-            "file": {
-                "class": "logging.handlers.RotatingFileHandler",
-                "filename": "thermostat.log",
-                "maxBytes": 10000000,
-                "backupCount": 3,
-                "formatter": "default",
-            },
+            "text": {"format": "%(asctime)s %(levelname)s %(name)s %(message)s"},
+            "json": {"()": JsonFormatter},
         },
-        "root": {"level": level, "handlers": ["console", "file"]},
+        "handlers": handlers,
+        "root": {"level": level, "handlers": list(handlers)},
     })
+    _sampler = ReadingSampler(readings_interval)
+
+    if mode == "queue":
+        root = logging.getLogger()
+        targets = list(root.handlers)
+        log_queue = queue.Queue(maxsize=queue_size)
+        for handler in targets:
+            root.removeHandler(handler)
+        root.addHandler(LocalQueueHandler(log_queue))
+        _listener = logging.handlers.QueueListener(log_queue, *targets, respect_handler_level=True)
+        _listener.start()
+    elif mode != "sync":
+        raise ValueError(f"LOG_MODE non valido: {mode}")
+    return _sampler
+
+
+atexit.register(stop_logging)
@@ -1,15 +1,87 @@
+import argparse
+import asyncio
+
+from thermostat.core.rooms import AGGREGATIONS
 from thermostat.logging_config import setup_logging
 from thermostat.mqtt.client import MQTTClient
 from thermostat.db.database import init_db
 
-# Configura il logging (console / file) secondo la configurazione del progetto
-setup_logging()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Controller del termostato smart")
+    # thread: tutto sul thread di rete paho (comportamento originale)
+    # asyncio: messaggi smistati su code per valvola ed elaborati in parallelo
+    parser.add_argument("--runtime", choices=("thread", "asyncio"), default="thread")
+    parser.add_argument("--shards", type=int, default=8, help="code/worker del runtime asyncio")
+    parser.add_argument("--db-workers", type=int, default=None, help="thread dell'executor (default = shards)")
+    # >1: un supervisore avvia N processi worker, ognuno con uno slice (consistent hash) delle valvole
+    parser.add_argument("--workers", type=int, default=1, help="processi controller (modalità cluster)")
+    parser.add_argument("--retention-days", type=float, default=None, help="elimina lo storico più vecchio di N giorni")
+    # listener HTTP con /metrics (formato Prometheus) e /stats/...; in modalità cluster il worker i usa la porta + i
+    parser.add_argument("--metrics-port", type=int, default=None, help="porta del listener /metrics e /stats del controller")
+    # controllo di stanza: temperatura aggregata delle valvole e una decisione per stanza per tick
+    parser.add_argument("--room-aggregation", choices=AGGREGATIONS, default="mean", help="temperatura di stanza")
+    parser.add_argument("--room-tick", type=float, default=1.0, help="secondi tra due decisioni della stessa stanza")
+    return parser.parse_args()
+
+
+def run_cluster(args):
+    # modalità multi-processo: il supervisore pubblica la membership e riavvia i worker morti
+    import paho.mqtt.client as mqtt
+    from thermostat.mqtt.client import BROKER, PORT
+    from thermostat.mqtt.cluster import ProcessWorker, Supervisor
+
+    client = mqtt.Client()
+    client.connect(BROKER, PORT, 60)
+    client.loop_start()
+    def spawn(wid):
+        index = int(wid.rsplit("-", 1)[1])
+        port = args.metrics_port + index if args.metrics_port else None
+        return ProcessWorker(
+            wid, runtime=args.runtime, shards=args.shards, metrics_port=port,
+            room_aggregation=args.room_aggregation, room_tick=args.room_tick, db_workers=args.db_workers,
+            # la retention agisce sul DB condiviso: solo il worker 0 (riavviato con lo stesso id)
+            retention_days=args.retention_days if index == 0 else None,
+        )
+
+    supervisor = Supervisor(args.workers, client, spawn)
+    try:
+        supervisor.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.loop_stop()
 
 
 if __name__ == "__main__":
+    # Configura il logging (console / file) secondo la configurazione del progetto; qui e
+    # non a livello di modulo perché i worker del cluster (spawn) reimportano questo modulo
+    setup_logging()
+    args = parse_args()
     # Inizializza il DB (crea tabelle / applica migrazioni semplici)
     init_db()
+    if args.workers > 1:
+        run_cluster(args)
+        raise SystemExit(0)
     # crea e avvia il client MQTT che a sua volta inizializza il controller
     mqtt_client = MQTTClient()
-    # avvia il loop MQTT in modalità bloccante
-    mqtt_client.start()
\ No newline at end of file
+    mqtt_client.controller.configure_rooms(args.room_aggregation, args.room_tick)
+    if args.retention_days:
+        mqtt_client.controller.start_retention(args.retention_days)
+    if args.metrics_port:
+        from thermostat.metrics import start_http_server
+
+        # /metrics e le statistiche mobili del controller (/stats/...)
+        start_http_server(args.metrics_port).routes.update(mqtt_client.controller.http_routes())
+    try:
+        if args.runtime == "asyncio":
+            from thermostat.mqtt.async_runtime import AsyncRuntime
+
+            runtime = AsyncRuntime(mqtt_client, shards=args.shards, db_workers=args.db_workers)
+            asyncio.run(runtime.run())
+        else:
+            # avvia il loop MQTT in modalità bloccante
+            mqtt_client.start()
+    finally:
+        # svuota la coda write-behind prima di uscire
+        mqtt_client.controller.stop()
@@ -0,0 +1,308 @@
+"""Metriche del processo (counter, gauge, histogram) nel formato testuale di Prometheus.
+
+Implementazione minima senza dipendenze: ogni metrica ha un lock proprio e tiene
+un valore per combinazione di label. Counter e gauge possono essere calcolati al
+momento dello scrape con `set_function` (es. valvole per stato, contatori del
+writer), senza costi sul percorso caldo. Le metriche senza campioni non vengono
+esposte, così lo stesso registro può essere concatenato con quello di un altro
+processo (l'API aggiunge quelle del controller) senza righe duplicate.
+
+Esposizione: `/metrics` dell'API oppure `start_http_server(port)` nel controller.
+"""
+import bisect
+import http.server
+import logging
+import math
+import os
+import threading
+import time
+import urllib.parse
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# bucket (secondi) per le fasi del percorso caldo: da pochi microsecondi a un secondo
+STAGE_BUCKETS = (
+    0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.1, 1.0,
+)
+# bucket (secondi) per le richieste HTTP
+REQUEST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self._lock = threading.Lock()
+        self._function = None
+
+    def set_function(self, fn):
+        # valori calcolati allo scrape: fn() -> {tuple label: valore} (o un numero senza label)
+        self._function = fn
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = self._samples()
+        if not lines:
+            return ""
+        header = f"# HELP {self.name} {self.help}\n# TYPE {self.name} {self.type}\n"
+        return header + "\n".join(lines) + "\n"
+
+
+class _Value(_Metric):
+    # counter e gauge: un numero per combinazione di label
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._values = {}
+
+    def _current(self):
+        if self._function is not None:
+            values = self._function()
+            if not isinstance(values, dict):
+                values = {(): values}
+            return values
+        with self._lock:
+            return dict(self._values)
+
+    def _samples(self):
+        return [
+            f"{self.name}{_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(self._current().items())
+        ]
+
+    def value(self, *labels):
+        return self._current().get(tuple(labels), 0)
+
+
+class Counter(_Value):
+    type = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Value):
+    type = "gauge"
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class StageTimer:
+    """Misura fasi consecutive: `mark(stage)` registra il tempo dall'ultimo mark."""
+
+    __slots__ = ("_histogram", "_last")
+
+    def __init__(self, histogram):
+        self._histogram = histogram
+        self._last = time.perf_counter()
+
+    def mark(self, *labels):
+        now = time.perf_counter()
+        self._histogram.observe(now - self._last, *labels)
+        self._last = now
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def mark(self, *labels):
+        pass
+
+
+# timer che non registra nulla (metriche disattivate o fasi non misurate)
+NULL_TIMER = _NullTimer()
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=STAGE_BUCKETS, registry=None):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._registry = registry
+        # tuple label -> [conteggi per bucket (non cumulativi, ultimo = +Inf), somma, totale]
+        self._data = {}
+
+    def observe(self, value, *labels):
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            data = self._data.get(labels)
+            if data is None:
+                data = self._data[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            data[0][idx] += 1
+            data[1] += value
+            data[2] += 1
+
+    def timer(self):
+        # timer per fasi consecutive (no-op se le metriche sono disabilitate)
+        if self._registry is not None and not self._registry.enabled:
+            return NULL_TIMER
+        return StageTimer(self)
+
+    def snapshot(self, *labels):
+        # (conteggi per bucket, somma, totale) per una combinazione di label
+        with self._lock:
+            data = self._data.get(labels)
+            return (list(data[0]), data[1], data[2]) if data else None
+
+    def _samples(self):
+        with self._lock:
+            items = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self._data.items())
+        lines = []
+        bounds = self.buckets + (math.inf,)
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(bounds, counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, ('le', _format_value(bound)))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    """Insieme delle metriche di un processo."""
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                    raise ValueError(f"metrica {metric.name} già registrata con tipo o label diversi")
+                # stessa definizione (es. modulo importato due volte): riusiamo la metrica esistente
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help, labels=()):
+        return self._register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self._register(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=STAGE_BUCKETS):
+        return self._register(Histogram(name, help, labels, buckets, registry=self))
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self):
+        # esposizione testuale di tutte le metriche con almeno un campione
+        with self._lock:
+            metrics = list(self._metrics.values())
+        parts = []
+        for metric in metrics:
+            try:
+                parts.append(metric.render())
+            except Exception:
+                logger.exception("Errore nel calcolo della metrica %s", metric.name)
+        return "".join(parts)
+
+
+# registro del processo; THERMOSTAT_METRICS=0 disabilita i timer delle fasi
+REGISTRY = Registry(enabled=os.getenv("THERMOSTAT_METRICS", "1") != "0")
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        # le rotte con parametro ("/prefisso/") non rispondono al prefisso da solo
+        route = None if path.endswith("/") else self.server.routes.get(path)
+        args = ()
+        if route is None and not path.endswith("/"):
+            # rotta con parametro: "/prefisso/segmento" -> fn(segmento)
+            prefix, _, tail = path.rpartition("/")
+            route = self.server.routes.get(prefix + "/")
+            args = (urllib.parse.unquote(tail),)
+        if route is None:
+            self.send_error(404)
+            return
+        try:
+            content_type, body = route(*args)
+        except LookupError:
+            self.send_error(404)
+            return
+        except Exception:
+            logger.exception("Errore nella rotta %s", self.path)
+            self.send_error(500)
+            return
+        if isinstance(body, str):
+            body = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("metrics http: " + format, *args)
+
+
+class MetricsServer(http.server.ThreadingHTTPServer):
+    """Listener HTTP minimale su un thread daemon; `routes` mappa path -> fn() -> (content type, body).
+
+    Un path che termina con "/" è una rotta con parametro: fn(segmento) per "/path/segmento";
+    un LookupError della rotta diventa 404.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, port, host="0.0.0.0", registry=REGISTRY):
+        super().__init__((host, port), _Handler)
+        self.routes = {"/metrics": lambda: (CONTENT_TYPE, registry.render())}
+        self._thread = threading.Thread(target=self.serve_forever, name="metrics-http", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        logger.info("Metriche esposte su http://%s:%s/metrics", *self.server_address[:2])
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def start_http_server(port, host="0.0.0.0", registry=REGISTRY):
+    # avvia il listener del controller e lo ritorna (per aggiungere rotte o fermarlo)
+    return MetricsServer(port, host, registry).start()
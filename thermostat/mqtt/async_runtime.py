@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import signal
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from thermostat.mqtt.client import BROKER, PORT
+
+logger = logging.getLogger(__name__)
+
+
+def shard_key(topic):
+    # chiave di sharding: l'id della valvola per i topic noti, altrimenti il topic
+    parts = topic.split("/")
+    if len(parts) == 4 and parts[0] == "home":
+        if parts[1] == "valves":
+            return parts[2]
+        if parts[1] == "thermostat":
+            return parts[3]
+    return topic
+
+
+class AsyncRuntime:
+    """Runtime asyncio per il controller.
+
+    Il thread di rete paho non elabora più i messaggi: li passa al loop asyncio che
+    li smista su `shards` code in base all'id della valvola. Ogni coda è servita da
+    un solo worker, quindi i messaggi della stessa valvola restano ordinati mentre
+    valvole diverse procedono in parallelo. Il lavoro bloccante (controller + DB)
+    gira su un executor limitato. Il numero di messaggi in volo è limitato da
+    `max_pending`: oltre quel limite il thread paho si blocca (backpressure).
+    """
+
+    def __init__(self, mqtt_client, shards=8, db_workers=None, max_pending=10000, report_interval=30.0):
+        self.mqtt = mqtt_client
+        self.shards = shards
+        self.report_interval = report_interval
+        self.executor = ThreadPoolExecutor(max_workers=db_workers or shards, thread_name_prefix="dispatch")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._loop = None
+        self._queues = []
+        self._stopping = None
+        # il wrapper continua a gestire on_connect, noi intercettiamo solo i messaggi
+        self.mqtt.client.on_message = self._on_message
+
+    def _on_message(self, client, userdata, msg):
+        # thread di rete paho: solo passaggio al loop asyncio
+        self._slots.acquire()
+        idx = zlib.crc32(shard_key(msg.topic).encode()) % self.shards
+        self._loop.call_soon_threadsafe(self._queues[idx].put_nowait, (msg.topic, msg.payload))
+
+    async def _worker(self, queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            topic, payload = await queue.get()
+            try:
+                await loop.run_in_executor(self.executor, self.mqtt.dispatch, topic, payload)
+            finally:
+                self._slots.release()
+                queue.task_done()
+
+    def pending(self):
+        # messaggi in coda sugli shard (non ancora elaborati)
+        return sum(q.qsize() for q in self._queues)
+
+    async def _report(self):
+        # log periodico dei percentili di latenza pubblicazione -> comando
+        while True:
+            await asyncio.sleep(self.report_interval)
+            pct = self.mqtt.latency.percentiles()
+            if pct:
+                logger.info(
+                    "[Runtime] latency ms p50=%.1f p90=%.1f p99=%.1f p99.9=%.1f | pending=%d",
+                    pct[50], pct[90], pct[99], pct[99.9], self.pending(),
+                )
+            logger.info("[Runtime] commands %s", self.mqtt.controller.command_stats())
+
+    async def run(self, connect=True):
+        # avvia worker e rete; ritorna quando viene chiamato stop()
+        self._loop = asyncio.get_running_loop()
+        self._queues = [asyncio.Queue() for _ in range(self.shards)]
+        self._stopping = asyncio.Event()
+        tasks = [asyncio.create_task(self._worker(q)) for q in self._queues]
+        tasks.append(asyncio.create_task(self._report()))
+        try:
+            self._loop.add_signal_handler(signal.SIGINT, self._stopping.set)
+            self._loop.add_signal_handler(signal.SIGTERM, self._stopping.set)
+        except (NotImplementedError, RuntimeError):
+            # piattaforme senza signal handler nel loop (es. Windows)
+            pass
+        if connect:
+            self.mqtt.client.connect(BROKER, PORT, 60)
+            # il loop di rete paho gira nel proprio thread
+            self.mqtt.client.loop_start()
+        try:
+            await self._stopping.wait()
+        finally:
+            if connect:
+                self.mqtt.client.loop_stop()
+            # svuotiamo le code prima di fermare i worker
+            for q in self._queues:
+                await q.join()
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.executor.shutdown(wait=True)
+
+    def stop(self):
+        # richiede l'arresto (thread-safe)
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stopping.set)
@@ -1,7 +1,13 @@
 import paho.mqtt.client as mqtt
 import json
 import logging
-from thermostat.core.controller import ThermostatController
+import threading
+import time
+from thermostat.core.controller import ThermostatController, STAGE_SECONDS
+from thermostat.core.latency import LatencyRecorder
+from thermostat.mqtt.cluster import MEMBERS_TOPIC, SHARED_BATCH_TOPIC, forward_topic, valve_topic
+from thermostat.mqtt import codec
+from thermostat import metrics
 
 # Parametri del broker (config hardcoded per sviluppo locale)
 BROKER = "localhost"
@@ -9,64 +15,259 @@ PORT = 1883
 
 logger = logging.getLogger(__name__)
 
+MESSAGES = metrics.REGISTRY.counter(
+    "thermostat_messages_total", "Messaggi MQTT ricevuti dal controller per tipo ed esito", ("kind", "outcome")
+)
+
 
 class MQTTClient:
     """Wrapper semplice intorno a paho mqtt che collega i messaggi al controller."""
 
-    def __init__(self):
-        # istanza del client paho
-        self.client = mqtt.Client()
+    def __init__(self, client=None, shard=None):
+        # istanza del client paho (iniettabile, es. per benchmark)
+        self.client = client if client is not None else mqtt.Client()
+        # appartenenza al cluster (ShardMembership) se il controller gestisce solo uno slice delle valvole
+        self.shard = shard
         # assegniamo callback
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
         # creiamo il controller che userà lo stesso client per pubblicare
         self.controller = ThermostatController(self.client)
+        # latenza pubblicazione temperatura -> comando (se il payload contiene "ts")
+        self.latency = LatencyRecorder()
+        # cluster: valvole note (DB e annunci) e quelle con la sottoscrizione esatta attiva
+        self._known = None
+        self._subscribed = set()
+        self._sub_lock = threading.Lock()
+        if self.shard is not None:
+            # un cambio di assegnazione sposta la valvola su un altro worker
+            self.controller.state.add_listener(self._on_state_event)
 
     def on_connect(self, client, userdata, flags, rc):
         # callback eseguita quando il client si connette al broker
         logger.info("Connected with result code %s", rc)
         # sottoscriviamo i topic usati dal progetto
-        client.subscribe("home/valves/+/temperature")
+        # annunci retained delle valvole (codec supportati)
+        client.subscribe("home/valves/+/announce")
         client.subscribe("home/thermostat/setpoint/+")
+        # target delle stanze (id separati da quelli delle valvole)
+        client.subscribe("home/thermostat/room_setpoint/+")
+        if self.shard is None:
+            client.subscribe("home/valves/+/temperature")
+            # batch di letture dei gateway
+            client.subscribe("home/gateways/+/batch")
+        else:
+            # cluster: telemetria solo delle valvole possedute (vedi _sync_subscriptions),
+            # batch a un solo worker e letture inoltrate dagli altri worker
+            client.subscribe(SHARED_BATCH_TOPIC)
+            client.subscribe(forward_topic(self.shard.worker_id, "+"))
+            with self._sub_lock:
+                # dopo una riconnessione il broker non ha più le sottoscrizioni esatte
+                self._subscribed = set()
+            self._sync_subscriptions()
+            # membership retained pubblicata dal supervisore
+            client.subscribe(MEMBERS_TOPIC)
 
     def on_message(self, client, userdata, msg):
         # callback per la ricezione dei messaggi: instrada verso il controller
+        self.dispatch(msg.topic, msg.payload)
+
+    def dispatch(self, topic, raw_payload):
+        # elabora un messaggio (topic, payload bytes); usato inline dal loop paho
+        # oppure dai worker del runtime asyncio
+        kind = "other"
         try:
-            topic_parts = msg.topic.split("/")
+            if topic == MEMBERS_TOPIC:
+                self._on_members(raw_payload)
+                return
+
+            topic_parts = topic.split("/")
 
             # Caso 1: messaggio di temperatura dalle valvole
             if topic_parts[0] == "home" and topic_parts[1] == "valves":
-                # formato atteso: home/valves/{id}/temperature
+                # formato atteso: home/valves/{id}/temperature oppure home/valves/{id}/announce
+                kind = "temperature"
                 if len(topic_parts) != 4:
-                    logger.warning("Topic temperatura non valido: %s", msg.topic)
+                    logger.warning("Topic temperatura non valido: %s", topic)
+                    MESSAGES.inc(kind, "invalid")
                     return
                 valve_id = topic_parts[2]
-                payload = json.loads(msg.payload.decode())
-                # il simulatore invia nel campo "value" la temperatura
-                temperature = payload.get("value")
+                if topic_parts[3] == "announce":
+                    # tenuto da tutti i worker del cluster: il proprietario può cambiare
+                    kind = "announce"
+                    self._on_announce(valve_id, raw_payload)
+                    MESSAGES.inc(kind, "ok")
+                    return
+                if self.shard is not None and not self.owns(valve_id):
+                    # valvola gestita da un altro worker del cluster
+                    MESSAGES.inc("temperature", "foreign")
+                    return
+                timer = STAGE_SECONDS.timer()
+                # JSON o binario, riconosciuto dal primo byte
+                temperature, sent_ts = codec.decode_temperature(raw_payload)
+                timer.mark("parse")
 
                 # inoltra al controller
                 self.controller.handle_temperature(valve_id, temperature)
+                MESSAGES.inc("temperature", "ok")
+
+                # il simulatore include "ts" (istante di pubblicazione): misuriamo la latenza
+                if sent_ts is not None:
+                    self.latency.record(time.time() - sent_ts)
+
+            # Caso 2b: letture di un batch inoltrate da un altro worker (home/cluster/{worker}/batch/{gw})
+            if topic_parts[0] == "home" and topic_parts[1] == "cluster":
+                kind = "batch"
+                if len(topic_parts) != 5 or topic_parts[3] != "batch":
+                    logger.warning("Topic di inoltro non valido: %s", topic)
+                    MESSAGES.inc(kind, "invalid")
+                    return
+                self._on_batch(topic_parts[4], raw_payload, forwarded=True)
+                MESSAGES.inc(kind, "ok")
+                return
+
+            # Caso 2: batch di letture da un gateway (home/gateways/{gw}/batch)
+            if topic_parts[0] == "home" and topic_parts[1] == "gateways":
+                kind = "batch"
+                if len(topic_parts) != 4 or topic_parts[3] != "batch":
+                    logger.warning("Topic batch non valido: %s", topic)
+                    MESSAGES.inc(kind, "invalid")
+                    return
+                self._on_batch(topic_parts[2], raw_payload)
+                MESSAGES.inc(kind, "ok")
+                return
 
-            # Caso 2: setpoint pubblicato (es. dalla dashboard)
+            # Caso 3: setpoint pubblicato (es. dalla dashboard)
             if topic_parts[0] == "home" and topic_parts[1] == "thermostat":
-                # formato atteso: home/thermostat/setpoint/{id}
-                if len(topic_parts) != 4:
-                    logger.warning("Topic setpoint non valido: %s", msg.topic)
+                # formato atteso: home/thermostat/setpoint/{valve_id} oppure
+                # home/thermostat/room_setpoint/{room_id}
+                kind = "setpoint"
+                if len(topic_parts) != 4 or topic_parts[2] not in ("setpoint", "room_setpoint"):
+                    logger.warning("Topic setpoint non valido: %s", topic)
+                    MESSAGES.inc(kind, "invalid")
                     return
 
-                valve_id = topic_parts[3]
-                payload = json.loads(msg.payload.decode())
+                target_id = topic_parts[3]
+                room = topic_parts[2] == "room_setpoint"
+                # nel cluster la stanza è la chiave di partizione delle sue valvole
+                if self.shard is not None and not (self.shard.owns(target_id) if room else self.owns(target_id)):
+                    MESSAGES.inc(kind, "foreign")
+                    return
+                payload = json.loads(raw_payload.decode())
                 new_setpoint = payload.get("setpoint")
 
-                # aggiorna il setpoint nel controller
-                self.controller.update_setpoint(valve_id, new_setpoint)
+                # aggiorna il setpoint della valvola o il target della stanza nel controller
+                if room:
+                    self.controller.update_room_target(target_id, new_setpoint)
+                else:
+                    self.controller.update_setpoint(target_id, new_setpoint)
+                MESSAGES.inc(kind, "ok")
                 return
 
         except Exception:
             # log di eventuali errori senza fermare il client
+            MESSAGES.inc(kind, "error")
             logger.exception("Errore nella gestione del messaggio")
 
+    def _on_batch(self, gateway_id, raw_payload, forwarded=False):
+        timer = STAGE_SECONDS.timer()
+        batch_codec = codec.detect(raw_payload)
+        entries = batch_codec.decode_batch(raw_payload)
+        timer.mark("batch_parse")
+        if self.shard is not None:
+            # nel cluster ogni worker elabora solo le proprie valvole del batch
+            entries = self._route_batch(gateway_id, entries, batch_codec, forwarded)
+        if not entries:
+            return
+        self.controller.handle_batch(gateway_id, [(vid, value) for vid, value, _ in entries], batch_codec)
+        # latenza misurata come per le singole letture, con il ts di ciascuna
+        now = time.time()
+        for _, _, sent_ts in entries:
+            if sent_ts is not None:
+                self.latency.record(now - sent_ts)
+
+    def _on_announce(self, valve_id, raw_payload):
+        # annuncio vuoto (retained cancellato) o senza "codecs": comandi in JSON
+        data = json.loads(raw_payload) if raw_payload else {}
+        self.controller.set_valve_codec(valve_id, codec.negotiate(data.get("codecs")))
+        # peso della valvola nella temperatura di stanza "weighted" (es. potenza del radiatore)
+        self.controller.room_engine.set_weight(valve_id, data.get("weight"))
+        if self.shard is not None and raw_payload:
+            # nel cluster una valvola nuova diventa nota con il suo annuncio
+            with self._sub_lock:
+                new = self._known is not None and valve_id not in self._known
+                if new:
+                    self._known.add(valve_id)
+            if new:
+                self._sync_subscriptions()
+
+    def _route_batch(self, gateway_id, entries, batch_codec, forwarded):
+        # batch ricevuto tramite la sottoscrizione condivisa: teniamo le nostre letture e
+        # inoltriamo le altre ai proprietari, un messaggio per worker; le letture già
+        # inoltrate non vengono reinoltrate (durante un ribilanciamento vengono scartate)
+        own = []
+        foreign = {}
+        rooms = self.controller.state.valve_rooms
+        for entry in entries:
+            owner = self.shard.ring.owner(rooms.get(entry[0], entry[0]))
+            if owner == self.shard.worker_id:
+                own.append(entry)
+            elif owner is not None and not forwarded:
+                foreign.setdefault(owner, []).append(entry)
+        for owner, part in foreign.items():
+            self.client.publish(forward_topic(owner, gateway_id), batch_codec.encode_batch(part))
+        if forwarded and len(own) < len(entries):
+            MESSAGES.inc("batch", "foreign")
+        return own
+
+    def owns(self, valve_id):
+        # la valvola appartiene a questo worker? (chiave = stanza se assegnata, altrimenti id)
+        key = self.controller.state.valve_rooms.get(valve_id, valve_id)
+        return self.shard.owns(key)
+
+    def _sync_subscriptions(self):
+        # cluster: sottoscrizioni esatte alla telemetria delle sole valvole possedute
+        with self._sub_lock:
+            if self._known is None:
+                # valvole registrate sul DB; le nuove si aggiungono con l'annuncio
+                self._known = {v["id"] for v in self.controller.repository.get_valves()}
+            candidates = self._known | set(self.controller.state.valve_rooms)
+            desired = {vid for vid in candidates if self.owns(vid)}
+            added = sorted(desired - self._subscribed)
+            removed = sorted(self._subscribed - desired)
+            self._subscribed = desired
+        for i in range(0, len(added), 500):
+            self.client.subscribe([(valve_topic(vid), 0) for vid in added[i:i + 500]])
+        for i in range(0, len(removed), 500):
+            self.client.unsubscribe([valve_topic(vid) for vid in removed[i:i + 500]])
+        if added or removed:
+            logger.info(
+                "[Cluster] worker %s: %d valvole sottoscritte (+%d -%d)",
+                self.shard.worker_id, len(desired), len(added), len(removed),
+            )
+
+    def _on_state_event(self, event, data):
+        # assegnazioni cambiate: la chiave di partizione (stanza) delle valvole può cambiare
+        if event in ("valve_assigned", "valve_deleted"):
+            with self._sub_lock:
+                if self._known is not None and event == "valve_assigned":
+                    self._known.add(data["valve_id"])
+                elif self._known is not None:
+                    self._known.discard(data["valve_id"])
+        if event in ("valve_assigned", "valve_deleted", "room_deleted", "reloaded"):
+            self._sync_subscriptions()
+
+    def _on_members(self, raw_payload):
+        # nuova membership del cluster: aggiorna il ring e rilascia le valvole cedute
+        if self.shard is None or not raw_payload:
+            return
+        data = json.loads(raw_payload.decode())
+        if self.shard.update(data.get("members", []), data.get("epoch", 0)):
+            released = self.controller.release_valves(self.owns)
+            if released:
+                logger.info("[Cluster] %d valvole cedute ad altri worker", released)
+            self._sync_subscriptions()
+
     def start(self):
         # connessione e loop bloccante
         self.client.connect(BROKER, PORT, 60)
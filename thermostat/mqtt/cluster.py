@@ -0,0 +1,236 @@
+import bisect
+import hashlib
+import json
+import logging
+import multiprocessing
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# topic retained con l'elenco dei worker attivi, pubblicato dal supervisore
+MEMBERS_TOPIC = "home/cluster/members"
+# batch dei gateway: ogni batch arriva a un solo worker del gruppo condiviso
+SHARED_BATCH_TOPIC = "$share/thermostat/home/gateways/+/batch"
+
+
+def valve_topic(valve_id):
+    # topic della telemetria di una valvola (sottoscrizione esatta del worker proprietario)
+    return f"home/valves/{valve_id}/temperature"
+
+
+def forward_topic(worker_id, gateway_id):
+    # letture di un batch inoltrate al worker proprietario (gateway_id "+" per sottoscrivere)
+    return f"home/cluster/{worker_id}/batch/{gateway_id}"
+
+
+def _hash(key):
+    # hash stabile tra processi (hash() di Python è randomizzato per processo)
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hashing con nodi virtuali: aggiungere o togliere un worker
+    sposta solo ~1/N delle chiavi."""
+
+    def __init__(self, members=(), vnodes=64):
+        self.members = sorted(members)
+        self._points = []
+        self._owners = []
+        for member in self.members:
+            for i in range(vnodes):
+                self._points.append((_hash(f"{member}#{i}"), member))
+        self._points.sort()
+        self._owners = [m for _, m in self._points]
+        self._points = [p for p, _ in self._points]
+
+    def owner(self, key):
+        # worker proprietario della chiave (None se il ring è vuoto)
+        if not self._points:
+            return None
+        idx = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[idx]
+
+
+class ShardMembership:
+    """Vista di un worker sul ring corrente.
+
+    Il partizionamento avviene sul broker: ogni worker sottoscrive in modo esatto
+    il topic della telemetria di ciascuna valvola che possiede (valvole registrate
+    sul DB o annunciate) e riallinea le sottoscrizioni a ogni cambio di membership
+    o di assegnazione, quindi ogni lettura arriva a un solo worker. Le
+    sottoscrizioni condivise MQTT v5 non garantirebbero che la stessa valvola
+    finisca sempre allo stesso worker (l'ordine per valvola verrebbe perso); le
+    usiamo solo per i batch dei gateway, che contengono valvole di più worker: il
+    worker che riceve il batch tiene le proprie letture e inoltra le altre ai
+    proprietari su `forward_topic`.
+
+    La chiave di partizione è la stanza della valvola (se assegnata), così tutte le
+    valvole di una stanza sono gestite dallo stesso worker e le decisioni a livello
+    di stanza restano coerenti; le valvole senza stanza sono partizionate per id.
+    """
+
+    def __init__(self, worker_id, members=()):
+        self.worker_id = worker_id
+        self.epoch = -1
+        self.ring = HashRing(members)
+
+    def update(self, members, epoch):
+        # applica un nuovo elenco di membri; False se l'aggiornamento è vecchio
+        if epoch <= self.epoch:
+            return False
+        self.epoch = epoch
+        self.ring = HashRing(members)
+        logger.info("[Cluster] worker %s: ring epoch %s membri %s", self.worker_id, epoch, self.ring.members)
+        return True
+
+    def owns(self, key):
+        return self.ring.owner(key) == self.worker_id
+
+
+def run_worker(
+    worker_id, runtime="thread", shards=8, metrics_port=None, room_aggregation="mean", room_tick=1.0,
+    db_workers=None, retention_days=None,
+):
+    # entrypoint dei processi worker avviati dal supervisore; retention_days va passato
+    # a un solo worker, la retention agisce sul DB condiviso
+    from thermostat.logging_config import setup_logging
+    from thermostat.mqtt.client import MQTTClient
+
+    # un file per worker: la rotazione di un file condiviso da più processi perde righe
+    setup_logging(log_file=f"thermostat-{worker_id}.log")
+    client = MQTTClient(shard=ShardMembership(worker_id))
+    client.controller.configure_rooms(room_aggregation, room_tick)
+    if retention_days:
+        client.controller.start_retention(retention_days)
+    if metrics_port:
+        from thermostat.metrics import start_http_server
+
+        start_http_server(metrics_port).routes.update(client.controller.http_routes())
+    try:
+        if runtime == "asyncio":
+            import asyncio
+            from thermostat.mqtt.async_runtime import AsyncRuntime
+
+            asyncio.run(AsyncRuntime(client, shards=shards, db_workers=db_workers).run())
+        else:
+            client.start()
+    finally:
+        client.controller.stop()
+
+
+class ProcessWorker:
+    # worker in un processo separato (modalità di produzione)
+    def __init__(
+        self, worker_id, runtime="thread", shards=8, metrics_port=None, room_aggregation="mean", room_tick=1.0,
+        db_workers=None, retention_days=None,
+    ):
+        ctx = multiprocessing.get_context("spawn")
+        self.worker_id = worker_id
+        self.process = ctx.Process(
+            target=run_worker,
+            args=(worker_id, runtime, shards, metrics_port, room_aggregation, room_tick, db_workers, retention_days),
+            name=worker_id, daemon=True,
+        )
+        self.process.start()
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def terminate(self):
+        self.process.terminate()
+        self.process.join(5)
+
+
+class ThreadWorker:
+    # worker in un thread collegato a un LocalBroker (test e benchmark senza broker reale)
+    def __init__(self, worker_id, broker):
+        from thermostat.mqtt.client import MQTTClient
+        from thermostat.mqtt.localbroker import LocalClient
+
+        self.worker_id = worker_id
+        self.client = MQTTClient(client=LocalClient(broker, client_id=worker_id), shard=ShardMembership(worker_id))
+        self.client.client.connect()
+        self.thread = threading.Thread(target=self.client.client.loop_forever, name=worker_id, daemon=True)
+        self.thread.start()
+
+    def is_alive(self):
+        return self.thread.is_alive()
+
+    def terminate(self):
+        self.client.client.disconnect()
+        self.thread.join(5)
+        self.client.controller.stop()
+
+
+class Supervisor:
+    """Avvia N worker, pubblica la membership (retained) e ribilancia quando un worker muore.
+
+    Alla morte di un worker il suo slice viene subito redistribuito tra i
+    sopravvissuti (nuova epoch senza di lui); dopo `restart_delay` secondi il
+    worker viene riavviato e reinserito nel ring.
+    """
+
+    def __init__(self, n_workers, client, spawn, check_interval=1.0, restart_delay=2.0):
+        self.worker_ids = [f"worker-{i}" for i in range(n_workers)]
+        # client MQTT usato solo per pubblicare la membership
+        self.client = client
+        # spawn(worker_id) -> oggetto con is_alive()/terminate()
+        self.spawn = spawn
+        self.check_interval = check_interval
+        self.restart_delay = restart_delay
+        self.workers = {}
+        self.members = []
+        self.epoch = 0
+        # worker_id -> istante del riavvio programmato
+        self._restarts = {}
+        self._stop = threading.Event()
+
+    def publish_members(self):
+        self.epoch += 1
+        payload = {"members": self.members, "epoch": self.epoch}
+        self.client.publish(MEMBERS_TOPIC, json.dumps(payload), retain=True)
+        logger.info("[Supervisor] membership epoch %s: %s", self.epoch, self.members)
+
+    def start(self):
+        for wid in self.worker_ids:
+            self.workers[wid] = self.spawn(wid)
+        self.members = list(self.worker_ids)
+        self.publish_members()
+
+    def check(self):
+        # un passo di monitoraggio: rileva worker morti e riavvia quelli programmati
+        changed = False
+        now = time.monotonic()
+        for wid, worker in list(self.workers.items()):
+            if wid in self._restarts or worker.is_alive():
+                continue
+            logger.warning("[Supervisor] worker %s terminato: ribilanciamento", wid)
+            self.members = [m for m in self.members if m != wid]
+            self._restarts[wid] = now + self.restart_delay
+            changed = True
+        for wid, due in list(self._restarts.items()):
+            if due <= now:
+                del self._restarts[wid]
+                self.workers[wid] = self.spawn(wid)
+                self.members = sorted(self.members + [wid])
+                changed = True
+        if changed:
+            self.publish_members()
+
+    def run_forever(self):
+        self.start()
+        try:
+            while not self._stop.wait(self.check_interval):
+                self.check()
+        finally:
+            self.shutdown()
+
+    def stop(self):
+        self._stop.set()
+
+    def shutdown(self):
+        for worker in self.workers.values():
+            worker.terminate()
+        # rimuove la membership retained
+        self.client.publish(MEMBERS_TOPIC, b"", retain=True)
@@ -0,0 +1,199 @@
+"""Codec dei payload di telemetria (temperature) e comandi delle valvole.
+
+Due codec:
+
+- `json` (storico): `{"value": 21.5, "ts": 1700000000.0}` e `{"heating": true}`;
+- `bin1`: layout fisso con `struct`, primo byte = versione del formato (0x01).
+  Temperatura: versione, centesimi di grado int16 (-32768 = assente), ts float64
+  (NaN = assente), 11 byte. Comando: versione e flag (bit 0 = heating), 2 byte.
+
+Batch dei gateway (`home/gateways/{gw}/batch`) e comandi raggruppati
+(`home/gateways/{gw}/commands`): in JSON `{"readings": [[id, value, ts], ...]}` e
+`{"commands": [[id, heating], ...]}`; in bin1 versione e numero di elementi
+(uint16), poi per elemento la lunghezza dell'id (uint8), l'id UTF-8 e gli stessi
+campi della temperatura (int16 + float64) o del comando (flag uint8).
+
+Il decoder riconosce il formato dal primo byte (un oggetto JSON inizia con `{`,
+il binario con il byte di versione), quindi il controller accetta entrambi da
+qualsiasi valvola. Per i comandi la scelta è negoziata per valvola: la valvola
+elenca i codec supportati nel campo `codecs` dell'annuncio retained
+`home/valves/{id}/announce`, il controller sceglie il suo preferito tra quelli
+offerti (JSON se l'annuncio manca) e la valvola pubblica la telemetria nel codec
+dei comandi che riceve. Valvole e controller che non conoscono il binario restano su JSON.
+"""
+import json
+import math
+import struct
+
+BIN1_VERSION = 0x01
+_MISSING_CENTI = -32768
+
+
+class JsonCodec:
+    name = "json"
+
+    def encode_temperature(self, value, ts=None):
+        data = {"value": value}
+        if ts is not None:
+            data["ts"] = ts
+        return json.dumps(data).encode()
+
+    def decode_temperature(self, payload):
+        # (valore, ts) con None per i campi assenti
+        data = json.loads(payload)
+        return data.get("value"), data.get("ts")
+
+    def encode_command(self, heating):
+        return json.dumps({"heating": heating}).encode()
+
+    def decode_command(self, payload):
+        return json.loads(payload).get("heating")
+
+    def encode_batch(self, readings):
+        # readings: sequenza di (valve_id, valore, ts o None)
+        return json.dumps({"readings": [[vid, value, ts] for vid, value, ts in readings]}).encode()
+
+    def decode_batch(self, payload):
+        return [(r[0], r[1], r[2] if len(r) > 2 else None) for r in json.loads(payload)["readings"]]
+
+    def encode_commands(self, commands):
+        # commands: sequenza di (valve_id, heating)
+        return json.dumps({"commands": [[vid, heating] for vid, heating in commands]}).encode()
+
+    def decode_commands(self, payload):
+        return [(c[0], bool(c[1])) for c in json.loads(payload)["commands"]]
+
+
+class StructCodec:
+    name = "bin1"
+    _temperature = struct.Struct("<Bhd")
+    _command = struct.Struct("<BB")
+    _header = struct.Struct("<BH")
+    _reading = struct.Struct("<hd")
+
+    def encode_temperature(self, value, ts=None):
+        centi = _MISSING_CENTI if value is None else int(round(value * 100))
+        return self._temperature.pack(BIN1_VERSION, centi, math.nan if ts is None else ts)
+
+    def decode_temperature(self, payload):
+        try:
+            _, centi, ts = self._temperature.unpack(payload)
+        except struct.error as exc:
+            raise ValueError(f"payload bin1 non valido: {exc}") from None
+        return (None if centi == _MISSING_CENTI else centi / 100.0), (None if ts != ts else ts)
+
+    def encode_command(self, heating):
+        return self._command.pack(BIN1_VERSION, 1 if heating else 0)
+
+    def decode_command(self, payload):
+        try:
+            _, flags = self._command.unpack(payload)
+        except struct.error as exc:
+            raise ValueError(f"payload bin1 non valido: {exc}") from None
+        return bool(flags & 1)
+
+    def encode_batch(self, readings):
+        parts = [self._header.pack(BIN1_VERSION, len(readings))]
+        for vid, value, ts in readings:
+            parts.append(_pack_id(vid))
+            centi = _MISSING_CENTI if value is None else int(round(value * 100))
+            parts.append(self._reading.pack(centi, math.nan if ts is None else ts))
+        return b"".join(parts)
+
+    def decode_batch(self, payload):
+        out = []
+        try:
+            _, count = self._header.unpack_from(payload)
+            pos = self._header.size
+            for _ in range(count):
+                vid, pos = _unpack_id(payload, pos)
+                centi, ts = self._reading.unpack_from(payload, pos)
+                pos += self._reading.size
+                out.append((vid, None if centi == _MISSING_CENTI else centi / 100.0, None if ts != ts else ts))
+        except (struct.error, IndexError, UnicodeDecodeError) as exc:
+            raise ValueError(f"batch bin1 non valido: {exc}") from None
+        return out
+
+    def encode_commands(self, commands):
+        parts = [self._header.pack(BIN1_VERSION, len(commands))]
+        for vid, heating in commands:
+            parts.append(_pack_id(vid))
+            parts.append(b"\x01" if heating else b"\x00")
+        return b"".join(parts)
+
+    def decode_commands(self, payload):
+        out = []
+        try:
+            _, count = self._header.unpack_from(payload)
+            pos = self._header.size
+            for _ in range(count):
+                vid, pos = _unpack_id(payload, pos)
+                out.append((vid, bool(payload[pos] & 1)))
+                pos += 1
+        except (struct.error, IndexError, UnicodeDecodeError) as exc:
+            raise ValueError(f"comandi bin1 non validi: {exc}") from None
+        return out
+
+
+def _pack_id(valve_id):
+    # id della valvola con prefisso di lunghezza (uint8)
+    raw = valve_id.encode()
+    if len(raw) > 255:
+        raise ValueError(f"id valvola troppo lungo per bin1: {valve_id!r}")
+    return bytes((len(raw),)) + raw
+
+
+def _unpack_id(payload, pos):
+    size = payload[pos]
+    end = pos + 1 + size
+    if end > len(payload):
+        raise IndexError("id troncato")
+    return bytes(payload[pos + 1:end]).decode(), end
+
+
+JSON = JsonCodec()
+BIN1 = StructCodec()
+CODECS = {JSON.name: JSON, BIN1.name: BIN1}
+# ordine di preferenza del controller
+PREFERENCE = (BIN1.name, JSON.name)
+_BY_VERSION = {BIN1_VERSION: BIN1}
+
+
+def detect(payload):
+    # codec di un payload (bytes); ValueError se il formato non è riconosciuto
+    if not payload:
+        raise ValueError("payload vuoto")
+    first = payload[0]
+    if first == 0x7B:  # "{"
+        return JSON
+    codec = _BY_VERSION.get(first)
+    if codec is not None:
+        return codec
+    if payload.lstrip()[:1] == b"{":
+        return JSON
+    raise ValueError(f"formato di payload sconosciuto (primo byte 0x{first:02x})")
+
+
+def decode_temperature(payload):
+    return detect(payload).decode_temperature(payload)
+
+
+def decode_command(payload):
+    return detect(payload).decode_command(payload)
+
+
+def decode_batch(payload):
+    return detect(payload).decode_batch(payload)
+
+
+def decode_commands(payload):
+    return detect(payload).decode_commands(payload)
+
+
+def negotiate(offered):
+    # codec da usare verso una valvola che dichiara `offered` (lista di nomi o None)
+    if offered:
+        for name in PREFERENCE:
+            if name in offered:
+                return CODECS[name]
+    return JSON
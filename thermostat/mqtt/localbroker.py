@@ -0,0 +1,226 @@
+import itertools
+import queue
+import threading
+
+
+def topic_matches(topic_filter, topic):
+    # confronto topic/filtro MQTT con wildcard '+' (un livello) e '#' (resto del topic)
+    fparts = topic_filter.split("/")
+    tparts = topic.split("/")
+    for i, f in enumerate(fparts):
+        if f == "#":
+            return True
+        if i >= len(tparts):
+            return False
+        if f != "+" and f != tparts[i]:
+            return False
+    return len(fparts) == len(tparts)
+
+
+class LocalMessage:
+    # equivalente minimo di paho MQTTMessage
+    __slots__ = ("topic", "payload", "qos", "retain")
+
+    def __init__(self, topic, payload, qos=0, retain=False):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+
+
+class _PublishInfo:
+    # equivalente minimo di paho MQTTMessageInfo
+    rc = 0
+
+    def wait_for_publish(self, timeout=None):
+        return None
+
+    def is_published(self):
+        return True
+
+
+def _to_bytes(payload):
+    # stessa conversione del payload fatta da paho
+    if payload is None:
+        return b""
+    if isinstance(payload, (bytes, bytearray)):
+        return bytes(payload)
+    if isinstance(payload, str):
+        return payload.encode()
+    return str(payload).encode()
+
+
+class LocalBroker:
+    """Broker MQTT in-process per test e benchmark (nessuna rete).
+
+    Supporta wildcard, messaggi retained e sottoscrizioni condivise MQTT v5
+    (`$share/{gruppo}/{filtro}`, consegna round-robin a un membro del gruppo).
+    I filtri senza wildcard sono indicizzati per topic, così migliaia di
+    sottoscrizioni esatte (una per valvola nel cluster) non rallentano `publish`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (client, filtro, gruppo|None) con wildcard o condivisi
+        self._subs = []
+        # topic -> client con sottoscrizione esatta (senza wildcard, non condivisa)
+        self._exact = {}
+        self._retained = {}
+        self._rr = itertools.count()
+        # numero totale di messaggi pubblicati (per le statistiche dei benchmark)
+        self.published = 0
+
+    def subscribe(self, client, topic_filter):
+        group = None
+        if topic_filter.startswith("$share/"):
+            _, group, topic_filter = topic_filter.split("/", 2)
+        with self._lock:
+            if group is None and "+" not in topic_filter and "#" not in topic_filter:
+                clients = self._exact.setdefault(topic_filter, [])
+                if client not in clients:
+                    clients.append(client)
+                retained = [(topic_filter, self._retained[topic_filter])] if topic_filter in self._retained else []
+            else:
+                if (client, topic_filter, group) not in self._subs:
+                    self._subs.append((client, topic_filter, group))
+                retained = [] if group else [
+                    (t, p) for t, p in self._retained.items() if topic_matches(topic_filter, t)
+                ]
+        for t, p in retained:
+            client._deliver(LocalMessage(t, p, retain=True))
+
+    def unsubscribe(self, client, topic_filter):
+        group = None
+        if topic_filter.startswith("$share/"):
+            _, group, topic_filter = topic_filter.split("/", 2)
+        with self._lock:
+            clients = self._exact.get(topic_filter)
+            if group is None and clients is not None and client in clients:
+                clients.remove(client)
+                if not clients:
+                    del self._exact[topic_filter]
+            self._subs = [s for s in self._subs if s != (client, topic_filter, group)]
+
+    def disconnect(self, client):
+        with self._lock:
+            self._subs = [s for s in self._subs if s[0] is not client]
+            for topic in [t for t, clients in self._exact.items() if client in clients]:
+                self._exact[topic].remove(client)
+                if not self._exact[topic]:
+                    del self._exact[topic]
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        payload = _to_bytes(payload)
+        with self._lock:
+            self.published += 1
+            if retain:
+                if payload:
+                    self._retained[topic] = payload
+                else:
+                    # payload vuoto retained = cancellazione del retained
+                    self._retained.pop(topic, None)
+            targets = list(self._exact.get(topic, ()))
+            groups = {}
+            for client, topic_filter, group in self._subs:
+                if not topic_matches(topic_filter, topic):
+                    continue
+                if group is None:
+                    if client not in targets:
+                        targets.append(client)
+                else:
+                    groups.setdefault((group, topic_filter), []).append(client)
+            for members in groups.values():
+                chosen = members[next(self._rr) % len(members)]
+                if chosen not in targets:
+                    targets.append(chosen)
+        for client in targets:
+            client._deliver(LocalMessage(topic, payload, qos))
+        return len(targets)
+
+
+class LocalClient:
+    """Client con la stessa interfaccia (minima) di paho.mqtt.client.Client collegato a un LocalBroker.
+
+    I messaggi vengono consegnati su un thread dedicato (`loop_start`) o sul thread
+    chiamante (`loop_forever`), come fa paho con il proprio loop di rete.
+    """
+
+    def __init__(self, broker, client_id="", userdata=None):
+        self.broker = broker
+        self.client_id = client_id
+        self._userdata = userdata
+        self.on_connect = None
+        self.on_message = None
+        self.on_disconnect = None
+        self._inbox = queue.Queue()
+        self._thread = None
+        self._connected = False
+        self._stop_loop = False
+
+    def user_data_set(self, userdata):
+        self._userdata = userdata
+
+    def connect(self, host=None, port=None, keepalive=60):
+        self._connected = True
+        # on_connect viene eseguita dal loop, come in paho
+        self._inbox.put(("connect", None))
+        return 0
+
+    def disconnect(self):
+        if not self._connected:
+            return 0
+        self._connected = False
+        self.broker.disconnect(self)
+        self._inbox.put(("disconnect", None))
+        return 0
+
+    def subscribe(self, topic, qos=0):
+        # come paho: un filtro oppure una lista di (filtro, qos)
+        for topic_filter in [topic] if isinstance(topic, str) else [t for t, _ in topic]:
+            self.broker.subscribe(self, topic_filter)
+        return 0, 0
+
+    def unsubscribe(self, topic):
+        # come paho: un filtro oppure una lista di filtri
+        for topic_filter in [topic] if isinstance(topic, str) else topic:
+            self.broker.unsubscribe(self, topic_filter)
+        return 0, 0
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.broker.publish(topic, payload, qos, retain)
+        return _PublishInfo()
+
+    def _deliver(self, msg):
+        self._inbox.put(("message", msg))
+
+    def _process(self, block=True):
+        # elabora un evento della inbox; False quando il client è disconnesso
+        try:
+            kind, msg = self._inbox.get(block=block, timeout=0.1 if block else None)
+        except queue.Empty:
+            return self._connected
+        if kind == "connect" and self.on_connect:
+            self.on_connect(self, self._userdata, {}, 0)
+        elif kind == "message" and self.on_message:
+            self.on_message(self, self._userdata, msg)
+        elif kind == "disconnect":
+            if self.on_disconnect:
+                self.on_disconnect(self, self._userdata, 0)
+            return False
+        return True
+
+    def loop_forever(self):
+        while not self._stop_loop and self._process():
+            pass
+
+    def loop_start(self):
+        if self._thread is None:
+            self._stop_loop = False
+            self._thread = threading.Thread(target=self.loop_forever, name=f"local-mqtt-{self.client_id}", daemon=True)
+            self._thread.start()
+
+    def loop_stop(self):
+        if self._thread is not None:
+            self._stop_loop = True
+            self._thread.join()
+            self._thread = None
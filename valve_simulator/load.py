@@ -0,0 +1,340 @@
+"""Simulatore ad alto carico: molte valvole virtuali su poche connessioni MQTT.
+
+Ogni processo gestisce un blocco di valvole suddiviso tra `--connections` client;
+ogni client ha un thread che pubblica secondo una schedulazione a tick (non una
+sleep per valvola): la valvola i del blocco riporta ogni `--interval` secondi con
+fase i / n, quindi a ogni tick si pubblica un intervallo contiguo di valvole e il
+modello termico viene aggiornato su quell'intervallo in un solo passo (NumPy se
+disponibile, altrimenti array della libreria standard). Se il thread resta
+indietro recupera pubblicando intervalli più ampi, senza deriva della frequenza.
+
+Il tempo di ritorno dei comandi (pubblicazione temperatura -> comando ricevuto
+per la stessa valvola) viene registrato da un subscriber per processo.
+
+Con `--announce` ogni valvola dichiara i codec di `--codecs`; la telemetria di
+una valvola passa al codec dei comandi che riceve (vedi thermostat.mqtt.codec).
+
+Con `--batch N` ogni connessione si comporta da gateway `{prefix}gw{c}`: le
+letture in scadenza vengono raccolte ogni `--batch-interval` secondi e pubblicate
+in messaggi da al più N letture su `home/gateways/{gw}/batch` (nel primo codec di
+`--codecs`); i comandi tornano raggruppati su `home/gateways/{gw}/commands`.
+
+Esecuzione:
+    python -m valve_simulator.load --valves 100000 --interval 10 --connections 4 --processes 4 --duration 60
+    python -m valve_simulator.load --valves 100000 --interval 10 --batch 200 --batch-interval 0.1
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import random
+import threading
+import time
+from array import array
+
+import paho.mqtt.client as mqtt
+
+from thermostat.core.latency import LatencyRecorder
+from thermostat.mqtt import codec
+
+try:
+    import numpy as np
+except ImportError:  # NumPy è opzionale: senza, il modello usa array e un ciclo Python
+    np = None
+
+logger = logging.getLogger(__name__)
+
+BROKER = "localhost"
+PORT = 1883
+
+
+class ThermalModel:
+    """Modello termico di n valvole su array colonnari (stesso modello di valve.py)."""
+
+    def __init__(self, n, seed=None):
+        self.n = n
+        self._random = random.Random(seed)
+        if np is not None:
+            self._rng = np.random.default_rng(seed)
+            self.temp = self._rng.uniform(18.0, 22.0, n)
+            self.heating = np.zeros(n, dtype=bool)
+        else:
+            self.temp = array("d", (self._random.uniform(18.0, 22.0) for _ in range(n)))
+            self.heating = bytearray(n)
+
+    def set_heating(self, idx, heating):
+        self.heating[idx] = bool(heating)
+
+    def step(self, lo, hi):
+        # un passo del modello per le valvole [lo, hi); ritorna le nuove temperature
+        if np is not None:
+            size = hi - lo
+            up = self._rng.uniform(0.05, 0.25, size)
+            down = self._rng.uniform(0.01, 0.15, size)
+            t = self.temp[lo:hi] + np.where(self.heating[lo:hi], up, -down)
+            np.clip(t, 5.0, 35.0, out=t)
+            self.temp[lo:hi] = t
+            return t.round(2).tolist()
+        temp, heating, uniform = self.temp, self.heating, self._random.uniform
+        out = []
+        for i in range(lo, hi):
+            if heating[i]:
+                t = temp[i] + uniform(0.05, 0.25)
+            else:
+                t = temp[i] - uniform(0.01, 0.15)
+            t = round(max(5.0, min(35.0, t)), 2)
+            temp[i] = t
+            out.append(t)
+        return out
+
+
+class LoadSimulator:
+    """Valvole virtuali `{prefix}{i}` per i in [0, n) su `connections` client MQTT.
+
+    `client_factory(client_id)` crea i client (default paho verso BROKER:PORT,
+    iniettabile ad esempio con un LocalBroker per i benchmark). Con `batch_size` > 0
+    ogni connessione pubblica batch da gateway invece di un messaggio per lettura.
+    """
+
+    def __init__(self, n_valves, interval=10.0, connections=4, tick=0.01, prefix="sim", client_factory=None, seed=None,
+                 codecs=codec.PREFERENCE, batch_size=0, batch_interval=0.1):
+        self.n = n_valves
+        self.interval = interval
+        self.tick = tick
+        self.prefix = prefix
+        self.ids = [f"{prefix}{i}" for i in range(n_valves)]
+        self._index = {vid: i for i, vid in enumerate(self.ids)}
+        self.model = ThermalModel(n_valves, seed)
+        # istante dell'ultima pubblicazione per valvola (per il tempo di ritorno dei comandi)
+        self.last_publish = array("d", bytes(8 * n_valves))
+        # codec annunciati e, per valvola, telemetria binaria (1) o JSON (0)
+        self.codecs = list(codecs)
+        self.binary = bytearray(n_valves)
+        # modalità gateway: letture per messaggio, attesa tra due invii e codec dei batch
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.batch_codec = next((codec.CODECS[name] for name in self.codecs if name in codec.CODECS), codec.JSON)
+        self.batches = 0
+        self.command_rtt = LatencyRecorder(size=100000)
+        self.commands = 0
+        self.published = 0
+        # ritardo massimo accumulato rispetto alla schedulazione (secondi)
+        self.max_lag = 0.0
+        self._factory = client_factory or self._paho_client
+        self._stop = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+        # blocchi contigui di valvole, uno per connessione
+        connections = max(1, min(connections, n_valves))
+        bounds = [n_valves * c // connections for c in range(connections + 1)]
+        self.blocks = list(zip(bounds[:-1], bounds[1:]))
+        self.clients = [self._factory(f"{prefix}-pub{c}") for c in range(connections)]
+        # un solo client riceve i comandi (sottoscrizione wildcard) per non duplicarli
+        self.clients[0].on_message = self._on_command
+        self.clients[0].on_connect = self._on_connect
+
+    @staticmethod
+    def _paho_client(client_id):
+        client = mqtt.Client(client_id=client_id)
+        client.connect(BROKER, PORT, 60)
+        return client
+
+    def _on_connect(self, client, userdata, flags, rc):
+        client.subscribe("home/valves/+/command")
+        if self.batch_size:
+            client.subscribe("home/gateways/+/commands")
+
+    def _on_command(self, client, userdata, msg):
+        parts = msg.topic.split("/")
+        if len(parts) == 4 and parts[1] == "gateways":
+            self._on_gateway_commands(msg.payload)
+            return
+        idx = self._index.get(parts[2]) if len(parts) == 4 else None
+        if idx is None:
+            return
+        try:
+            command_codec = codec.detect(msg.payload)
+            heating = command_codec.decode_command(msg.payload)
+        except ValueError:
+            return
+        self.model.set_heating(idx, heating)
+        self.binary[idx] = command_codec is codec.BIN1
+        sent = self.last_publish[idx]
+        if sent:
+            self.command_rtt.record(time.time() - sent)
+        self.commands += 1
+
+    def _on_gateway_commands(self, payload):
+        # comandi raggruppati per le valvole di un gateway
+        try:
+            commands = codec.decode_commands(payload)
+        except (ValueError, KeyError, TypeError):
+            return
+        now = time.time()
+        for vid, heating in commands:
+            idx = self._index.get(vid)
+            if idx is None:
+                continue
+            self.model.set_heating(idx, heating)
+            sent = self.last_publish[idx]
+            if sent:
+                self.command_rtt.record(now - sent)
+            self.commands += 1
+
+    def announce(self):
+        # annuncio retained per ogni valvola, come valve.py (opzionale: con molte valvole
+        # lascia sul broker un messaggio retained per ciascuna)
+        for c, (lo, hi) in enumerate(self.blocks):
+            for i in range(lo, hi):
+                ann = {"id": self.ids[i], "ts": time.time(), "proto": "sim-load", "codecs": self.codecs}
+                self.clients[c].publish(f"home/valves/{self.ids[i]}/announce", json.dumps(ann), retain=True)
+
+    def _publish_loop(self, client, lo, hi, gateway=None):
+        n = hi - lo
+        if n == 0:
+            return
+        batch_topic = f"home/gateways/{gateway}/batch"
+        encode_batch = self.batch_codec.encode_batch
+        batch_size = self.batch_size
+        # in modalità gateway l'attesa minima tra due giri è l'intervallo dei batch
+        min_wait = self.batch_interval if batch_size else self.tick
+        ids = self.ids
+        last_publish = self.last_publish
+        binary = self.binary
+        pack = codec.BIN1.encode_temperature
+        # posizione nel ciclo: le valvole [lo, lo + done) hanno già pubblicato in questo giro
+        start = time.monotonic()
+        cycle = 0
+        done = 0
+        while not self._stop.is_set():
+            now = time.monotonic()
+            elapsed = now - start - cycle * self.interval
+            # valvole che secondo la schedulazione dovrebbero aver pubblicato in questo giro
+            due = min(n, int(elapsed / self.interval * n) + 1)
+            if due > done:
+                a, b = lo + done, lo + due
+                temps = self.model.step(a, b)
+                ts = time.time()
+                sent_batches = 0
+                if batch_size:
+                    for c in range(a, b, batch_size):
+                        end = min(b, c + batch_size)
+                        client.publish(batch_topic, encode_batch(
+                            [(ids[i], t, ts) for i, t in zip(range(c, end), temps[c - a:end - a])]
+                        ))
+                        sent_batches += 1
+                    last_publish[a:b] = array("d", [ts]) * (b - a)
+                else:
+                    for i, t in zip(range(a, b), temps):
+                        if binary[i]:
+                            payload = pack(t, ts)
+                        else:
+                            payload = f'{{"value": {t}, "ts": {ts:.6f}}}'
+                        client.publish(f"home/valves/{ids[i]}/temperature", payload)
+                        last_publish[i] = ts
+                with self._lock:
+                    self.published += b - a
+                    self.batches += sent_batches
+                done = due
+                lag = elapsed - (due - 1) * self.interval / n
+                if lag > self.max_lag:
+                    self.max_lag = lag
+            if done >= n:
+                cycle += 1
+                done = 0
+                continue
+            # prossima scadenza: valvola lo + done
+            next_due = start + cycle * self.interval + done * self.interval / n
+            self._stop.wait(max(min_wait, next_due - time.monotonic()))
+
+    def start(self, announce=False):
+        for client in self.clients:
+            client.loop_start()
+        if announce:
+            self.announce()
+        for c, (client, (lo, hi)) in enumerate(zip(self.clients, self.blocks)):
+            gateway = f"{self.prefix}gw{c}" if self.batch_size else None
+            t = threading.Thread(
+                target=self._publish_loop, args=(client, lo, hi, gateway), name=f"{self.prefix}-pub", daemon=True
+            )
+            t.start()
+            self._threads.append(t)
+
+    def stop(self):
+        self._stop.set()
+        for t in self._threads:
+            t.join(5)
+        for client in self.clients:
+            client.loop_stop()
+            client.disconnect()
+
+    def stats(self):
+        return {
+            "valves": self.n,
+            "published": self.published,
+            "batches": self.batches,
+            "commands": self.commands,
+            "max_lag_ms": self.max_lag * 1000.0,
+            "command_rtt_ms": self.command_rtt.percentiles(),
+            "rtt_samples": self.command_rtt.samples(),
+        }
+
+
+def _run_process(index, n_valves, args, results):
+    # entrypoint dei processi figli: ogni processo ha il proprio prefisso di id
+    sim = LoadSimulator(
+        n_valves, args.interval, args.connections, prefix=f"{args.prefix}{index}-", seed=index,
+        codecs=args.codecs.split(","), batch_size=args.batch, batch_interval=args.batch_interval,
+    )
+    sim.start(announce=args.announce)
+    time.sleep(args.duration)
+    sim.stop()
+    results.put(sim.stats())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--valves", type=int, default=10000, help="valvole virtuali totali")
+    parser.add_argument("--interval", type=float, default=10.0, help="secondi tra due letture della stessa valvola")
+    parser.add_argument("--connections", type=int, default=4, help="connessioni MQTT per processo")
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--duration", type=float, default=60.0)
+    parser.add_argument("--prefix", default="sim")
+    parser.add_argument("--announce", action="store_true", help="pubblica l'annuncio retained di ogni valvola")
+    parser.add_argument("--codecs", default=",".join(codec.PREFERENCE), help="codec dichiarati nell'annuncio")
+    parser.add_argument("--batch", type=int, default=0, help="letture per batch di gateway (0 = un messaggio per lettura)")
+    parser.add_argument("--batch-interval", type=float, default=0.1, help="secondi tra due invii di batch")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    per_process = [args.valves * (p + 1) // args.processes - args.valves * p // args.processes for p in range(args.processes)]
+    procs = [ctx.Process(target=_run_process, args=(p, n, args, results)) for p, n in enumerate(per_process)]
+    for p in procs:
+        p.start()
+    stats = [results.get() for _ in procs]
+    for p in procs:
+        p.join()
+
+    published = sum(s["published"] for s in stats)
+    rtt = LatencyRecorder(size=10 ** 7)
+    for s in stats:
+        for sample in s["rtt_samples"]:
+            rtt.record(sample)
+    pct = rtt.percentiles()
+    print(
+        f"valves={args.valves} processes={args.processes} connections={args.connections * args.processes} "
+        f"interval={args.interval}s duration={args.duration}s"
+    )
+    print(f"published={published} ({published / args.duration:.0f} letture/s, target {args.valves / args.interval:.0f})")
+    if args.batch:
+        print(f"batches={sum(s['batches'] for s in stats)}")
+    print(f"max schedule lag: {max(s['max_lag_ms'] for s in stats):.1f} ms")
+    print(f"commands={sum(s['commands'] for s in stats)}")
+    if pct:
+        print("command rtt ms " + " ".join(f"p{k}={v:.1f}" for k, v in pct.items()))
+
+
+if __name__ == "__main__":
+    main()
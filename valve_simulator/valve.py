@@ -5,7 +5,12 @@ import json
 import sys
 import logging
 
+from thermostat.logging_config import log_reading, setup_logging
+from thermostat.mqtt import codec
+
 logger = logging.getLogger(__name__)
+# riga per ogni pubblicazione, campionata per valvola (logging_config.log_reading)
+readings_logger = logging.getLogger("valve_simulator.readings")
 
 # parametri broker
 BROKER = "localhost"
@@ -21,11 +26,12 @@ def parse_args():
 
 
 def on_message(client, userdata, msg):
-    # callback per ricevere comandi (es. heating on/off)
+    # callback per ricevere comandi (es. heating on/off), in JSON o binari
     try:
-        payload = json.loads(msg.payload.decode())
+        command_codec = codec.detect(msg.payload)
+        heating = command_codec.decode_command(msg.payload)
     except Exception:
-        payload = {}
+        command_codec, heating = None, None
 
     parts = msg.topic.split("/")
     # ci aspettiamo topic del tipo: home/valves/{id}/command
@@ -34,12 +40,15 @@ def on_message(client, userdata, msg):
         valves = userdata.get("valves", {}) if userdata else {}
         if vid in valves:
             # aggiorna lo stato 'heating' della valvola corrispondente
-            valves[vid]["heating"] = bool(payload.get("heating"))
+            valves[vid]["heating"] = bool(heating)
+            if command_codec is not None:
+                # la telemetria segue il codec scelto dal controller per i comandi
+                valves[vid]["codec"] = command_codec
             logger.info("[VALVE_SIM] Command on %s: set heating=%s", vid, valves[vid]["heating"])
         else:
             logger.info("[VALVE_SIM] Command on unknown valve %s", vid)
     else:
-        logger.info("[VALVE_SIM] Command on %s: %s", msg.topic, payload)
+        logger.info("[VALVE_SIM] Command on %s: %s", msg.topic, heating)
 
 
 def start_simulator(valve_ids):
@@ -57,7 +66,7 @@ def start_simulator(valve_ids):
     # inizializziamo gli stati e pubblichiamo l'annuncio retained per ogni valvola
     for vid in valve_ids:
         valves_state[vid] = {"heating": False, "temp": round(random.uniform(18.0, 22.0), 2)}
-        ann = {"id": vid, "ts": time.time(), "proto": "sim"}
+        ann = {"id": vid, "ts": time.time(), "proto": "sim", "codecs": list(codec.CODECS)}
         client.publish(f"home/valves/{vid}/announce", json.dumps(ann), retain=True)
 
     try:
@@ -75,10 +84,15 @@ def start_simulator(valve_ids):
                 # afferra nel range [5,35] e arrotonda
                 state["temp"] = round(max(5.0, min(35.0, state["temp"])), 2)
 
-                payload = {"value": state["temp"]}
+                # "ts" permette al controller di misurare la latenza pubblicazione -> comando
+                payload = state.get("codec", codec.JSON).encode_temperature(state["temp"], time.time())
                 topic = f"home/valves/{vid}/temperature"
-                client.publish(topic, json.dumps(payload))
-                logger.info("[VALVE_SIM] %s published temperature: %s (heating=%s)", vid, state["temp"], state["heating"])
+                client.publish(topic, payload)
+                if readings_logger.isEnabledFor(logging.INFO) and log_reading(vid):
+                    readings_logger.info(
+                        "[VALVE_SIM] %s published temperature: %s (heating=%s)", vid, state["temp"], state["heating"],
+                        extra={"valve_id": vid},
+                    )
                 # breve pausa per distribuire i timestamp
                 time.sleep(0.5)
             # pausa tra un giro completo e il successivo
@@ -90,5 +104,7 @@ def start_simulator(valve_ids):
 
 
 if __name__ == "__main__":
+    # solo console: il file di log è del controller
+    setup_logging(log_file=None)
     ids = parse_args()
     start_simulator(ids)